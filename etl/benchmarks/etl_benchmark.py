@@ -0,0 +1,250 @@
+"""
+End-to-end benchmark of the ETL without the real sites and the OpenAI API.
+
+Runs scraper.main() against a local fixture server replaying the saved pages of all sources, with deterministic fake
+embeddings, tokens estimated from the length of texts and an in-process Chroma instead of the server, so no network access
+is needed. Reports pages and events per second, peak memory and the
+time spent in every stage. Unless the crawl limits are set in the environment, the crawler is not slowed down to
+protect the sites, so the scraper's own code is measured.
+
+Save the results of a commit with --output and compare another commit to them with --baseline.
+
+Usage:
+    python benchmarks/etl_benchmark.py [--events 200] [--latency 0.05] [--error-rate 0.02] [--output results.json]
+    python benchmarks/etl_benchmark.py --baseline results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from fixture_server import build_corpus, get_fixture_path, run_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The crawl limits are read when the scheduler is created, the ones set in the environment take precedence.
+# The saved events have long ended, so they are not pruned unless a grace period is set.
+for name, value in {
+    "CRAWL_INITIAL_CONCURRENCY": "16",
+    "CRAWL_MAX_CONCURRENCY": "16",
+    "CRAWL_INITIAL_RATE": "10000",
+    "CRAWL_MAX_RATE": "10000",
+    "EVENT_PRUNE_GRACE_HOURS": str(100 * 365 * 24),
+}.items():
+    os.environ.setdefault(name, value)
+
+import chromadb  # noqa: E402
+import scraper  # noqa: E402
+import vector_saver  # noqa: E402
+from crawl_scheduler import CrawlScheduler  # noqa: E402
+from embedding_cache import CachedEmbeddings  # noqa: E402
+from event_store import EventStore  # noqa: E402
+from frontier import Frontier  # noqa: E402
+from http_cache import HttpCache  # noqa: E402
+from http_client import ConnectionStats, create_client_session  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings answering after a fixed delay, in place of a request to the embedding API.
+    """
+
+    latency: float = 0.0
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency)
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return self.embed_query(text)
+
+
+class FixtureSession:
+    """
+    Sends the requests of the real client session to the fixture server instead of the sites, so that the connection pool,
+    headers and compression of the ETL are measured as they are.
+    """
+
+    def __init__(self, session, server_url: str) -> None:
+        self.session = session
+        self.server_url = server_url
+
+    def get(self, url: str, **kwargs):
+        return self.session.get(self.server_url + get_fixture_path(url), **kwargs)
+
+    async def __aenter__(self) -> "FixtureSession":
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.session.__aexit__(*exc_info)
+
+
+def redirect_to_fixture_server(server_url: str) -> None:
+    """
+    Makes the scraper send its requests to the fixture server. Crawl workers are started fresh, so they call it as well.
+    :param server_url: URL of the fixture server
+    """
+    scraper.create_client_session = lambda headers, stats: FixtureSession(create_client_session(headers, stats), server_url)
+
+
+def configure_scraper(
+    work_dir: str, server_url: str, listing_urls: list[str], embeddings: FakeEmbeddings, workers: int
+) -> None:
+    """
+    Sets up the scraper module the way its __main__ block does, with every file kept in the work directory.
+    :param work_dir: Temporary directory for the event store, caches and the run report
+    :param server_url: URL of the fixture server
+    :param listing_urls: Listing URLs to scrape
+    :param embeddings: Embeddings used instead of the OpenAI API
+    :param workers: Number of processes crawling the sources
+    """
+    chroma_client = chromadb.EphemeralClient(settings=chromadb.Settings(anonymized_telemetry=False))
+    vector_saver.create_chroma_client = lambda: chroma_client
+    vector_saver.create_embedding_function = lambda: CachedEmbeddings(
+        embeddings, "text-embedding-3-small", os.path.join(work_dir, "embeddings.sqlite3")
+    )
+    # The tokenizer would download its vocabulary
+    vector_saver.create_token_counter = lambda model: vector_saver.estimate_tokens
+    redirect_to_fixture_server(server_url)
+    scraper.worker_setup = functools.partial(redirect_to_fixture_server, server_url)
+    os.environ["ETL_RUN_REPORT_PATH"] = os.path.join(work_dir, "run_report.json")
+
+    scraper.OUTPUT_DIR = os.path.join(work_dir, "data")
+    os.makedirs(scraper.OUTPUT_DIR)
+    scraper.frontier = Frontier(os.path.join(work_dir, "frontier.sqlite3"))
+    scraper.vector_storage = vector_saver.create_new_vector_storage()
+    scraper.event_store = EventStore(os.path.join(scraper.OUTPUT_DIR, "events.sqlite3"))
+    scraper.URLS = listing_urls
+    scraper.HEADERS = {"User-Agent": "etl-benchmark"}
+    scraper.connection_stats = ConnectionStats()
+    scraper.scheduler = CrawlScheduler()
+    scraper.http_cache = HttpCache(work_dir)
+    scraper.EVENT_REFRESH_AGE = 0
+    scraper.WORKERS = workers
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results: dict[str], baseline: dict[str]) -> None:
+    print(f"\nCompared to {baseline.get('commit') or 'the baseline'}:")
+    print(f"{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    metrics = [
+        (name, baseline["metrics"][name], value) for name, value in results["metrics"].items() if name in baseline["metrics"]
+    ]
+    metrics += [
+        (f"stage {stage}", baseline["stages"][stage], seconds)
+        for stage, seconds in results["stages"].items()
+        if stage in baseline["stages"]
+    ]
+    for name, baseline_value, value in metrics:
+        change = f"{(value - baseline_value) / baseline_value:+.1%}" if baseline_value else "-"
+        print(f"{name:<28}{baseline_value:>12.2f}{value:>12.2f}{change:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the whole ETL against a local fixture server")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+    parser.add_argument("--events", type=int, default=200, help="Number of events listed by every source")
+    parser.add_argument("--page-size", type=int, default=20, help="Number of events on a paged listing page")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean response delay of the server in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum deviation of the response delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of the injected errors")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Delay of every embedding request in seconds")
+    parser.add_argument("--embedding-size", type=int, default=1536, help="Size of the fake embeddings")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes crawling the sources")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path of the JSON file to save the results to")
+    parser.add_argument("--baseline", help="Path of the JSON results of an earlier run to compare to")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the ETL instead of saving it to a log")
+    args = parser.parse_args()
+
+    pages, listing_urls = build_corpus(args.fixtures, args.events, args.page_size, args.seed)
+    fault_options = (args.latency, args.jitter, args.error_rate, args.error_status, args.seed)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(target=run_server, args=(sender, pages, *fault_options), daemon=True)
+    server.start()
+    server_url = receiver.recv()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_scraper(
+            work_dir,
+            server_url,
+            listing_urls,
+            FakeEmbeddings(size=args.embedding_size, latency=args.embedding_latency),
+            args.workers,
+        )
+        log_path = os.path.join(work_dir, "etl.log")
+        with open(log_path, "w", encoding="utf-8") as log, contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+            start_time = time.perf_counter()
+            asyncio.run(scraper.main())
+            duration = time.perf_counter() - start_time
+        with open(os.environ["ETL_RUN_REPORT_PATH"], encoding="utf-8") as f:
+            run_report = json.load(f)
+
+    # Parser processes have already finished, so their peak memory is known, the server is left out
+    own_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    server.terminate()
+    server.join()
+
+    requests = sum(host.get("requests", 0) for host in run_report["hosts"].values())
+    events = run_report["counters"].get("events_scraped", 0)
+    results = {
+        "commit": get_commit(),
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("output", "baseline", "verbose")},
+        "metrics": {
+            "duration_seconds": duration,
+            "pages_per_second": requests / duration,
+            "events_per_second": events / duration,
+            "pages": requests,
+            "events": events,
+            "events_indexed": run_report["counters"].get("events_indexed", 0),
+            "failed_requests": sum(host.get("failed_requests", 0) for host in run_report["hosts"].values()),
+            "retries": sum(host.get("retries", 0) for host in run_report["hosts"].values()),
+            "peak_rss_mb": own_rss,
+            "peak_parser_rss_mb": child_rss,
+        },
+        "stages": {stage: stats["seconds"] for stage, stats in run_report["stages"].items()},
+    }
+
+    print(f"Scraped {len(listing_urls)} sources, {len(pages)} pages served by {server_url}")
+    for name, value in results["metrics"].items():
+        print(f"{name:<28}{value:>12.2f}")
+    print("Stages (total time summed over concurrent operations):")
+    for stage, seconds in sorted(results["stages"].items(), key=lambda item: -item[1]):
+        print(f"  {stage:<26}{seconds:>12.2f}")
+    print("Requests per site:")
+    for host, host_report in run_report["hosts"].items():
+        print(f"  {host:<26}{host_report.get('requests', 0):>12}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
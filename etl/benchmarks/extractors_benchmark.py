@@ -0,0 +1,101 @@
+"""
+Microbenchmark of the field extraction on saved event pages.
+
+Compares the single-pass DocumentIndex used by the extractors with looking up every field with its own find() call,
+which walks the document again for every field. Pages are parsed once up front, so only the extraction is measured.
+
+Usage:
+    python benchmarks/extractors_benchmark.py [--fixtures benchmarks/fixtures] [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extractors  # noqa: E402
+from extractors import CROSSWEB_LABEL, DocumentIndex, Field, Selector, extract_fields  # noqa: E402
+
+# Declarative fields and label selector of every event extractor
+EXTRACTOR_FIELDS: dict[str, tuple[dict[str, Field], Optional[Selector]]] = {
+    "extract_crossweb_event": (extractors.CROSSWEB_FIELDS, CROSSWEB_LABEL),
+    "extract_unikon_event": (extractors.UNIKON_FIELDS, None),
+    "extract_brite_event": (extractors.BRITE_FIELDS, None),
+}
+
+
+def find_field_tag(soup: BeautifulSoup, field: Field, label_selector: Optional[Selector]) -> Optional[Tag]:
+    # One search of the whole document per field, the way the extractors used to work
+    if field.label is not None:
+        label = soup.find(label_selector.name, attrs=dict(label_selector.attrs), string=field.label)
+        return label.find_next_sibling(label_selector.name) if label else None
+    matches = soup.find_all(field.selector.name, attrs=dict(field.selector.attrs), limit=field.index + 1)
+    return matches[field.index] if len(matches) > field.index else None
+
+
+def extract_with_find(soup: BeautifulSoup, fields: dict[str, Field], label_selector: Optional[Selector]) -> dict[str]:
+    event_details = {}
+    for name, field in fields.items():
+        tag = find_field_tag(soup, field, label_selector)
+        if tag is None:
+            event_details[name] = "N/A"
+        elif field.attribute is not None:
+            event_details[name] = tag[field.attribute].strip() if tag.has_attr(field.attribute) else "N/A"
+        else:
+            event_details[name] = tag.text.strip()
+    return event_details
+
+
+def extract_with_index(soup: BeautifulSoup, fields: dict[str, Field], label_selector: Optional[Selector]) -> dict[str]:
+    document_index = DocumentIndex(soup, [field.selector for field in fields.values() if field.selector], label_selector)
+    return extract_fields(document_index, fields)
+
+
+def measure(extract: Callable, soups: list[BeautifulSoup], fields: dict[str, Field], label_selector, repeat: int) -> float:
+    """
+    :return: Extracted pages per second
+    """
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for soup in soups:
+            extract(soup, fields, label_selector)
+    return repeat * len(soups) / (time.perf_counter() - start_time)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks field extraction on saved event pages")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.fixtures, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    print(f"{'extractor':<26}{'pages':>7}{'find() pages/s':>17}{'index pages/s':>16}{'speedup':>10}")
+    for extractor_name, (fields, label_selector) in EXTRACTOR_FIELDS.items():
+        bodies = []
+        for entry in manifest:
+            if entry["extractor"] == extractor_name:
+                with open(os.path.join(args.fixtures, entry["file"]), "rb") as f:
+                    bodies.append(f.read())
+        if not bodies:
+            continue
+
+        soups = [extractors.process_page(body, lambda soup, url: soup, "")[0] for body in bodies]
+        for soup in soups:
+            # Both ways have to extract the same details, otherwise the comparison is meaningless
+            assert extract_with_find(soup, fields, label_selector) == extract_with_index(soup, fields, label_selector)
+
+        find_rate = measure(extract_with_find, soups, fields, label_selector, args.repeat)
+        index_rate = measure(extract_with_index, soups, fields, label_selector, args.repeat)
+        print(f"{extractor_name:<26}{len(soups):>7}{find_rate:>17.0f}{index_rate:>16.0f}{index_rate / find_rate:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
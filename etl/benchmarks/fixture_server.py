@@ -0,0 +1,208 @@
+"""
+Local HTTP server replaying the saved listing and event pages of all scraped sites, used by etl_benchmark.py.
+
+Every saved event page is turned into many distinct events by numbering its title and shuffling the words of its
+description, so that they are neither merged as duplicates nor served from the embedding cache. The corpus only depends
+on the fixtures and the seed, so runs on different commits scrape exactly the same pages.
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+from collections import defaultdict
+from multiprocessing.connection import Connection
+from string import Template
+from typing import Callable, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extractors  # noqa: E402
+
+
+class Source(NamedTuple):
+    """
+    Listing of a site as it is given in SCRAPING_URLS and how its listing pages link to the events.
+    """
+
+    listing_url: str
+    listing_template: str
+    # Link to an event in the listing, formatted with the event's URL, path and title
+    event_link: str
+    # URL of the listing page with the given number, only set for sites whose listings are paged
+    page_url: Optional[Callable[[str, int], str]] = None
+    # Navigation links of the listing page with the given number out of the given count
+    navigation: Optional[Callable[[str, int, int], str]] = None
+
+
+def get_unikon_navigation(listing_url: str, page_index: int, page_count: int) -> str:
+    links = []
+    if page_index > 1:
+        links.append(f'<a class="n-p" href="{urlsplit(listing_url).path},s{page_index - 1}">Poprzednie</a>')
+    if page_index < page_count:
+        links.append(f'<a class="n-p" href="{urlsplit(listing_url).path},s{page_index + 1}">Następne</a>')
+    return "\n".join(links)
+
+
+# Sources by the extractor of their event pages in the fixtures manifest
+SOURCES = {
+    "extract_crossweb_event": Source(
+        "https://crossweb.pl/wydarzenia/",
+        "crossweb/listing.html",
+        '<a class="clearfix" href="{path}">{title}</a>',
+    ),
+    "extract_unikon_event": Source(
+        "https://unikonferencje.pl/konferencje/informatyka_teoretyczna",
+        "unikonferencje/listing.html",
+        '<a property="url" href="{path}">{title}</a>',
+        lambda listing_url, page_index: f"{listing_url},s{page_index}",
+        get_unikon_navigation,
+    ),
+    # Eventbrite lists all events on a single page
+    "extract_brite_event": Source(
+        "https://www.eventbrite.com/d/poland/science-and-tech--events/?page=1",
+        "eventbrite/listing.html",
+        '<li><a class="event-card-link" href="{url}">{title}</a></li>',
+    ),
+}
+
+
+def get_fixture_path(url: str) -> str:
+    """
+    Maps a URL of any of the scraped sites to the path under which the fixture server serves it.
+    :param url: URL of a listing or event page
+    :return: Path starting with the host of the URL, including the query string
+    """
+    parts = urlsplit(url)
+    return f"/{parts.hostname}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+
+def get_variant_url(url: str, index: int) -> str:
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/") + f"-{index}" + ("/" if parts.path.endswith("/") else "")
+    return parts._replace(path=path).geturl()
+
+
+def build_corpus(fixtures_dir: str, events_per_source: int, page_size: int, seed: int) -> tuple[dict[str, bytes], list[str]]:
+    """
+    Generates the listing and event pages of every source from the saved pages.
+    :param fixtures_dir: Directory with manifest.json and the saved pages
+    :param events_per_source: Number of events listed by every source
+    :param page_size: Number of events on a single listing page of sources whose listings are paged
+    :param seed: Seed of the shuffled descriptions
+    :return: Tuple of the page bodies by their fixture paths and the listing URLs to scrape
+    """
+    with open(os.path.join(fixtures_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    pages: dict[str, bytes] = {}
+    listing_events: dict[str, list[tuple[str, str]]] = defaultdict(list)
+    for entry in manifest:
+        if entry["extractor"] not in SOURCES:
+            continue
+        with open(os.path.join(fixtures_dir, entry["file"]), "rb") as f:
+            body = f.read()
+        extract_event = getattr(extractors, entry["extractor"])
+        event_details = extractors.process_page(body, extract_event, entry["url"])[0]
+        title, description = event_details["event_title"], event_details["event_description"]
+        text = body.decode("utf-8")
+
+        for index in range(1, events_per_source + 1):
+            words = description.split()
+            random.Random(f"{seed}:{entry['url']}:{index}").shuffle(words)
+            variant_url = get_variant_url(entry["url"], index)
+            variant_title = f"{title} {index}"
+            variant_text = text.replace(description, " ".join(words)).replace(title, variant_title)
+            pages[get_fixture_path(variant_url)] = variant_text.encode("utf-8")
+            listing_events[entry["extractor"]].append((variant_url, variant_title))
+
+    listing_urls = []
+    for extractor_name, source in SOURCES.items():
+        events = listing_events[extractor_name]
+        if not events:
+            continue
+        with open(os.path.join(fixtures_dir, source.listing_template), encoding="utf-8") as f:
+            listing_template = Template(f.read())
+
+        if source.page_url is None:
+            page_count = 1
+        else:
+            # A listing page without navigation is taken for one followed by another page, so the last page always
+            # links back to the previous one
+            page_count = max(2, math.ceil(len(events) / page_size))
+        for page_index in range(1, page_count + 1):
+            page_events = events if source.page_url is None else events[(page_index - 1) * page_size : page_index * page_size]
+            event_links = "\n".join(
+                source.event_link.format(url=url, path=urlsplit(url).path, title=title) for url, title in page_events
+            )
+            navigation = source.navigation(source.listing_url, page_index, page_count) if source.navigation else ""
+            page_url = source.listing_url if source.page_url is None else source.page_url(source.listing_url, page_index)
+            page = listing_template.substitute(events=event_links, navigation=navigation)
+            pages[get_fixture_path(page_url)] = page.encode("utf-8")
+        listing_urls.append(source.listing_url)
+
+    return pages, listing_urls
+
+
+def create_app(
+    pages: dict[str, bytes], latency: float, jitter: float, error_rate: float, error_status: int, seed: int
+) -> web.Application:
+    """
+    Creates the fixture server. Delays and errors are drawn from a generator seeded with the path and the number of
+    earlier requests for it, so they do not depend on the order in which concurrent requests arrive.
+    :param pages: Page bodies by their fixture paths
+    :param latency: Mean delay of a response in seconds
+    :param jitter: Maximum deviation of the delay from the mean in seconds
+    :param error_rate: Fraction of requests answered with an error
+    :param error_status: HTTP status of the injected errors
+    :param seed: Seed of the delays and errors
+    :return: aiohttp web application
+    """
+    request_counts: dict[str, int] = defaultdict(int)
+
+    async def serve_page(request: web.Request) -> web.StreamResponse:
+        path = request.path_qs
+        request_counts[path] += 1
+        generator = random.Random(f"{seed}:{path}:{request_counts[path]}")
+        delay = latency + generator.uniform(-jitter, jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if generator.random() < error_rate:
+            return web.Response(status=error_status)
+        if path not in pages:
+            return web.Response(status=404)
+
+        response = web.Response(body=pages[path], content_type="text/html", charset="utf-8")
+        # The sites compress their pages, so decompression is part of the measured work
+        response.enable_compression()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", serve_page)
+    return app
+
+
+def run_server(connection: Connection, pages: dict[str, bytes], *fault_options) -> None:
+    """
+    Runs the fixture server on a free port until the process is terminated, meant to be the target of a separate
+    process, so that serving pages does not compete with the scraper for its event loop.
+    :param connection: Pipe to which the URL of the server is sent once it is listening
+    :param pages: Page bodies by their fixture paths
+    :param fault_options: Latency, jitter, error rate, error status and seed passed to create_app()
+    """
+
+    async def serve() -> None:
+        runner = web.AppRunner(create_app(pages, *fault_options), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        connection.send(f"http://{host}:{port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
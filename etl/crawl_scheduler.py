@@ -0,0 +1,329 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+
+# Responses that mean the site asks us to slow down
+THROTTLING_STATUSES = (429, 503)
+
+
+def is_host_failure(status: Optional[int]) -> bool:
+    """
+    :return: Whether a response with the status, None if no response was received, tells that the host is unhealthy.
+        Missing pages do not, and neither does throttling, which the limits already back off on.
+    """
+    return status is None or (status >= 500 and status not in THROTTLING_STATUSES)
+
+
+class RequestSlot:
+    """
+    Outcome of a single request made inside CrawlScheduler.request(), filled in by the caller.
+    """
+
+    def __init__(self) -> None:
+        self.status: Optional[int] = None
+        self.retry_after: Optional[str] = None
+        # Whether the request probes a host whose circuit breaker was open, set by the scheduler
+        self.probe = False
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to a host whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a host once too many of its recently requested URLs failed even after their retries, so that a dead
+    site fails fast instead of every queued URL spending its whole retry budget on it. Throttling does not count as a
+    failure, a site that only asks us to slow down is paced by its HostLimiter instead. After a cool-down a single probe request is let through
+    while the other requests wait for its outcome: the circuit closes again if it succeeds and stays open for another
+    cool-down if it fails.
+    """
+
+    def __init__(self, host: str, window: int, min_requests: int, error_rate: float, open_seconds: float) -> None:
+        self.host = host
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        # Whether each of the recent requests failed
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        # Set while the circuit is open
+        self.opened_until: Optional[float] = None
+        self.probing = False
+
+        self.times_opened = 0
+        self.rejected = 0
+
+    def is_open(self) -> bool:
+        return self.opened_until is not None and time.monotonic() < self.opened_until
+
+    def check(self) -> bool:
+        """
+        Lets a request through or raises CircuitOpenError during the cool-down.
+        :return: Whether the request is the probe, which is the first request after the cool-down
+        """
+        if self.opened_until is None:
+            return False
+        if self.is_open():
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit breaker of {self.host} is open")
+        self.probing = True
+        return True
+
+    def record(self, failed: bool, probe: bool) -> None:
+        if probe:
+            self.probing = False
+            if failed:
+                self._open()
+            else:
+                print(f"Circuit breaker of {self.host} closed")
+                self.opened_until = None
+                self.outcomes.clear()
+            return
+        # Requests that were already in flight when the circuit opened do not change it
+        if self.opened_until is not None:
+            return
+
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_requests and sum(self.outcomes) >= self.error_rate * len(self.outcomes):
+            self._open()
+
+    def _open(self) -> None:
+        self.opened_until = time.monotonic() + self.open_seconds
+        self.times_opened += 1
+        print(f"Circuit breaker of {self.host} opened for {self.open_seconds:.0f} seconds")
+
+
+class HostLimiter:
+    """
+    Limits the load put on a single host with a concurrency window and a token bucket.
+    Both limits adapt AIMD-style: they grow additively while the host answers quickly and are cut multiplicatively
+    when it slows down, throttles us (429/503) or drops the connection.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        min_concurrency: int,
+        max_concurrency: int,
+        initial_concurrency: int,
+        rate: float,
+        max_rate: float,
+        target_latency: float,
+        circuit_breaker: CircuitBreaker,
+    ) -> None:
+        self.host = host
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(initial_concurrency)
+        self.min_rate = 0.2
+        self.max_rate = max_rate
+        self.rate = rate
+        self.target_latency = target_latency
+        self.circuit_breaker = circuit_breaker
+
+        self.active = 0
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.condition = asyncio.Condition()
+
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+
+    async def acquire(self) -> bool:
+        """
+        Waits until the host has a free concurrency slot and a rate-limit token.
+        Raises CircuitOpenError without waiting if the host's circuit breaker is open.
+        :return: Whether the request probes the host after its circuit breaker was open
+        """
+        async with self.condition:
+            # While the probe is in flight, the other requests wait for its outcome instead of being rejected
+            await self.condition.wait_for(lambda: self.active < int(self.concurrency) and not self.circuit_breaker.probing)
+            probe = self.circuit_breaker.check()
+            self.active += 1
+
+        try:
+            await self._take_token()
+        except BaseException:
+            # Give the slot back if the waiting request got cancelled, the next request becomes the probe then
+            async with self.condition:
+                self.active -= 1
+                if probe:
+                    self.circuit_breaker.probing = False
+                self.condition.notify_all()
+            raise
+        return probe
+
+    async def _take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+            elif self.tokens >= 1:
+                self.tokens -= 1
+                return
+            else:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def release(self, latency: float, slot: RequestSlot) -> None:
+        """
+        Frees the slot and adapts the limits to the outcome of the request.
+        :param latency: Time the request took in seconds
+        :param slot: RequestSlot with the response status, left empty if no response was received
+        """
+        async with self.condition:
+            self.active -= 1
+            self.requests += 1
+            # The probe decides on its own whether the circuit closes, other requests are recorded once per URL after
+            # their retries by CrawlScheduler.record_outcome()
+            if slot.probe:
+                self.circuit_breaker.record(is_host_failure(slot.status), probe=True)
+
+            if slot.status in THROTTLING_STATUSES:
+                self.throttled += 1
+                self._decrease(0.5)
+                self._block(slot.retry_after)
+            elif slot.status is None:
+                self.failed += 1
+                self._decrease(0.75)
+            elif latency > self.target_latency:
+                self._decrease(0.9)
+            else:
+                # Additive increase of roughly one slot per full window of fast responses
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + 0.1)
+
+            self.condition.notify_all()
+
+    def _decrease(self, factor: float) -> None:
+        self.concurrency = max(self.min_concurrency, self.concurrency * factor)
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def _block(self, retry_after: Optional[str]) -> None:
+        # Only the delay-seconds form of Retry-After is honoured, HTTP dates are rare on these sites
+        if retry_after and retry_after.strip().isdigit():
+            self.blocked_until = max(self.blocked_until, time.monotonic() + int(retry_after.strip()))
+
+    def report(self) -> str:
+        return (
+            f"{self.host}: {self.requests} requests, {self.throttled} throttled, {self.failed} failed, "
+            f"final concurrency {int(self.concurrency)}, final rate {self.rate:.1f} req/s, "
+            f"circuit opened {self.circuit_breaker.times_opened} times, {self.circuit_breaker.rejected} requests rejected"
+        )
+
+
+class CrawlScheduler:
+    """
+    Keeps one adaptive HostLimiter per domain, so that every site is crawled as fast as it tolerates
+    independently of the others, and a site that is down does not slow down the crawl of the others.
+    When several processes crawl the same sites, every one of them gets an equal share of the limits, so that together
+    they do not load a site more than a single process would.
+    """
+
+    def __init__(self, shares: int = 1) -> None:
+        self.min_concurrency = int(os.getenv("CRAWL_MIN_CONCURRENCY", "1"))
+        self.max_concurrency = max(self.min_concurrency, int(os.getenv("CRAWL_MAX_CONCURRENCY", "16")) // shares)
+        self.initial_concurrency = max(self.min_concurrency, int(os.getenv("CRAWL_INITIAL_CONCURRENCY", "4")) // shares)
+        self.initial_rate = float(os.getenv("CRAWL_INITIAL_RATE", "2")) / shares
+        self.max_rate = float(os.getenv("CRAWL_MAX_RATE", "20")) / shares
+        self.target_latency = float(os.getenv("CRAWL_TARGET_LATENCY", "2.5"))
+        self.queue_size = int(os.getenv("CRAWL_QUEUE_SIZE", "100"))
+        self.circuit_window = int(os.getenv("CIRCUIT_WINDOW", "20"))
+        self.circuit_min_requests = int(os.getenv("CIRCUIT_MIN_REQUESTS", "10"))
+        self.circuit_error_rate = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+        self.circuit_open_seconds = float(os.getenv("CIRCUIT_OPEN_SECONDS", "60"))
+        self.hosts: dict[str, HostLimiter] = {}
+
+    def limiter(self, url: str) -> HostLimiter:
+        host = urlsplit(url).hostname or ""
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(
+                host,
+                self.min_concurrency,
+                self.max_concurrency,
+                self.initial_concurrency,
+                self.initial_rate,
+                self.max_rate,
+                self.target_latency,
+                CircuitBreaker(
+                    host, self.circuit_window, self.circuit_min_requests, self.circuit_error_rate, self.circuit_open_seconds
+                ),
+            )
+        return self.hosts[host]
+
+    def record_outcome(self, url: str, failed: bool) -> None:
+        """
+        Records in the circuit breaker of the URL's host whether the URL could be fetched, once all retries are done.
+        :param url: URL that was requested
+        :param failed: Whether the host failed to serve it, see is_host_failure()
+        """
+        self.limiter(url).circuit_breaker.record(failed, probe=False)
+
+    @asynccontextmanager
+    async def request(self, url: str) -> AsyncIterator[RequestSlot]:
+        """
+        Holds a slot of the URL's host for the duration of one request.
+        The caller should set the status and Retry-After header of the response on the yielded RequestSlot.
+        Raises CircuitOpenError if the host's circuit breaker is open.
+        :param url: URL that is going to be requested
+        :return: RequestSlot describing the outcome of the request
+        """
+        limiter = self.limiter(url)
+        probe = await limiter.acquire()
+        slot = RequestSlot()
+        slot.probe = probe
+        start_time = time.perf_counter()
+        try:
+            yield slot
+        finally:
+            await limiter.release(time.perf_counter() - start_time, slot)
+
+    async def pipeline(
+        self, produce: Callable[[Callable[[str], Awaitable[None]]], Awaitable[None]], worker: Callable[[str], Awaitable[None]]
+    ) -> int:
+        """
+        Runs worker(url) for every URL produced, while the producer is still producing further URLs.
+        URLs are passed through a bounded queue to a bounded number of workers, so a producer that is faster than
+        the workers waits for them instead of piling up URLs. The number of requests actually in flight is further
+        limited by the hosts' adaptive limits.
+        :param produce: Coroutine function producing URLs, it gets an enqueue coroutine function to call for every URL
+        :param worker: Coroutine function processing a single URL
+        :return: Number of produced URLs
+        """
+        queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=self.queue_size)
+        produced = 0
+
+        async def enqueue(url: str) -> None:
+            nonlocal produced
+            produced += 1
+            await queue.put(url)
+
+        async def run_worker() -> None:
+            while (url := await queue.get()) is not None:
+                try:
+                    await worker(url)
+                except Exception as e:
+                    # A single broken URL must not stop the worker, otherwise the producer could wait for a free place forever
+                    print(f"Failed to process {url}: {e}")
+
+        workers = [asyncio.create_task(run_worker()) for _ in range(self.max_concurrency)]
+        try:
+            await produce(enqueue)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        return produced
+
+    def report(self) -> str:
+        return "\n".join(limiter.report() for limiter in self.hosts.values())
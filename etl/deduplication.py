@@ -0,0 +1,189 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+from itertools import combinations
+from typing import Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from text_utils import find_date_parts, fold_text
+
+SIMHASH_BITS = 64
+# Near duplicates differ in at most this many bits of their SimHash, with 4 bands of 16 bits every such pair shares a band
+SIMHASH_MAX_DISTANCE = 3
+SIMHASH_BANDS = 4
+# Buckets larger than this hold boilerplate shared by unrelated events and are not compared
+MAX_BUCKET_SIZE = 100
+
+YEAR = re.compile(r"\b(19|20)\d{2}\b")
+
+
+class DisjointSet:
+    """
+    Union-find of event IDs, used to group pairs of duplicates into clusters.
+    """
+
+    def __init__(self, items: Iterable[str]) -> None:
+        self.parents = {item: item for item in items}
+
+    def find(self, item: str) -> str:
+        while self.parents[item] != item:
+            self.parents[item] = self.parents[self.parents[item]]
+            item = self.parents[item]
+        return item
+
+    def union(self, first: str, second: str) -> None:
+        first_root, second_root = self.find(first), self.find(second)
+        if first_root != second_root:
+            # The smaller ID becomes the root, so that clusters do not depend on the order of the pairs
+            self.parents[max(first_root, second_root)] = min(first_root, second_root)
+
+    def clusters(self) -> List[List[str]]:
+        clusters = defaultdict(list)
+        for item in self.parents:
+            clusters[self.find(item)].append(item)
+        return list(clusters.values())
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercases text, strips Polish diacritics and punctuation, so that the same title written on different sites matches.
+    :param text: Text to normalize
+    :return: Normalized text with single spaces between words
+    """
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", fold_text(text)).split())
+
+
+def normalize_title(title: str) -> str:
+    # Years are often added to the title by only some of the sites
+    return " ".join(YEAR.sub(" ", normalize_text(title)).split())
+
+
+def get_date_key(event_details: dict[str]) -> Optional[str]:
+    """
+    Finds the day on which the event starts, in any of the date formats used by the scraped sites.
+    The year is left out, as not every site shows it.
+    :param event_details: Dictionary with event details
+    :return: Month and day of the event as MM-DD or None if no date was found
+    """
+    for field in ("event_date", "event_time"):
+        for _, month, day in find_date_parts(fold_text(event_details.get(field, ""))):
+            if 1 <= month <= 12 and 1 <= day <= 31:
+                return f"{month:02d}-{day:02d}"
+    return None
+
+
+def get_simhash(event_details: dict[str]) -> int:
+    """
+    Computes the SimHash of the title and description of an event. Texts that share most of their words get hashes
+    differing in only a few bits.
+    :param event_details: Dictionary with event details
+    :return: 64-bit SimHash
+    """
+    title_words = normalize_title(event_details.get("event_title", "")).split()
+    description = event_details.get("event_description", "N/A")
+    description_words = normalize_text(description).split() if description != "N/A" else []
+    # The title is weighted more, descriptions are often shortened or extended by the sites
+    features = Counter({f"title:{word}": 3 for word in title_words})
+    features.update(" ".join(pair) for pair in zip(description_words, description_words[1:]))
+
+    weights = [0] * SIMHASH_BITS
+    for feature, weight in features.items():
+        feature_hash = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += weight if feature_hash >> bit & 1 else -weight
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+
+def find_duplicate_events(events: dict[str, dict[str]]) -> List[List[str]]:
+    """
+    Groups events describing the same event, also when they come from different sites.
+    Events are duplicates if they have the same normalized title and start on the same day, or if their SimHashes are
+    nearly identical and their dates do not contradict each other. Candidates are found through hash buckets instead of
+    comparing every pair, so the time grows almost linearly with the number of events.
+    :param events: Details of every event by event ID
+    :return: Clusters of event IDs, events without duplicates form single-element clusters
+    """
+    disjoint_set = DisjointSet(sorted(events))
+    date_keys = {event_id: get_date_key(event_details) for event_id, event_details in events.items()}
+
+    key_buckets = defaultdict(list)
+    for event_id, event_details in events.items():
+        title = normalize_title(event_details.get("event_title", ""))
+        if title and date_keys[event_id] is not None:
+            key_buckets[(title, date_keys[event_id])].append(event_id)
+    for bucket in key_buckets.values():
+        for event_id in bucket[1:]:
+            disjoint_set.union(bucket[0], event_id)
+
+    simhashes = {event_id: get_simhash(event_details) for event_id, event_details in events.items()}
+    band_bits = SIMHASH_BITS // SIMHASH_BANDS
+    band_buckets = defaultdict(list)
+    for event_id, simhash in simhashes.items():
+        for band in range(SIMHASH_BANDS):
+            band_buckets[(band, simhash >> (band * band_bits) & ((1 << band_bits) - 1))].append(event_id)
+    for bucket in band_buckets.values():
+        if len(bucket) > MAX_BUCKET_SIZE:
+            continue
+        for first, second in combinations(bucket, 2):
+            if bin(simhashes[first] ^ simhashes[second]).count("1") <= SIMHASH_MAX_DISTANCE and (
+                date_keys[first] is None or date_keys[second] is None or date_keys[first] == date_keys[second]
+            ):
+                disjoint_set.union(first, second)
+
+    return disjoint_set.clusters()
+
+
+def merge_duplicate_events(events: dict[str, dict[str]], clusters: List[List[str]]) -> dict[str, dict[str]]:
+    """
+    Merges every cluster of duplicates into one canonical event.
+    The event with the most details is canonical, its missing details are filled in from the other copies and the URLs
+    of all copies are kept under "sources".
+    :param events: Details of every event by event ID
+    :param clusters: Clusters of event IDs returned by find_duplicate_events()
+    :return: Details of the canonical events by their event IDs
+    """
+    canonical_events = {}
+    for cluster in clusters:
+        copies = {
+            event_id: {key: value for key, value in events[event_id].items() if key != "sources"} for event_id in cluster
+        }
+        canonical_id = min(
+            cluster,
+            key=lambda event_id: (
+                -sum(value != "N/A" for value in copies[event_id].values()),
+                -len(copies[event_id].get("event_description", "")),
+                event_id,
+            ),
+        )
+        canonical_details = copies[canonical_id]
+        if len(cluster) > 1:
+            for event_id in sorted(cluster):
+                for key, value in copies[event_id].items():
+                    if canonical_details.get(key, "N/A") == "N/A" and value != "N/A":
+                        canonical_details[key] = value
+            canonical_details["sources"] = sorted(copies[event_id]["source"] for event_id in cluster)
+        canonical_events[canonical_id] = canonical_details
+    return canonical_events
+
+
+def report_duplicates(events: dict[str, dict[str]], clusters: List[List[str]]) -> str:
+    """
+    Describes how many events of every pair of sites are duplicates of each other.
+    :param events: Details of every event by event ID
+    :param clusters: Clusters of event IDs returned by find_duplicate_events()
+    :return: Report with one line per pair of sites with duplicates
+    """
+    source_events = Counter(urlsplit(event_details["source"]).hostname for event_details in events.values())
+    pair_duplicates = Counter()
+    for cluster in clusters:
+        sources = sorted(urlsplit(events[event_id]["source"]).hostname for event_id in cluster)
+        pair_duplicates.update(set(combinations(sources, 2)))
+
+    duplicate_count = sum(len(cluster) - 1 for cluster in clusters)
+    lines = [f"Deduplication: {len(events)} events, {duplicate_count} duplicates merged into {len(clusters)} events"]
+    for (first, second), count in sorted(pair_duplicates.items()):
+        lines.append(
+            f"  {first} - {second}: {count} duplicates "
+            f"({count / source_events[first]:.1%} of {first}, {count / source_events[second]:.1%} of {second})"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding function that remembers the vectors of already embedded texts in a local SQLite database.
+    Vectors are keyed by the model name and the hash of the text, so identical chunks repeated across events or runs
+    are sent to the embedding model only once.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache_path: str) -> None:
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        # Chroma calls the embedding function from executor threads, so the connection is shared behind a lock
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)")
+        self.connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        text_hashes, vectors, missing_texts = self._lookup(texts)
+        if missing_texts:
+            vectors.update(self._store(missing_texts, self.embeddings.embed_documents(list(missing_texts.values()))))
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        text_hashes, vectors, missing_texts = self._lookup(texts)
+        if missing_texts:
+            vectors.update(self._store(missing_texts, await self.embeddings.aembed_documents(list(missing_texts.values()))))
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        # Queries are rarely repeated, so they are not cached
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+    def _lookup(self, texts: list[str]) -> tuple[list[str], dict[str, list[float]], dict[str, str]]:
+        """
+        Finds cached vectors of the given texts with batched queries.
+        :param texts: Texts to embed
+        :return: Tuple of the hashes of all texts, the cached vectors by hash and the texts missing from the cache by hash
+        """
+        text_hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        unique_texts = dict(zip(text_hashes, texts))
+        vectors = {}
+
+        with self.lock:
+            unique_hashes = list(unique_texts)
+            # Stay below SQLite's limit of variables in a single query
+            for index in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[index : index + 500]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (self.model, *batch),
+                ).fetchall()
+                for text_hash, vector in rows:
+                    vectors[text_hash] = array("f", vector).tolist()
+                self.connection.execute(
+                    f"UPDATE embeddings SET accessed_at = ? WHERE model = ? AND text_hash IN ({placeholders})",
+                    (time.time(), self.model, *batch),
+                )
+            self.connection.commit()
+
+            missing_texts = {text_hash: text for text_hash, text in unique_texts.items() if text_hash not in vectors}
+            self.hits += len(texts) - len(missing_texts)
+            self.misses += len(missing_texts)
+        return text_hashes, vectors, missing_texts
+
+    def _store(self, missing_texts: dict[str, str], embedded_vectors: list[list[float]]) -> dict[str, list[float]]:
+        """
+        Saves freshly embedded vectors in the cache.
+        :param missing_texts: Embedded texts by hash
+        :param embedded_vectors: Vectors returned by the embedding model, in the same order as missing_texts
+        :return: Stored vectors by hash, with the same precision as vectors read from the cache
+        """
+        packed_vectors = {text_hash: array("f", vector) for text_hash, vector in zip(missing_texts, embedded_vectors)}
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, accessed_at) VALUES (?, ?, ?, ?)",
+                [(self.model, text_hash, vector.tobytes(), time.time()) for text_hash, vector in packed_vectors.items()],
+            )
+            self.connection.commit()
+        return {text_hash: vector.tolist() for text_hash, vector in packed_vectors.items()}
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used vectors above the maximum number of entries.
+        """
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.evict()
+        with self.lock:
+            self.connection.close()
+
+    def report(self) -> str:
+        requests = self.hits + self.misses
+        hit_ratio = self.hits / requests if requests else 0.0
+        return (
+            f"Embedding cache: {self.hits} hits, {self.misses} misses, {hit_ratio:.1%} hit ratio "
+            f"({self.misses} chunks sent to {self.model})"
+        )
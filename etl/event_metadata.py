@@ -0,0 +1,188 @@
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
+
+from text_utils import find_date_parts, fold_text, remove_dates
+
+# Version of the metadata stored with the vectors, events indexed with an older version get the new metadata in the next run
+METADATA_VERSION = 2
+
+# Dates and times on the scraped sites are in Polish time
+TIMEZONE = ZoneInfo("Europe/Warsaw")
+
+TIME = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?"
+TIME_RANGE = re.compile(rf"\b{TIME}\s*[-–]\s*{TIME}\b")
+SINGLE_TIME = re.compile(r"\b(\d{1,2}):(\d{2})\b|\b(\d{1,2})\s*(am|pm)\b")
+
+CITIES = [
+    "Warszawa",
+    "Kraków",
+    "Wrocław",
+    "Poznań",
+    "Gdańsk",
+    "Gdynia",
+    "Sopot",
+    "Łódź",
+    "Katowice",
+    "Gliwice",
+    "Lublin",
+    "Białystok",
+    "Szczecin",
+    "Bydgoszcz",
+    "Toruń",
+    "Rzeszów",
+    "Kielce",
+    "Olsztyn",
+    "Opole",
+    "Zielona Góra",
+    "Bielsko-Biała",
+    "Częstochowa",
+    "Radom",
+]
+FREE_FEE = re.compile(r"bezplat|darmow|\bfree\b|bez oplat")
+PAID_FEE = re.compile(r"[1-9]\d*(?:[.,]\d+)?\s*(?:zl|pln|eur|usd|\$|€)|platn|oplata")
+
+
+def find_dates(text: str, today: date) -> list[date]:
+    """
+    Finds all dates in a text in any of the formats used by the scraped sites, in the order in which they appear.
+    Dates without a year are taken for the nearest one that is not more than a month in the past, as the sites only list
+    upcoming events.
+    :param text: Folded text, see fold_text()
+    :param today: Day on which the event was scraped
+    :return: Dates found in the text
+    """
+    dates = []
+    for year, month, day in find_date_parts(text):
+        try:
+            if year:
+                dates.append(date(year, month, day))
+                continue
+            found_date = date(today.year, month, day)
+            if found_date < today - timedelta(days=31):
+                found_date = date(today.year + 1, month, day)
+            dates.append(found_date)
+        except ValueError:
+            continue
+    return dates
+
+
+def to_time(hour: str, minute: str, meridiem: str) -> Optional[time]:
+    hour_number = int(hour) % 12 + 12 if meridiem == "pm" else int(hour) % 12 if meridiem == "am" else int(hour)
+    if hour_number > 23 or int(minute or 0) > 59:
+        return None
+    return time(hour_number, int(minute or 0))
+
+
+def find_times(text: str) -> list[time]:
+    """
+    Finds the start and end time of an event, like "18:00 - 20:00", "6 - 9pm" or "18:00".
+    :param text: Folded text without dates
+    :return: Start and end time, only the start time or nothing
+    """
+    for match in TIME_RANGE.finditer(text):
+        start_hour, start_minute, start_meridiem, end_hour, end_minute, end_meridiem = match.groups()
+        # Bare numbers like "1 - 2" are not times
+        if not (start_minute or start_meridiem or end_minute or end_meridiem):
+            continue
+        # In "6 - 9pm" the meridiem of the end applies to the start as well
+        times = [
+            to_time(start_hour, start_minute, start_meridiem or end_meridiem),
+            to_time(end_hour, end_minute, end_meridiem),
+        ]
+        if None not in times:
+            return times
+    for match in SINGLE_TIME.finditer(text):
+        found_time = to_time(match[1], match[2], "") if match[1] else to_time(match[3], "", match[4])
+        if found_time is not None:
+            return [found_time]
+    return []
+
+
+def get_event_period(event_details: dict[str], scraped_at: datetime) -> Optional[tuple[datetime, datetime]]:
+    """
+    Parses when an event starts and ends from its date and time details. An event without an end date ends on the day it
+    starts, one without an end time lasts until the end of its last day.
+    :param event_details: Dictionary with event details
+    :param scraped_at: Time at which the event was scraped, used to complete dates without a year
+    :return: Start and end of the event in Polish time or None if no date was found
+    """
+    text = fold_text(" ".join(event_details.get(field, "N/A") for field in ("event_date", "event_time")))
+    dates = find_dates(text, scraped_at.date())
+    if not dates:
+        return None
+    times = find_times(remove_dates(text))
+
+    start_date, end_date = dates[0], max(dates[0], dates[1]) if len(dates) > 1 else dates[0]
+    start = datetime.combine(start_date, times[0] if times else time(0, 0), TIMEZONE)
+    if len(times) > 1:
+        end = datetime.combine(end_date, times[1], TIMEZONE)
+        # Events ending after midnight, like "20:00 - 2:00"
+        if end < start:
+            end += timedelta(days=1)
+    else:
+        end = datetime.combine(end_date, time(23, 59, 59), TIMEZONE)
+    return start, end
+
+
+def get_end_timestamp(event_details: dict[str], scraped_at: Optional[datetime] = None) -> Optional[int]:
+    """
+    :return: Unix timestamp of the end of the event or None if its date is not known
+    """
+    period = get_event_period(event_details, scraped_at or datetime.now(TIMEZONE))
+    return int(period[1].timestamp()) if period is not None else None
+
+
+def get_city(event_details: dict[str]) -> Optional[str]:
+    """
+    Finds the city of an event, from its city detail if the site has one and otherwise from its location.
+    :param event_details: Dictionary with event details
+    :return: City folded like fold_text() does, e.g. "krakow", "online" for online events or None if it is not known
+    """
+    city = event_details.get("event_city", "N/A")
+    if city != "N/A" and city.strip():
+        return fold_text(city.strip())
+
+    location = fold_text(" ".join(event_details.get(field, "N/A") for field in ("event_location", "event_location_address")))
+    for city in CITIES:
+        if re.search(rf"\b{re.escape(fold_text(city))}\b", location):
+            return fold_text(city)
+    if "online" in location:
+        return "online"
+    return None
+
+
+def is_free(event_details: dict[str]) -> Optional[bool]:
+    fee = fold_text(event_details.get("event_fee", "N/A"))
+    if FREE_FEE.search(fee):
+        return True
+    if PAID_FEE.search(fee):
+        return False
+    return None
+
+
+def get_event_metadata(event_details: dict[str], scraped_at: Optional[datetime] = None) -> dict[str]:
+    """
+    Normalizes the free-text details of an event into metadata the vector storage can filter on.
+    Start and end are stored both as ISO timestamps and as Unix timestamps, as only numbers can be compared in filters.
+    Details that could not be parsed are left out, Chroma does not accept empty metadata values.
+    :param event_details: Dictionary with event details
+    :param scraped_at: Time at which the event was scraped, now if not given
+    :return: Metadata with "start", "end", "start_ts", "end_ts", "city", "is_free" and "source_site"
+    """
+    metadata = {"source_site": urlsplit(event_details["source"]).hostname.removeprefix("www.")}
+    period = get_event_period(event_details, scraped_at or datetime.now(TIMEZONE))
+    if period is not None:
+        start, end = period
+        metadata.update(
+            start=start.isoformat(), end=end.isoformat(), start_ts=int(start.timestamp()), end_ts=int(end.timestamp())
+        )
+    city = get_city(event_details)
+    if city is not None:
+        metadata["city"] = city
+    free = is_free(event_details)
+    if free is not None:
+        metadata["is_free"] = free
+    return metadata
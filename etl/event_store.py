@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from event_metadata import TIMEZONE, get_end_timestamp
+
+
+class EventStore:
+    """
+    Details of all scraped events kept in a single SQLite database keyed by the stable event ID.
+    Writes are buffered and committed in bulk, and the frontend reads the details of many events with a single query.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        # WAL lets the frontend read the store while the ETL is writing to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                event_id TEXT PRIMARY KEY,
+                details TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                end_ts INTEGER
+            )
+            """
+        )
+        # Stores created before events had end times get the column, filled in from the details of the stored events
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(events)")]
+        if "end_ts" not in columns:
+            self.connection.execute("ALTER TABLE events ADD COLUMN end_ts INTEGER")
+            rows = self.connection.execute("SELECT event_id, details, updated_at FROM events").fetchall()
+            self.connection.executemany(
+                "UPDATE events SET end_ts = ? WHERE event_id = ?",
+                [
+                    (get_end_timestamp(json.loads(details), datetime.fromtimestamp(updated_at, TIMEZONE)), event_id)
+                    for event_id, details, updated_at in rows
+                ],
+            )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS events_end_ts ON events (end_ts)")
+        self.connection.commit()
+
+        self.batch_size = int(os.getenv("EVENT_STORE_BATCH_SIZE", "200"))
+        self.pending: dict[str, tuple[str, str, Optional[int]]] = {}
+
+    def put(self, event_id: str, event_details: dict[str], content_hash: str, end_ts: Optional[int] = None) -> None:
+        """
+        Adds or replaces the details of an event. They are written together with other events once the buffer is full.
+        :param event_id: Stable ID of the event
+        :param event_details: Dictionary with event details
+        :param content_hash: Hash of the event details
+        :param end_ts: Unix timestamp of the end of the event, None if it is not known
+        """
+        self.pending[event_id] = (
+            json.dumps(event_details, ensure_ascii=False, separators=(",", ":")),
+            content_hash,
+            end_ts,
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO events (event_id, details, content_hash, updated_at, end_ts) VALUES (?, ?, ?, ?, ?)",
+            [
+                (event_id, details, content_hash, now, end_ts)
+                for event_id, (details, content_hash, end_ts) in self.pending.items()
+            ],
+        )
+        self.connection.commit()
+        self.pending.clear()
+
+    def get_all(self) -> dict[str, dict[str]]:
+        self.flush()
+        rows = self.connection.execute("SELECT event_id, details FROM events").fetchall()
+        return {event_id: json.loads(details) for event_id, details in rows}
+
+    def delete(self, event_ids: Iterable[str]) -> None:
+        self.flush()
+        self.connection.executemany("DELETE FROM events WHERE event_id = ?", [(event_id,) for event_id in event_ids])
+        self.connection.commit()
+
+    def delete_ended(self, before_ts: float) -> List[str]:
+        """
+        Deletes all events that ended before the given time with a single statement. Events without a known end are kept.
+        :param before_ts: Unix timestamp, events ending earlier are deleted
+        :return: IDs of the deleted events
+        """
+        self.flush()
+        event_ids = [
+            row[0] for row in self.connection.execute("SELECT event_id FROM events WHERE end_ts < ?", (before_ts,)).fetchall()
+        ]
+        self.connection.execute("DELETE FROM events WHERE end_ts < ?", (before_ts,))
+        self.connection.commit()
+        return event_ids
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
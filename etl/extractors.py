@@ -0,0 +1,353 @@
+import os
+import re
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+import ftfy
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+# Bump whenever the extract_* functions change, so that details cached by older versions are not reused
+EXTRACTION_VERSION = 2
+
+# "lxml" is considerably faster than the default parser, but it may build a slightly different tree from broken HTML
+HTML_PARSER = os.getenv("HTML_PARSER", "html.parser")
+
+
+def process_page(
+    body: bytes, extract: Callable[[BeautifulSoup, str], object], url: str, strainer: Optional[SoupStrainer] = None
+) -> tuple[object, dict[str, float]]:
+    """
+    Decodes, parses and extracts data from a page. Meant to be run in a worker process, so that CPU-bound parsing
+    does not block the downloads running on the event loop.
+    :param body: Raw body of the page
+    :param extract: Function extracting data from the parsed page
+    :param url: URL of the page
+    :param strainer: Tags the extract function needs, only they are built, None to build the whole document
+    :return: Tuple of the data returned by the extract function and the seconds spent decoding, parsing and extracting
+    """
+    start_time = time.perf_counter()
+    try:
+        page_text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        page_text = body.decode("utf-8", errors="replace")
+        page_text = ftfy.fix_text(page_text)
+    page_text = re.sub(r"\s+", " ", page_text)
+    decoded_time = time.perf_counter()
+
+    soup: BeautifulSoup = BeautifulSoup(page_text, HTML_PARSER, parse_only=strainer)
+    parsed_time = time.perf_counter()
+
+    extracted = extract(soup, url)
+    timings = {
+        "decode": decoded_time - start_time,
+        "parse": parsed_time - decoded_time,
+        "extract": time.perf_counter() - parsed_time,
+    }
+    return extracted, timings
+
+
+def extract_unikon_listing(event_list_soup: BeautifulSoup, url: str) -> tuple[List[str], bool]:
+    """
+    Extracts event URLs from a listing page on unikonferencje.pl.
+    :param event_list_soup: BeautifulSoup object of the listing page
+    :param url: URL of the listing page
+    :return: Tuple of the event URLs and whether there is a next listing page
+    """
+    event_urls = [anchor["href"] for anchor in event_list_soup.find_all("a", property="url")]
+
+    nav_anchors: List[Tag] = event_list_soup.find_all("a", class_="n-p")
+    has_next_page = not (len(nav_anchors) == 1 and "Poprzednie" in nav_anchors[0].text)
+    return event_urls, has_next_page
+
+
+def extract_brite_listing(event_list_soup: BeautifulSoup, url: str) -> tuple[List[str], bool]:
+    """
+    Extracts event URLs from a listing page on eventbrite.com.
+    :param event_list_soup: BeautifulSoup object of the listing page
+    :param url: URL of the listing page
+    :return: Tuple of the event URLs and whether there is a next listing page
+    """
+    event_urls = [anchor["href"] for anchor in event_list_soup.find_all("a", class_="event-card-link")]
+
+    next_page_button: Optional[Tag] = event_list_soup.find("button", aria_label="Next Page")
+    return event_urls, next_page_button is not None
+
+
+def extract_crossweb_listing(event_list_soup: BeautifulSoup, url: str) -> tuple[List[str], bool]:
+    """
+    Extracts event URLs from the listing page on crossweb.pl, which lists all events on a single page.
+    :param event_list_soup: BeautifulSoup object of the listing page
+    :param url: URL of the listing page
+    :return: Tuple of the event URLs and whether there is a next listing page
+    """
+    event_urls = [anchor["href"] for anchor in event_list_soup.find_all("a", class_="clearfix")]
+    return event_urls, False
+
+
+# Listing pages are only searched for links and navigation, so the rest of the document is not even built
+UNIKON_LISTING_STRAINER = SoupStrainer("a")
+BRITE_LISTING_STRAINER = SoupStrainer(["a", "button"])
+CROSSWEB_LISTING_STRAINER = SoupStrainer("a")
+
+
+class Selector(NamedTuple):
+    """
+    Matches tags like BeautifulSoup's find(name, attrs=...) does. A "class" value matches either one of the tag's classes
+    or the whole class attribute.
+    """
+
+    name: str
+    attrs: tuple[tuple[str, str], ...] = ()
+
+    def matches(self, tag: Tag) -> bool:
+        for key, value in self.attrs:
+            if key == "class":
+                classes = tag.get("class") or []
+                if value not in classes and " ".join(classes) != value:
+                    return False
+            elif tag.get(key) != value:
+                return False
+        return True
+
+
+def select(name: str, **attrs: str) -> Selector:
+    """
+    Creates a Selector, "class_" stands for the class attribute and underscores in other names for hyphens.
+    :param name: Name of the tag
+    :param attrs: Values of the tag's attributes
+    :return: Selector matching the tag
+    """
+    return Selector(
+        name, tuple(sorted(("class" if key == "class_" else key.replace("_", "-"), value) for key, value in attrs.items()))
+    )
+
+
+class Field(NamedTuple):
+    """
+    Declarative description of a single event detail: the text (or the attribute, if given) of either the n-th tag matched
+    by the selector or the value next to a label.
+    """
+
+    selector: Optional[Selector] = None
+    label: Optional[str] = None
+    index: int = 0
+    attribute: Optional[str] = None
+
+
+class DocumentIndex:
+    """
+    Index of all tags an extractor needs, built in a single traversal of the document, so that extracting every field
+    does not walk the whole document again.
+    Tags matched by the label selector are indexed by their text and point to the value tag that follows them.
+    """
+
+    def __init__(self, soup: BeautifulSoup, selectors: Iterable[Selector], label_selector: Optional[Selector] = None) -> None:
+        self.matches: dict[Selector, List[Tag]] = {}
+        self.labels: dict[str, Tag] = {}
+
+        selectors_by_name: dict[str, List[Selector]] = {}
+        for selector in set(selectors):
+            selectors_by_name.setdefault(selector.name, []).append(selector)
+            self.matches[selector] = []
+
+        for tag in soup.find_all(True):
+            for selector in selectors_by_name.get(tag.name, ()):
+                if selector.matches(tag):
+                    self.matches[selector].append(tag)
+
+            if label_selector is not None and tag.name == label_selector.name and label_selector.matches(tag):
+                # The first label wins, just like with find()
+                if tag.string is not None and tag.string not in self.labels:
+                    value_tag = tag.find_next_sibling(label_selector.name)
+                    if value_tag is not None:
+                        self.labels[tag.string] = value_tag
+
+    def get(self, selector: Selector, index: int = 0) -> Optional[Tag]:
+        matches = self.matches[selector]
+        return matches[index] if index < len(matches) else None
+
+    def get_all(self, selector: Selector) -> List[Tag]:
+        return self.matches[selector]
+
+
+def extract_fields(document_index: DocumentIndex, fields: dict[str, Field]) -> dict[str]:
+    """
+    Fills the event details described by the fields from the document index.
+    :param document_index: Index of the event page
+    :param fields: Fields by the names of the event details
+    :return: Dictionary with event details, with "N/A" for every field that was not found
+    """
+    event_details: dict[str] = {}
+    for name, field in fields.items():
+        if field.label is not None:
+            tag = document_index.labels.get(field.label)
+        else:
+            tag = document_index.get(field.selector, field.index)
+
+        if tag is None:
+            event_details[name] = "N/A"
+        elif field.attribute is not None:
+            event_details[name] = tag[field.attribute].strip() if tag.has_attr(field.attribute) else "N/A"
+        else:
+            event_details[name] = tag.text.strip()
+    return event_details
+
+
+def build_index(
+    event_soup: BeautifulSoup, fields: dict[str, Field], *selectors: Selector, label_selector: Optional[Selector] = None
+) -> DocumentIndex:
+    """
+    Builds the index of an event page for the given fields and for the additional selectors used by custom extraction code.
+    """
+    field_selectors = [field.selector for field in fields.values() if field.selector is not None]
+    return DocumentIndex(event_soup, [*field_selectors, *selectors], label_selector)
+
+
+# region Unikonferencje
+
+UNIKON_FIELDS = {
+    "event_title": Field(select("h2", property="name")),
+    "event_time": Field(select("div", class_="content-details-box"), index=0),
+    "event_location": Field(select("div", class_="content-details-box"), index=1),
+    "event_description": Field(select("div", class_="content-details-description")),
+}
+UNIKON_RIGHT_COLUMN = select("div", class_="content-info-column conference")
+# Details in the right column have no labels, only a fixed order
+UNIKON_RIGHT_COLUMN_FIELDS = ["event_fee", "event_organizers", "event_disciplines", "event_keywords"]
+
+
+def extract_unikon_event(event_soup: BeautifulSoup, url: str) -> dict[str]:
+    """
+    Extracts details of a single event from its page on unikonferencje.pl.
+    :param event_soup: BeautifulSoup object of the event page
+    :param url: URL of the event page
+    :return: Dictionary with event details
+    """
+    document_index = build_index(event_soup, UNIKON_FIELDS, UNIKON_RIGHT_COLUMN)
+    event_details = extract_fields(document_index, UNIKON_FIELDS)
+
+    # Extracting the details from the right column, only the column itself is searched
+    event_right_column_div = document_index.get(UNIKON_RIGHT_COLUMN)
+    event_right_column_divs: List[Tag] = event_right_column_div.find_all("div") if event_right_column_div else []
+    for index, name in enumerate(UNIKON_RIGHT_COLUMN_FIELDS):
+        event_details[name] = event_right_column_divs[index].text.strip() if index < len(event_right_column_divs) else "N/A"
+
+    # Setting event source
+    event_details["source"] = url
+    return event_details
+
+
+# endregion
+
+# region Eventbrite
+
+BRITE_FIELDS = {
+    "event_title": Field(select("h1", class_="event-title")),
+    "event_summary": Field(select("p", class_="summary")),
+    "event_date": Field(select("div", data_testid="display-date-container")),
+    "event_location": Field(select("div", class_="location-info__address")),
+    "event_fee": Field(select("div", class_="conversion-bar__panel-info")),
+    "event_refund_policy": Field(select("section", aria_labelledby="refund-policy-heading")),
+    "event_organizer": Field(select("a", class_="descriptive-organizer-info-mobile__name-link")),
+    "event_organizer_profile": Field(select("a", class_="descriptive-organizer-info-mobile__name-link"), attribute="href"),
+    "event_description": Field(select("div", class_="event-description")),
+}
+
+
+def extract_brite_event(event_soup: BeautifulSoup, url: str) -> dict[str]:
+    """
+    Extracts details of a single event from its page on eventbrite.com.
+    :param event_soup: BeautifulSoup object of the event page
+    :param url: URL of the event page
+    :return: Dictionary with event details
+    """
+    document_index = build_index(event_soup, BRITE_FIELDS)
+    event_details = extract_fields(document_index, BRITE_FIELDS)
+
+    # Remove button text from the location
+    event_location_tag = document_index.get(BRITE_FIELDS["event_location"].selector)
+    if event_location_tag:
+        button = event_location_tag.find("button")
+        if button:
+            event_details["event_location"] = event_details["event_location"].replace(button.text.strip(), "").strip()
+
+    # Put the currency after the amount in the fee
+    event_details["event_fee"] = re.sub(r"(?<=zł)\s*", " ", event_details["event_fee"])
+    event_details["event_fee"] = re.sub(r"zł\s*(\d+)", r"\1 zł", event_details["event_fee"])
+
+    # The refund policy is the text of the only unstyled div in its section
+    event_refund_section = document_index.get(BRITE_FIELDS["event_refund_policy"].selector)
+    event_refund_div: Optional[Tag] = event_refund_section.find("div", class_=None) if event_refund_section else None
+    event_details["event_refund_policy"] = event_refund_div.text.strip() if event_refund_div else "N/A"
+
+    # Setting event source
+    event_details["source"] = url
+    return event_details
+
+
+# endregion
+
+# region Crossweb
+
+CROSSWEB_LABEL = select("div", class_="event-label")
+CROSSWEB_FIELDS = {
+    "event_title": Field(select("div", class_="event-var fw-bold", itemprop="name")),
+    "event_type": Field(label="Typ wydarzenia:"),
+    "event_category": Field(label="Kategoria:"),
+    "event_subject": Field(label="Tematyka:"),
+    "event_date": Field(label="Data:"),
+    "event_time": Field(label="Godzina:"),
+    "event_language": Field(label="Język:"),
+    "event_fee": Field(label="Wstęp:"),
+    "event_city": Field(label="Miasto:"),
+    "event_location": Field(label="Miejsce:"),
+    "event_location_address": Field(label="Adres:"),
+    "event_registration_link": Field(select("a", class_="eventDetailLink.apply-link-js"), attribute="href"),
+    "event_webpage": Field(select("a", class_="eventDetailLink.apply-link-js", target="_blank"), attribute="href"),
+}
+CROSSWEB_SPEAKER = select("div", class_="speaker-box")
+CROSSWEB_DESCRIPTION = select("div", class_="event-detail description")
+
+
+def extract_crossweb_event(event_soup: BeautifulSoup, url: str) -> dict[str]:
+    """
+    Extracts details of a single event from its page on crossweb.pl.
+    All labelled details are read from a label index built in the same single pass over the document as the other fields.
+    :param event_soup: BeautifulSoup object of the event page
+    :param url: URL of the event page
+    :return: Dictionary with event details
+    """
+    document_index = build_index(
+        event_soup, CROSSWEB_FIELDS, CROSSWEB_SPEAKER, CROSSWEB_DESCRIPTION, label_selector=CROSSWEB_LABEL
+    )
+    event_details = extract_fields(document_index, CROSSWEB_FIELDS)
+
+    # Extracting event speakers from the links to their profiles
+    event_speakers = document_index.get_all(CROSSWEB_SPEAKER)
+    event_details["event_speakers"] = (
+        ", ".join(speaker.div.a["href"].split("/")[2].replace("-", " ").strip() for speaker in event_speakers)
+        if event_speakers
+        else "N/A"
+    )
+
+    # If there are two divs with this class, the first one contains the agenda and the second one the description
+    event_details_outer_div = document_index.get_all(CROSSWEB_DESCRIPTION)
+    if len(event_details_outer_div) == 2:
+        event_agenda = event_details_outer_div[0]
+        event_description = event_details_outer_div[1]
+    elif len(event_details_outer_div) == 1:
+        event_agenda = None
+        event_description = event_details_outer_div[0].find("div", class_="event-var ql-editor")
+    else:
+        event_agenda = None
+        event_description = None
+
+    event_details["event_agenda"] = event_agenda.text.strip() if event_agenda else "N/A"
+    event_details["event_description"] = event_description.text.strip() if event_description else "N/A"
+
+    # Setting source
+    event_details["source"] = url
+    return event_details
+
+
+# endregion
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import time
+import uuid
+from typing import Iterable, List, Optional
+
+# States of a URL in the frontier
+PENDING = "pending"  # Discovered, not processed yet
+CLAIMED = "claimed"  # Being processed by a worker
+FETCHED = "fetched"  # Details extracted, waiting to be committed to the event store
+SAVED = "saved"  # Details committed to the event store, or the page has no event
+FAILED = "failed"  # Could not be scraped
+
+
+class Frontier:
+    """
+    Persistent record of every event URL of the current crawl and of its state, kept in SQLite.
+    If the ETL dies halfway through a run, the next start resumes the unfinished run instead of starting over:
+    URLs already handled by the interrupted attempt are skipped and the rest are crawled again.
+    Claiming a URL is atomic, so several workers (also in different processes) never process the same URL twice.
+    URLs that failed are also kept in a dead-letter queue across runs, so that the next runs retry them first.
+    """
+
+    def __init__(self, path: str, attempt_id: Optional[str] = None) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        # Autocommit mode, every statement is its own transaction
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL,
+                finished_at REAL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempt_id TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS urls_state ON urls (state)")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                name TEXT PRIMARY KEY,
+                next_refresh_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                error TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                failed_at REAL NOT NULL
+            )
+            """
+        )
+        # URLs that failed this many runs in a row are given up
+        self.max_dead_letter_attempts = int(os.getenv("DEAD_LETTER_MAX_ATTEMPTS", "5"))
+        # Every start of the ETL is a new attempt, workers of the same attempt share its ID
+        self.attempt_id = attempt_id or uuid.uuid4().hex
+
+    def unfinished_run_exists(self) -> bool:
+        return self.connection.execute("SELECT 1 FROM runs WHERE finished_at IS NULL").fetchone() is not None
+
+    def start_run(self) -> bool:
+        """
+        Starts a new run with an empty frontier, unless the previous run did not finish, in which case it is resumed.
+        :return: Whether the previous run is being resumed
+        """
+        if self.unfinished_run_exists():
+            return True
+
+        self.connection.execute("DELETE FROM urls")
+        self.connection.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),))
+        return False
+
+    def finish_run(self) -> None:
+        self.connection.execute("UPDATE runs SET finished_at = ? WHERE finished_at IS NULL", (time.time(),))
+
+    def claim(self, url: str, kind: str) -> bool:
+        """
+        Atomically claims a URL for processing by the calling worker, adding it to the frontier if it is new.
+        A URL can be claimed if it is pending or if it was left behind by an earlier, interrupted attempt.
+        :param url: URL to claim
+        :param kind: Kind of the URL, telling which scraper processes it
+        :return: Whether the URL was claimed and should be processed by the caller
+        """
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR IGNORE INTO urls (url, kind, state, updated_at) VALUES (?, ?, ?, ?)", (url, kind, PENDING, now)
+        )
+        cursor = self.connection.execute(
+            "UPDATE urls SET state = ?, attempt_id = ?, updated_at = ? "
+            "WHERE url = ? AND state != ? AND (state = ? OR attempt_id IS NULL OR attempt_id != ?)",
+            (CLAIMED, self.attempt_id, now, url, SAVED, PENDING, self.attempt_id),
+        )
+        return cursor.rowcount == 1
+
+    def mark(self, urls: Iterable[str], state: str) -> None:
+        urls = list(urls)
+        self.connection.executemany(
+            "UPDATE urls SET state = ?, updated_at = ? WHERE url = ?", [(state, time.time(), url) for url in urls]
+        )
+        # URLs handled successfully leave the dead-letter queue
+        if state == SAVED:
+            self.connection.executemany("DELETE FROM dead_letters WHERE url = ?", [(url,) for url in urls])
+
+    def fail(self, url: str, error: str) -> None:
+        """
+        Marks a claimed URL as failed and adds it to the dead-letter queue, counting how many runs in a row it failed.
+        :param url: URL that could not be scraped
+        :param error: Description of the error
+        """
+        now = time.time()
+        self.connection.execute("UPDATE urls SET state = ?, updated_at = ? WHERE url = ?", (FAILED, now, url))
+        self.connection.execute(
+            "INSERT INTO dead_letters (url, kind, error, attempts, failed_at) SELECT url, kind, ?, 1, ? FROM urls WHERE url = ? "
+            "ON CONFLICT (url) DO UPDATE SET error = excluded.error, attempts = attempts + 1, failed_at = excluded.failed_at",
+            (error, now, url),
+        )
+
+    def dead_letters(self) -> List[tuple[str, str]]:
+        """
+        Drops URLs that failed too many runs in a row from the dead-letter queue and returns the rest.
+        :return: URLs with their kinds that failed in earlier runs, the least recently failed first
+        """
+        cursor = self.connection.execute("DELETE FROM dead_letters WHERE attempts >= ?", (self.max_dead_letter_attempts,))
+        if cursor.rowcount:
+            print(f"Gave up {cursor.rowcount} URLs that failed {self.max_dead_letter_attempts} runs in a row")
+        return self.connection.execute("SELECT url, kind FROM dead_letters ORDER BY failed_at").fetchall()
+
+    def unfinished_urls(self) -> List[tuple[str, str]]:
+        """
+        :return: URLs with their kinds that were not handled completely by earlier attempts of the current run
+        """
+        return self.connection.execute(
+            "SELECT url, kind FROM urls WHERE state != ? AND (attempt_id IS NULL OR attempt_id != ?)",
+            (SAVED, self.attempt_id),
+        ).fetchall()
+
+    def next_refresh_at(self, source_name: str) -> Optional[float]:
+        """
+        :return: Time at which the source should be scraped again or None if it was never scraped
+        """
+        row = self.connection.execute("SELECT next_refresh_at FROM sources WHERE name = ?", (source_name,)).fetchone()
+        return row[0] if row else None
+
+    def schedule_refresh(self, source_name: str, next_refresh_at: float) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sources (name, next_refresh_at) VALUES (?, ?)", (source_name, next_refresh_at)
+        )
+
+    def report(self) -> str:
+        counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM urls GROUP BY state").fetchall())
+        dead_letter_count = self.connection.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return (
+            "Frontier: "
+            + ", ".join(f"{counts.get(state, 0)} {state}" for state in (PENDING, CLAIMED, FETCHED, SAVED, FAILED))
+            + f", {dead_letter_count} in the dead-letter queue"
+        )
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Statistics of the current run kept by HttpCache
+COUNTERS = ("revalidated", "unchanged", "misses", "parses_skipped", "requests_skipped")
+
+
+class HttpCache:
+    """
+    Persistent cache of HTTP responses kept between ETL runs.
+    Stores response bodies together with their validators (ETag / Last-Modified), so that pages can be revalidated with
+    conditional requests, and the details extracted from each body, so that unchanged pages do not need to be parsed again.
+    During the crawl the cache is used through run(), which keeps its disk I/O off the event loop.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        # The connection is used by the thread of the executor during the crawl and by the caller before and after it
+        self.connection = sqlite3.connect(os.path.join(cache_dir, "http_cache.sqlite3"), timeout=30, check_same_thread=False)
+        # WAL lets crawl workers in other processes read the cache while one of them is writing to it,
+        # and in WAL mode commits do not wait for the disk, only checkpoints do
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # A single thread runs all calls made during the crawl, one after another, so they never interleave
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="http-cache")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB NOT NULL,
+                body_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                extracted TEXT,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+        self.max_age = float(os.getenv("HTTP_CACHE_MAX_AGE_DAYS", "14")) * 24 * 60 * 60
+        self.max_size = int(os.getenv("HTTP_CACHE_MAX_SIZE_MB", "512")) * 1024 * 1024
+
+        # Statistics of the current run
+        self.revalidated = 0
+        self.unchanged = 0
+        self.misses = 0
+        self.parses_skipped = 0
+        self.requests_skipped = 0
+
+    async def run(self, method: Callable[..., T], *args: Any) -> T:
+        """
+        Runs a method of the cache in the thread of the cache, so that the event loop keeps downloading meanwhile.
+        :param method: Method of the cache to run
+        :param args: Arguments of the method
+        :return: Result of the method
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """
+        Builds If-None-Match / If-Modified-Since headers from the validators of the cached response.
+        :param url: URL that is going to be requested
+        :return: Dictionary with conditional headers, empty if the URL is not cached
+        """
+        row = self.connection.execute("SELECT etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return {}
+
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def load(self, url: str) -> tuple[bytes, str]:
+        """
+        Serves the cached body after the server answered 304 Not Modified.
+        :param url: URL of the revalidated response
+        :return: Tuple of the cached body and its hash
+        """
+        row = self.connection.execute("SELECT body, body_hash FROM responses WHERE url = ?", (url,)).fetchone()
+        assert row is not None, f"Got 304 for {url} which is not cached"
+
+        self.connection.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        self.connection.commit()
+        self.revalidated += 1
+        return zlib.decompress(row[0]), row[1]
+
+    def store(self, url: str, body: bytes, etag: Optional[str], last_modified: Optional[str]) -> str:
+        """
+        Stores a freshly downloaded body with its validators.
+        Details extracted from the previous body are kept only if the body did not change.
+        :param url: URL of the response
+        :param body: Body of the response
+        :param etag: Value of the ETag header, if any
+        :param last_modified: Value of the Last-Modified header, if any
+        :return: Hash of the body
+        """
+        body_hash = hashlib.sha256(body).hexdigest()
+        row = self.connection.execute("SELECT body_hash FROM responses WHERE url = ?", (url,)).fetchone()
+
+        if row is not None and row[0] == body_hash:
+            self.unchanged += 1
+            self.connection.execute(
+                "UPDATE responses SET etag = ?, last_modified = ?, accessed_at = ? WHERE url = ?",
+                (etag, last_modified, time.time(), url),
+            )
+        else:
+            self.misses += 1
+            compressed_body = zlib.compress(body)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, body, body_hash, size, extracted, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                (url, etag, last_modified, compressed_body, body_hash, len(compressed_body), time.time()),
+            )
+        self.connection.commit()
+        return body_hash
+
+    def get_extracted(self, url: str, body_hash: str, version: int) -> Optional[dict]:
+        """
+        Returns the details previously extracted from exactly the same body by the same version of the extractors.
+        :param url: URL of the page
+        :param body_hash: Hash of the current body of the page
+        :param version: Version of the extractors, cached details of other versions are ignored
+        :return: Extracted details or None if the page has to be parsed
+        """
+        row = self.connection.execute(
+            "SELECT extracted FROM responses WHERE url = ? AND body_hash = ?", (url, body_hash)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+
+        cached = json.loads(row[0])
+        if cached["version"] != version:
+            return None
+        self.parses_skipped += 1
+        return cached["details"]
+
+    def get_recent_extracted(self, url: str, version: int, max_age: float) -> Optional[dict]:
+        """
+        Returns the details extracted from a page that was downloaded or revalidated recently, without requesting it again.
+        :param url: URL of the page
+        :param version: Version of the extractors, cached details of other versions are ignored
+        :param max_age: Maximum number of seconds since the page was downloaded or revalidated
+        :return: Extracted details or None if the page has to be requested
+        """
+        row = self.connection.execute(
+            "SELECT extracted FROM responses WHERE url = ? AND accessed_at >= ?", (url, time.time() - max_age)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+
+        cached = json.loads(row[0])
+        if cached["version"] != version:
+            return None
+        self.requests_skipped += 1
+        return cached["details"]
+
+    def store_extracted(self, url: str, body_hash: str, version: int, details: dict) -> None:
+        self.connection.execute(
+            "UPDATE responses SET extracted = ? WHERE url = ? AND body_hash = ?",
+            (json.dumps({"version": version, "details": details}, ensure_ascii=False), url, body_hash),
+        )
+        self.connection.commit()
+
+    def evict(self) -> None:
+        """
+        Removes responses not used for longer than the maximum age, then the least recently used ones until the cache
+        fits within its maximum size.
+        """
+        self.connection.execute("DELETE FROM responses WHERE accessed_at < ?", (time.time() - self.max_age,))
+
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size > self.max_size:
+            rows = self.connection.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall()
+            evicted_urls = []
+            for url, size in rows:
+                if total_size <= self.max_size:
+                    break
+                evicted_urls.append((url,))
+                total_size -= size
+            self.connection.executemany("DELETE FROM responses WHERE url = ?", evicted_urls)
+        self.connection.commit()
+
+    def close(self, evict: bool = True) -> None:
+        if evict:
+            self.evict()
+        self.executor.shutdown()
+        self.connection.close()
+
+    def counters(self) -> dict[str, int]:
+        return {name: getattr(self, name) for name in COUNTERS}
+
+    def add_counters(self, counters: dict[str, int]) -> None:
+        """
+        Adds the statistics of the current run collected by a crawl worker in another process to these ones.
+        :param counters: Statistics returned by counters() of the worker's cache
+        """
+        for name, value in counters.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def report(self) -> str:
+        requests = self.revalidated + self.unchanged + self.misses
+        hits = self.revalidated + self.unchanged
+        hit_ratio = hits / requests if requests else 0.0
+        return (
+            f"HTTP cache: {hits} hits ({self.revalidated} not modified, {self.unchanged} with unchanged body), "
+            f"{self.misses} misses, {hit_ratio:.1%} hit ratio, {self.parses_skipped} pages not parsed again, "
+            f"{self.requests_skipped} recently fetched pages not requested again"
+        )
@@ -0,0 +1,70 @@
+import os
+
+import aiohttp
+from aiohttp.compression_utils import HAS_BROTLI
+
+
+class ConnectionStats:
+    """
+    Counts how many requests had to open a new connection and how many reused a pooled keep-alive connection.
+    """
+
+    def __init__(self) -> None:
+        self.created = 0
+        self.reused = 0
+
+    def merge(self, other: "ConnectionStats") -> None:
+        self.created += other.created
+        self.reused += other.reused
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.created + self.reused
+        return self.reused / total if total else 0.0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Builds an aiohttp trace config that updates the counters on every connection checkout.
+        :return: TraceConfig to pass to aiohttp.ClientSession
+        """
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        return trace_config
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params) -> None:
+        self.created += 1
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params) -> None:
+        self.reused += 1
+
+    def report(self) -> str:
+        return (
+            f"HTTP connections: {self.created} opened, {self.reused} reused "
+            f"({self.reuse_ratio:.1%} of requests served over keep-alive connections)"
+        )
+
+
+def create_client_session(headers: dict[str, str], stats: ConnectionStats) -> aiohttp.ClientSession:
+    """
+    Creates the single HTTP session shared by all scrapers during a run.
+    Connections are pooled and kept alive between requests, DNS lookups are cached and compressed responses are negotiated,
+    so that consecutive requests to the same site skip the TCP+TLS handshake.
+    :param headers: Default headers sent with every request
+    :param stats: ConnectionStats object that will count new and reused connections
+    :return: aiohttp.ClientSession that has to be closed by the caller, preferably with "async with"
+    """
+    connector = aiohttp.TCPConnector(
+        limit=int(os.getenv("HTTP_POOL_SIZE", "100")),
+        limit_per_host=int(os.getenv("HTTP_POOL_SIZE_PER_HOST", "20")),
+        ttl_dns_cache=int(os.getenv("HTTP_DNS_CACHE_TTL", "600")),
+        keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60")),
+    )
+    # Brotli can only be negotiated when a decoder is installed, otherwise aiohttp would fail to decompress the body
+    accept_encoding = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={**headers, "Accept-Encoding": accept_encoding},
+        trace_configs=[stats.trace_config()],
+    )
@@ -0,0 +1,174 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Upper bounds of the request latency buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Cumulative histogram of request latencies with fixed buckets, in the layout used by Prometheus.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # The last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        """
+        :return: Pairs of the upper bound of every bucket and the number of values not larger than it
+        """
+        cumulative_counts = []
+        total = 0
+        for bucket, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            cumulative_counts.append((bucket, total))
+        return cumulative_counts
+
+
+class RunMetrics:
+    """
+    Timings and counters of a single ETL run, so that a slow run can be traced to a site, the embedding model or Chroma.
+    Stage timings are sums over all concurrent operations of the stage, so they show where the work went, not wall time.
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.start_time = time.perf_counter()
+        self.stage_seconds: dict[str, float] = defaultdict(float)
+        self.stage_calls: dict[str, int] = defaultdict(int)
+        self.host_latency: dict[str, Histogram] = defaultdict(Histogram)
+        # Counter instead of a nested defaultdict keeps the metrics picklable, so crawl workers can send them back
+        self.host_counters: dict[str, Counter[str]] = defaultdict(Counter)
+        self.counters: dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1) -> None:
+        self.stage_seconds[stage] += seconds
+        self.stage_calls[stage] += calls
+
+    def observe_request(self, host: str, latency: float) -> None:
+        self.host_latency[host].observe(latency)
+
+    def increment(self, name: str, value: int = 1, host: Optional[str] = None) -> None:
+        if host is None:
+            self.counters[name] += value
+        else:
+            self.host_counters[host][name] += value
+
+    def merge(self, other: "RunMetrics") -> None:
+        """
+        Adds the timings and counters collected by another part of the same run, like a crawl worker, to these ones.
+        :param other: Metrics to add
+        """
+        for stage, seconds in other.stage_seconds.items():
+            self.add_time(stage, seconds, other.stage_calls[stage])
+        for host, histogram in other.host_latency.items():
+            self.host_latency[host].merge(histogram)
+        for host, counters in other.host_counters.items():
+            self.host_counters[host].update(counters)
+        for name, value in other.counters.items():
+            self.counters[name] += value
+
+    def to_dict(self) -> dict[str]:
+        return {
+            "started_at": self.started_at,
+            "duration_seconds": time.perf_counter() - self.start_time,
+            "stages": {
+                stage: {"seconds": seconds, "calls": self.stage_calls[stage]} for stage, seconds in self.stage_seconds.items()
+            },
+            "hosts": {
+                host: {
+                    **self.host_counters[host],
+                    "latency": {
+                        "count": self.host_latency[host].count,
+                        "sum": self.host_latency[host].sum,
+                        "buckets": dict(self.host_latency[host].cumulative_counts()),
+                    },
+                }
+                for host in sorted(set(self.host_latency) | set(self.host_counters))
+            },
+            "counters": dict(self.counters),
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Metrics in the Prometheus text format, e.g. for the textfile collector of node_exporter
+        """
+        report = self.to_dict()
+        lines = [
+            "# HELP etl_run_duration_seconds Duration of the last ETL run.",
+            "# TYPE etl_run_duration_seconds gauge",
+            f"etl_run_duration_seconds {report['duration_seconds']}",
+            "# HELP etl_run_started_seconds Time at which the last ETL run started.",
+            "# TYPE etl_run_started_seconds gauge",
+            f"etl_run_started_seconds {report['started_at']}",
+            "# HELP etl_stage_seconds Time spent in every stage of the last ETL run, summed over concurrent operations.",
+            "# TYPE etl_stage_seconds gauge",
+            *(f'etl_stage_seconds{{stage="{stage}"}} {stats["seconds"]}' for stage, stats in report["stages"].items()),
+            "# HELP etl_stage_calls Number of operations of every stage in the last ETL run.",
+            "# TYPE etl_stage_calls gauge",
+            *(f'etl_stage_calls{{stage="{stage}"}} {stats["calls"]}' for stage, stats in report["stages"].items()),
+            "# HELP etl_request_latency_seconds Latency of HTTP requests to the scraped sites in the last ETL run.",
+            "# TYPE etl_request_latency_seconds histogram",
+        ]
+        for host, histogram in self.host_latency.items():
+            for bucket, count in histogram.cumulative_counts():
+                lines.append(f'etl_request_latency_seconds_bucket{{host="{host}",le="{bucket}"}} {count}')
+            lines.append(f'etl_request_latency_seconds_sum{{host="{host}"}} {histogram.sum}')
+            lines.append(f'etl_request_latency_seconds_count{{host="{host}"}} {histogram.count}')
+        for name in sorted({name for counters in self.host_counters.values() for name in counters}):
+            lines.append(f"# TYPE etl_{name} gauge")
+            for host, counters in self.host_counters.items():
+                lines.append(f'etl_{name}{{host="{host}"}} {counters.get(name, 0)}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE etl_{name} gauge")
+            lines.append(f"etl_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_path: str, prometheus_path: Optional[str] = None) -> None:
+        """
+        Writes the JSON run report and, if a path is given, the Prometheus textfile. Files are replaced atomically, so
+        that readers never see a partially written report.
+        :param report_path: Path of the JSON report
+        :param prometheus_path: Path of the Prometheus textfile, usually ending with .prom
+        """
+        outputs = [(report_path, json.dumps(self.to_dict(), indent=4))]
+        if prometheus_path:
+            outputs.append((prometheus_path, self.to_prometheus()))
+        for path, content in outputs:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+
+    def report(self) -> str:
+        stages = ", ".join(
+            f"{stage} {seconds:.2f}s/{self.stage_calls[stage]}" for stage, seconds in sorted(self.stage_seconds.items())
+        )
+        return f"Stages (total time/operations): {stages}"
@@ -1,22 +1,115 @@
+import argparse
 import asyncio
+import hashlib
 import json
+import multiprocessing
 import os
 import random
-import re
 import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List
+from typing import Awaitable, Callable, List, NamedTuple, Optional, TypeVar
+from urllib.parse import urlsplit
 
-import aiofiles
 import aiohttp
 import backoff
-import ftfy
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, SoupStrainer
+from crawl_scheduler import CircuitOpenError, CrawlScheduler, is_host_failure
+from deduplication import find_duplicate_events, merge_duplicate_events, report_duplicates
 from dotenv import load_dotenv
-from vector_saver import add_data_to_vector_storage, create_new_vector_storage
+from event_metadata import METADATA_VERSION, get_end_timestamp
+from event_store import EventStore
+from extractors import (
+    BRITE_LISTING_STRAINER,
+    CROSSWEB_LISTING_STRAINER,
+    EXTRACTION_VERSION,
+    UNIKON_LISTING_STRAINER,
+    extract_brite_event,
+    extract_brite_listing,
+    extract_crossweb_event,
+    extract_crossweb_listing,
+    extract_unikon_event,
+    extract_unikon_listing,
+    process_page,
+)
+from frontier import FETCHED, SAVED, Frontier
+from http_cache import HttpCache
+from http_client import ConnectionStats, create_client_session
+from run_metrics import RunMetrics
+from vector_saver import (
+    VectorWriter,
+    activate_vector_storage,
+    add_data_to_vector_storage,
+    connect_to_vector_storage,
+    create_new_vector_storage,
+    delete_ended_events_from_vector_storage,
+    delete_events_from_vector_storage,
+    get_indexed_events,
+    is_being_built,
+)
 
 load_dotenv()
 
+T = TypeVar("T")
+
+# Event URLs found by the main process of a sharded crawl with the kind of each, they are scraped by the workers
+# afterward. None when events are scraped as soon as they are found.
+found_event_urls: Optional[dict[str, str]] = None
+# Called first in every crawl worker, so that it can be set up like the main process, e.g. by a benchmark. It is sent
+# to the workers, so it has to be picklable.
+worker_setup: Optional[Callable[[], None]] = None
+
+
+class Page(NamedTuple):
+    body: bytes
+    body_hash: str
+
+
+class WorkerConfig(NamedTuple):
+    """
+    Configuration of a crawl worker, which is started fresh and opens its own connections to the databases.
+    """
+
+    frontier_path: str
+    attempt_id: str
+    event_store_path: str
+    http_cache_dir: str
+    headers: dict[str, str]
+    event_refresh_age: float
+    # Number of workers crawling the same sites
+    worker_count: int
+    setup: Optional[Callable[[], None]]
+
+
+class CrawlResult(NamedTuple):
+    """
+    Outcome of scraping a shard of the events in a worker process, merged into the state of the main process.
+    """
+
+    seen_event_ids: set[str]
+    run_metrics: RunMetrics
+    connection_stats: ConnectionStats
+    http_cache_counters: dict[str, int]
+    scheduler_report: str
+
+
+def count_retry(details: dict) -> None:
+    run_metrics.increment("retries", host=urlsplit(details["args"][0]).hostname)
+
+
+def count_giveup(details: dict) -> None:
+    run_metrics.increment("giveups", host=urlsplit(details["args"][0]).hostname)
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    :return: Whether retrying the request cannot help, like for a missing page or a domain that does not resolve
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return 400 <= error.status < 500 and error.status not in (408, 429)
+    return isinstance(error, aiohttp.ClientConnectorDNSError)
+
 
 @backoff.on_exception(
     backoff.expo,
@@ -27,268 +120,405 @@ load_dotenv()
         aiohttp.ClientConnectorDNSError,
         aiohttp.ClientResponseError,
         ConnectionRefusedError,
-        AssertionError,
     ),
     max_tries=5,
     jitter=backoff.full_jitter,
+    giveup=is_permanent_error,
+    on_backoff=count_retry,
+    on_giveup=count_giveup,
 )
-async def get_soup_from_url(url: str) -> BeautifulSoup:
+async def request_page(url: str) -> Page:
     """
-    Retrieves a BeautifulSoup object from a URL, handling potential character encoding issues.
-    :param url: URL to get the BeautifulSoup object from
-    :return: BeautifulSoup object of the response with fixed characters
+    Retrieves the body of a page, revalidating the cached copy with a conditional request when there is one.
+    Only handles I/O, decoding and parsing are left to process_page() running in the parser pool.
+    :param url: URL of the page to retrieve
+    :return: Page with the raw body and its hash
     """
-    await asyncio.sleep(random.uniform(1, 3))
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=HEADERS) as response:
-            try:
-                response.raise_for_status()
-            except Exception:
-                print(f"Failed to get response from {url}")
-                raise
-            response_content: bytes = await response.read()
+    host = urlsplit(url).hostname
+    # The scheduler paces requests per host instead of a blind sleep and adapts to how the site responds
+    async with scheduler.request(url) as slot:
+        start_time = time.perf_counter()
+        try:
+            headers = await http_cache.run(http_cache.conditional_headers, url)
+            async with session.get(url, headers=headers) as response:
+                slot.status = response.status
+                slot.retry_after = response.headers.get("Retry-After")
+                try:
+                    response.raise_for_status()
+                except Exception:
+                    print(f"Failed to get response from {url}")
+                    raise
+                if response.status == 304:
+                    response_content, body_hash = await http_cache.run(http_cache.load, url)
+                else:
+                    response_content: bytes = await response.read()
+                    run_metrics.increment("bytes_downloaded", len(response_content), host=host)
+                    body_hash = await http_cache.run(
+                        http_cache.store,
+                        url,
+                        response_content,
+                        response.headers.get("ETag"),
+                        response.headers.get("Last-Modified"),
+                    )
+        except Exception:
+            run_metrics.increment("failed_requests", host=host)
+            raise
+        latency = time.perf_counter() - start_time
+        run_metrics.observe_request(host, latency)
+        run_metrics.add_time("fetch", latency)
+        run_metrics.increment("requests", host=host)
+
+    return Page(response_content, body_hash)
+
 
+async def fetch_page(url: str) -> Page:
+    """
+    Retrieves the body of a page via request_page(), retrying transient errors, and records in the circuit breaker of
+    the site whether the page could be fetched in the end, so that a site is only cut off for failing URLs, not for
+    single failed attempts.
+    :param url: URL of the page to retrieve
+    :return: Page with the raw body and its hash
+    """
     try:
-        response_text = response_content.decode("utf-8")
-    except UnicodeDecodeError:
-        response_text = response_content.decode("utf-8", errors="replace")
-        response_text = ftfy.fix_text(response_text)
-    response_text = re.sub(r"\s+", " ", response_text)
-    soup: BeautifulSoup = BeautifulSoup(response_text, "html.parser")
-    return soup
+        page = await request_page(url)
+    except CircuitOpenError:
+        raise
+    except (asyncio.TimeoutError, aiohttp.ClientError, ConnectionRefusedError) as e:
+        scheduler.record_outcome(url, is_host_failure(e.status if isinstance(e, aiohttp.ClientResponseError) else None))
+        raise
+    scheduler.record_outcome(url, False)
+    return page
+
+
+async def parse_page(
+    page: Page, extract: Callable[[BeautifulSoup, str], T], url: str, strainer: Optional[SoupStrainer] = None
+) -> T:
+    """
+    Parses a page and extracts data from it in the parser pool, keeping the event loop free for downloads.
+    :param page: Page to parse
+    :param extract: Function extracting data from the parsed page, it has to be defined in the extractors module
+    :param url: URL of the page
+    :param strainer: Tags the extract function needs, None to parse the whole page
+    :return: Data returned by the extract function
+    """
+    extracted, timings = await asyncio.get_running_loop().run_in_executor(
+        parser_pool, process_page, page.body, extract, url, strainer
+    )
+    for stage, seconds in timings.items():
+        run_metrics.add_time(stage, seconds)
+    return extracted
+
+
+async def get_event_urls(
+    url: str, extract_listing: Callable[[BeautifulSoup, str], tuple[List[str], bool]], strainer: SoupStrainer
+) -> tuple[List[str], bool]:
+    """
+    Retrieves a listing page and extracts event URLs from it.
+    :param url: URL of the listing page
+    :param extract_listing: Function extracting event URLs from the parsed listing page
+    :param strainer: Tags of the listing page the extract function needs, the rest of the page is not parsed
+    :return: Tuple of the event URLs and whether there is a next listing page
+    """
+    page = await fetch_page(url)
+    return await parse_page(page, extract_listing, url, strainer)
+
+
+async def get_event_details(url: str, extract_event: Callable[[BeautifulSoup, str], dict[str]]) -> dict[str]:
+    """
+    Retrieves the page of a single event and extracts its details.
+    The page is parsed only if its body changed since the details were last extracted.
+    :param url: URL of the event page
+    :param extract_event: Function extracting the details from the parsed page
+    :return: Dictionary with event details
+    """
+    # In daemon mode recently fetched event pages are not requested again, new events still come from the listing pages
+    if EVENT_REFRESH_AGE:
+        event_details = await http_cache.run(http_cache.get_recent_extracted, url, EXTRACTION_VERSION, EVENT_REFRESH_AGE)
+        if event_details is not None:
+            return event_details
+
+    page = await fetch_page(url)
+    event_details = await http_cache.run(http_cache.get_extracted, url, page.body_hash, EXTRACTION_VERSION)
+    if event_details is None:
+        event_details = await parse_page(page, extract_event, url)
+        await http_cache.run(http_cache.store_extracted, url, page.body_hash, EXTRACTION_VERSION, event_details)
+    return event_details
+
+
+def get_event_id(url: str) -> str:
+    """
+    Creates a stable ID of an event from the URL of its page, so that the same event gets the same ID in every run.
+    :param url: URL of the event page
+    :return: ID of the event
+    """
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def get_content_hash(event_details: dict[str]) -> str:
+    return hashlib.sha256(json.dumps(event_details, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 
 async def save_event_details(event_details: dict[str]) -> None:
     """
-    Saves event details to a JSON file and adds them to the vector storage.
+    Saves event details to the event store. They are added to the vector storage after the crawl, once duplicates of
+    the same event found on other sites are merged.
     :param event_details: Dictionary with event details to save
     :return: None
     """
+    event_id = get_event_id(event_details["source"])
+    seen_event_ids.add(event_id)
+
     print(f"Saving event: {event_details['event_title']}")
     if event_details["event_title"] == "N/A":
         print(event_details)
+        frontier.mark([event_details["source"]], SAVED)
         return
 
-    event_id = re.sub(r'[<>:"/\\|?*]', "_", event_details["event_title"].replace(" ", "_"))
+    event_store.put(event_id, event_details, get_content_hash(event_details), get_end_timestamp(event_details))
+    run_metrics.increment("events_scraped")
+    frontier.mark([event_details["source"]], FETCHED)
+    stored_urls.append(event_details["source"])
+    if len(stored_urls) >= event_store.batch_size:
+        commit_stored_events()
 
-    async with aiofiles.open(f"{OUTPUT_DIR}/{event_id}.json", "w", encoding="utf-8") as f:
-        await f.write(json.dumps(event_details, indent=4, ensure_ascii=False))
 
-    await add_data_to_vector_storage(vector_storage, event_details, f"{OUTPUT_DIR}/{event_id}.json")
+def commit_stored_events() -> None:
+    """
+    Commits buffered event details to the event store and marks their events as saved in the frontier.
+    :return: None
+    """
+    event_store.flush()
+    frontier.mark(stored_urls, SAVED)
+    stored_urls.clear()
 
 
-async def scrape_unikon_events(url: str) -> None:
+async def index_events() -> None:
     """
-    Scrapes events from a given subset of events on unikonferencje.pl as defined by the URLs in .env file.
-    Delegates scraping and saving of individual events to scrape_unikon_event().
-    :param url: URL to scrape event URLs from
+    Merges duplicates of the same event scraped from different sites and adds the canonical events to the vector storage.
+    Events whose content did not change since the previous run are skipped. Indexed events that disappeared from the
+    event store or turned out to be duplicates are deleted from the vector storage.
     :return: None
     """
-    event_urls: List[str] = []
-    page_index = 1
-    while True:
-        try:
-            event_list_soup: BeautifulSoup = await get_soup_from_url(f"{url},s{page_index}")
-        except Exception:
-            print(f"Failed to get response from {url},s{page_index}")
-            return
-        event_urls.extend(anchor["href"] for anchor in event_list_soup.find_all("a", property="url"))
-        page_index += 1
+    events = event_store.get_all()
+    clusters = find_duplicate_events(events)
+    canonical_events = merge_duplicate_events(events, clusters)
+    print(report_duplicates(events, clusters))
+    run_metrics.increment("duplicates_merged", len(events) - len(canonical_events))
+
+    for event_id, event_details in canonical_events.items():
+        content_hash = get_content_hash(event_details)
+        # Canonical events are stored with the details merged from their duplicates
+        event_store.put(event_id, event_details, content_hash, get_end_timestamp(event_details))
+
+        indexed_event = indexed_events.get(event_id)
+        # Events indexed with older metadata are added again, their embeddings are served from the embedding cache
+        if (
+            indexed_event is not None
+            and indexed_event["content_hash"] == content_hash
+            and indexed_event.get("metadata_version") == METADATA_VERSION
+        ):
+            continue
+        # The event changed, so its old vectors are removed in case the new version has fewer chunks
+        if indexed_event is not None:
+            delete_events_from_vector_storage(vector_storage, [event_id])
+        await add_data_to_vector_storage(vector_writer, event_details, event_id, content_hash)
+        run_metrics.increment("events_indexed")
+
+    event_store.flush()
+    await vector_writer.flush()
+
+    # Events missing from the event store are kept if their site was not refreshed, as their absence does not mean
+    # they disappeared
+    deleted_event_ids = [
+        event_id
+        for event_id, indexed_event in indexed_events.items()
+        if event_id not in canonical_events and (event_id in events or is_refreshed(indexed_event["source"]))
+    ]
+    if deleted_event_ids:
+        delete_events_from_vector_storage(vector_storage, deleted_event_ids)
+        print(
+            f"Deleted {len(deleted_event_ids)} indexed events that disappeared from the sources or turned out to be duplicates"
+        )
+
+
+def is_refreshed(url: str) -> bool:
+    """
+    :return: Whether the site of the URL was scraped in this run, without failing to get its listing
+    """
+    hostname = urlsplit(url).hostname
+    return hostname in refreshed_hosts and hostname not in failed_hosts
 
-        nav_anchors: List[Tag] = event_list_soup.find_all("a", class_="n-p")
-        if len(nav_anchors) == 1 and "Poprzednie" in nav_anchors[0].text:
-            break
 
-    print(f"Found {len(event_urls)} events on Unikonferencje - {url.split('/')[-1]}")
+def delete_disappeared_events() -> None:
+    """
+    Deletes events that were stored in a previous run but were not found on their source websites anymore from the
+    event store, their vectors are deleted when the events are indexed.
+    Only sites scraped in this run are checked. Events from hosts whose listing could not be scraped are kept, as their
+    absence does not mean they disappeared. So are the events of hosts on which less than EVENT_DELETE_MIN_SEEN_RATIO
+    (default 0.5) of the stored events were found again: a listing that parses to no or few events, after a change of
+    the site's layout or on an error page served with a success status, fails the host instead.
+    :return: None
+    """
+    stored_events = event_store.get_all()
+    stored_counts, seen_counts = Counter(), Counter()
+    for event_id, event_details in stored_events.items():
+        hostname = urlsplit(event_details["source"]).hostname
+        stored_counts[hostname] += 1
+        seen_counts[hostname] += event_id in seen_event_ids
+    min_seen_ratio = float(os.getenv("EVENT_DELETE_MIN_SEEN_RATIO", "0.5"))
+    for hostname, stored_count in stored_counts.items():
+        if (
+            hostname in refreshed_hosts
+            and hostname not in failed_hosts
+            and seen_counts[hostname] < min_seen_ratio * stored_count
+        ):
+            print(
+                f"Only {seen_counts[hostname]} of {stored_count} stored events were found on {hostname}, "
+                "keeping them as its listings were probably not scraped correctly"
+            )
+            failed_hosts.add(hostname)
+
+    disappeared_event_ids = [
+        event_id
+        for event_id, event_details in stored_events.items()
+        if event_id not in seen_event_ids and is_refreshed(event_details["source"])
+    ]
+    if not disappeared_event_ids:
+        return
 
-    base_url = "https://unikonferencje.pl"
+    event_store.delete(disappeared_event_ids)
+    print(f"Deleted {len(disappeared_event_ids)} events that disappeared from the sources")
 
-    tasks = []
-    for event_url in event_urls:
-        tasks.append(asyncio.create_task(scrape_unikon_event(base_url + event_url)))
 
-    await asyncio.gather(*tasks)
+def prune_ended_events() -> None:
+    """
+    Deletes events that ended more than the grace period ago from the event store and from the vector storage in bulk,
+    so that they neither grow the index nor take places among the search results. The grace period, in hours, is set in
+    EVENT_PRUNE_GRACE_HOURS, events whose end is not known are kept.
+    :return: None
+    """
+    global indexed_events
+    before_ts = time.time() - float(os.getenv("EVENT_PRUNE_GRACE_HOURS", "24")) * 60 * 60
+    with run_metrics.time("prune"):
+        pruned_event_ids = set(event_store.delete_ended(before_ts))
+        pruned_event_ids.update(delete_ended_events_from_vector_storage(vector_storage, before_ts))
+    if not pruned_event_ids:
+        return
 
+    # Pruned events are neither indexed again nor deleted a second time by index_events()
+    indexed_events = {event_id: event for event_id, event in indexed_events.items() if event_id not in pruned_event_ids}
+    run_metrics.increment("events_pruned", len(pruned_event_ids))
+    print(f"Pruned {len(pruned_event_ids)} events that ended before {datetime.fromtimestamp(before_ts):%d-%m-%Y %H:%M}")
 
-async def scrape_unikon_event(url: str) -> None:
+
+async def scrape_event_page(url: str, kind: str, extract_event: Callable[[BeautifulSoup, str], dict[str]]) -> None:
     """
-    Scrapes details of a single event from unikonferencje.pl. Later saves the details to a JSON file via
-    save_event_details().
+    Scrapes details of a single event and saves them to the event store via save_event_details(). Events already claimed
+    in the frontier, like the ones reappearing on unikonferencje.pl or handled by an interrupted attempt of this run, are
+    skipped. Events that fail are recorded in the frontier, so that they are retried in the next run.
     :param url: URL of the event to scrape and save
+    :param kind: Kind of the event URL, see EVENT_SCRAPERS
+    :param extract_event: Function extracting the details from the parsed event page
     :return: None
     """
-    # Stops scraping for reappearing events which is specific to unikonferencje.pl
-    if url in visited_urls:
+    if not frontier.claim(url, kind):
+        seen_event_ids.add(get_event_id(url))
         return
-    visited_urls.add(url)
     try:
-        event_soup: BeautifulSoup = await get_soup_from_url(url)
-    except Exception:
-        print(f"Failed to get response from {url}")
+        event_details = await get_event_details(url, extract_event)
+    except Exception as e:
+        print(f"Failed to scrape {url}: {e}")
+        run_metrics.increment("events_failed", host=urlsplit(url).hostname)
+        frontier.fail(url, f"{type(e).__name__}: {e}")
+        # The event may still exist, so it must not be deleted from the vector storage
+        seen_event_ids.add(get_event_id(url))
         return
-    event_details: dict[str] = {}
-
-    # region Extracting event details
-
-    # Extracting event title
-    event_title_tag: Tag = event_soup.find("h2", property="name")
-    event_title = event_title_tag.text.strip() if event_title_tag else "N/A"
-    event_details["event_title"] = event_title
-
-    # Finding divs for both time and location
-    event_content_details_divs: List[Tag] = event_soup.find_all("div", class_="content-details-box")
-
-    # Extracting event time
-    event_time = event_content_details_divs[0].text.strip() if event_content_details_divs else "N/A"
-    event_details["event_time"] = event_time
 
-    # Extracting event location
-    event_location = event_content_details_divs[1].text.strip() if event_content_details_divs else "N/A"
-    event_details["event_location"] = event_location
-
-    # Extracting event description
-    event_description_tag: Tag = event_soup.find("div", class_="content-details-description")
-    event_description = event_description_tag.text.strip() if event_description_tag else "N/A"
-    event_details["event_description"] = event_description
-
-    # Finding div for right column info
-    event_right_column_div: Tag = event_soup.find("div", class_="content-info-column conference")
-    # Extracting all divs inside
-    event_right_column_divs: List[Tag] = event_right_column_div.find_all("div") if event_right_column_div else []
+    await save_event_details(event_details)
 
-    # Extracting event fee
-    event_fee_tag: Tag = event_right_column_divs[0]
-    event_fee = event_fee_tag.text.strip() if event_fee_tag else "N/A"
-    event_details["event_fee"] = event_fee
 
-    # Extracting event organizers
-    event_organizers_tag: Tag = event_right_column_divs[1]
-    event_organizers = event_organizers_tag.text.strip() if event_organizers_tag else "N/A"
-    event_details["event_organizers"] = event_organizers
+async def scrape_unikon_events(url: str) -> None:
+    """
+    Scrapes events from a given subset of events on unikonferencje.pl as defined by the URLs in .env file.
+    Delegates scraping and saving of individual events to scrape_unikon_event(), which starts as soon as the first
+    listing page is parsed, while the following listing pages are still being walked.
+    :param url: URL to scrape event URLs from
+    :return: None
+    """
+    base_url = "https://unikonferencje.pl"
 
-    # Extracting event scientific disciplines
-    event_disciplines_tag: Tag = event_right_column_divs[2]
-    event_disciplines = event_disciplines_tag.text.strip() if event_disciplines_tag else "N/A"
-    event_details["event_disciplines"] = event_disciplines
+    async def produce_event_urls(enqueue: Callable[[str], Awaitable[None]]) -> None:
+        page_index = 1
+        while True:
+            try:
+                page_event_urls, has_next_page = await get_event_urls(
+                    f"{url},s{page_index}", extract_unikon_listing, UNIKON_LISTING_STRAINER
+                )
+            except Exception:
+                print(f"Failed to get response from {url},s{page_index}")
+                failed_hosts.add(urlsplit(url).hostname)
+                return
+            for event_url in page_event_urls:
+                await enqueue(base_url + event_url)
+            page_index += 1
 
-    # Extracting event keywords
-    event_keywords_tag: Tag = event_right_column_divs[3]
-    event_keywords = event_keywords_tag.text.strip() if event_keywords_tag else "N/A"
-    event_details["event_keywords"] = event_keywords
+            if not has_next_page:
+                break
 
-    # Setting event source
-    event_details["source"] = url
+    event_count = await scheduler.pipeline(produce_event_urls, lambda event_url: scrape_event(event_url, "unikon"))
+    print(f"Found {event_count} events on Unikonferencje - {url.split('/')[-1]}")
 
-    # endregion
 
-    await save_event_details(event_details)
+async def scrape_unikon_event(url: str) -> None:
+    """
+    Scrapes details of a single event from unikonferencje.pl and saves them to the event store via scrape_event_page().
+    :param url: URL of the event to scrape and save
+    :return: None
+    """
+    await scrape_event_page(url, "unikon", extract_unikon_event)
 
 
 async def scrape_brite_events(url: str) -> None:
     """
     Scrapes events from a given subset of events on eventbrite.com as defined by the URLs in .env file.
-    Delegates scraping and saving of individual events to scrape_brite_event().
+    Delegates scraping and saving of individual events to scrape_brite_event(), which starts as soon as the first
+    listing page is parsed, while the following listing pages are still being walked.
     :param url: URL to scrape event URLs from
     :return: None
     """
-    event_urls: List[str] = []
-    page_index = 1
-    while True:
-        try:
-            event_list_soup: BeautifulSoup = await get_soup_from_url(f"{url[:-1]}{page_index}")
-        except Exception:
-            print(f"Failed to get response from {url[:-1]}{page_index}")
-            return
-        event_urls.extend(anchor["href"] for anchor in event_list_soup.find_all("a", class_="event-card-link"))
-        event_urls = list(set(event_urls))  # Remove duplicates
-        page_index += 1
-
-        next_page_button: Tag = event_list_soup.find("button", aria_label="Next Page")
-        if next_page_button is None:
-            break
 
-    print(f"Found {len(event_urls)} events on Eventbrite - {url.split('/')[-2]}")
+    async def produce_event_urls(enqueue: Callable[[str], Awaitable[None]]) -> None:
+        event_urls = set()  # Events may appear on more than one listing page
+        page_index = 1
+        while True:
+            try:
+                page_event_urls, has_next_page = await get_event_urls(
+                    f"{url[:-1]}{page_index}", extract_brite_listing, BRITE_LISTING_STRAINER
+                )
+            except Exception:
+                print(f"Failed to get response from {url[:-1]}{page_index}")
+                failed_hosts.add(urlsplit(url).hostname)
+                return
+            for event_url in page_event_urls:
+                if event_url not in event_urls:
+                    event_urls.add(event_url)
+                    await enqueue(event_url)
+            page_index += 1
 
-    tasks = []
-    for event_url in event_urls:
-        tasks.append(asyncio.create_task(scrape_brite_event(event_url)))
+            if not has_next_page:
+                break
 
-    await asyncio.gather(*tasks)
+    event_count = await scheduler.pipeline(produce_event_urls, lambda event_url: scrape_event(event_url, "brite"))
+    print(f"Found {event_count} events on Eventbrite - {url.split('/')[-2]}")
 
 
 async def scrape_brite_event(url: str) -> None:
     """
-    Scrapes details of a single event from eventbrite.com. Later saves the details to a JSON file via
-    save_event_details().
+    Scrapes details of a single event from eventbrite.com and saves them to the event store via scrape_event_page().
     :param url: URL of the event to scrape and save
     :return: None
     """
-    try:
-        event_soup: BeautifulSoup = await get_soup_from_url(url)
-    except Exception:
-        print(f"Failed to get response from {url}")
-        return
-    event_details: dict[str] = {}
-    # region Extracting event details
-
-    # Extracting event title
-    event_title_tag: Tag = event_soup.find("h1", class_="event-title")
-    event_title = event_title_tag.text.strip() if event_title_tag else "N/A"
-    event_details["event_title"] = event_title
-
-    # Extracting event summary
-    event_summary_tag: Tag = event_soup.find("p", class_="summary")
-    event_summary = event_summary_tag.text.strip() if event_summary_tag else "N/A"
-    event_details["event_summary"] = event_summary
-
-    # Extracting event date
-    event_date_tag: Tag = event_soup.find("div", attrs={"data-testid": "display-date-container"})
-    event_date = event_date_tag.text.strip() if event_date_tag else "N/A"
-    event_details["event_date"] = event_date
-
-    # Extracting event location
-    event_location_tag: Tag = event_soup.find("div", class_="location-info__address")
-    event_location = event_location_tag.text.strip() if event_location_tag else "N/A"
-
-    # Remove button text
-    if event_location_tag:
-        button = event_location_tag.find("button")
-        if button:
-            button_text = button.text.strip()
-            event_location = event_location.replace(button_text, "").strip()
-    event_details["event_location"] = event_location
-
-    # Extracting event fee
-    event_fee_tag: Tag = event_soup.find("div", class_="conversion-bar__panel-info")
-    event_fee = event_fee_tag.text.strip() if event_fee_tag else "N/A"
-    event_fee = re.sub(r"(?<=zł)\s*", " ", event_fee)
-    event_fee = re.sub(r"zł\s*(\d+)", r"\1 zł", event_fee)
-    event_details["event_fee"] = event_fee
-
-    # Extracting event refund policy
-    event_refund_section: Tag = event_soup.find("section", attrs={"aria-labelledby": "refund-policy-heading"})
-    event_refund_div: Tag = event_refund_section.find("div", class_=None) if event_refund_section else None
-    event_refund_policy = event_refund_div.text.strip() if event_refund_div else "N/A"
-    event_details["event_refund_policy"] = event_refund_policy
-
-    # Extracting event organizer
-    event_organizer_tag: Tag = event_soup.find("a", class_="descriptive-organizer-info-mobile__name-link")
-    event_organizer = event_organizer_tag.text.strip() if event_organizer_tag else "N/A"
-    event_organizer_profile = event_organizer_tag["href"].strip() if event_organizer_tag else "N/A"
-    event_details["event_organizer"] = event_organizer
-    event_details["event_organizer_profile"] = event_organizer_profile
-
-    # Extracting event description
-    event_description_tag: Tag = event_soup.find("div", class_="event-description")
-    event_description = event_description_tag.text.strip() if event_description_tag else "N/A"
-    event_details["event_description"] = event_description
-
-    # Setting event source
-    event_details["source"] = url
-
-    # endregion
-
-    await save_event_details(event_details)
+    await scrape_event_page(url, "brite", extract_brite_event)
 
 
 async def scrape_crossweb_events(url: str) -> None:
@@ -298,167 +528,435 @@ async def scrape_crossweb_events(url: str) -> None:
     :param url: URL to scrape event URLs from
     :return: None
     """
-    try:
-        event_list_soup: BeautifulSoup = await get_soup_from_url(url)
-    except Exception:
-        print(f"Failed to get response from {url}")
-        return
-    event_urls: List[str] = [anchor["href"] for anchor in event_list_soup.find_all("a", class_="clearfix")]
-    print(f"Found {len(event_urls)} events on Crossweb")
-
     base_url = "https://crossweb.pl"
 
-    tasks = []
-    for event_url in event_urls:
-        tasks.append(asyncio.create_task(scrape_crossweb_event(base_url + event_url)))
+    async def produce_event_urls(enqueue: Callable[[str], Awaitable[None]]) -> None:
+        try:
+            event_urls, _ = await get_event_urls(url, extract_crossweb_listing, CROSSWEB_LISTING_STRAINER)
+        except Exception:
+            print(f"Failed to get response from {url}")
+            failed_hosts.add(urlsplit(url).hostname)
+            return
+        for event_url in event_urls:
+            await enqueue(base_url + event_url)
 
-    await asyncio.gather(*tasks)
+    event_count = await scheduler.pipeline(produce_event_urls, lambda event_url: scrape_event(event_url, "crossweb"))
+    print(f"Found {event_count} events on Crossweb")
 
 
 async def scrape_crossweb_event(url: str) -> None:
     """
-    Scrapes details of a single event from crossweb.pl. Later saves the details to a JSON file via
-    save_event_details().
+    Scrapes details of a single event from crossweb.pl and saves them to the event store via scrape_event_page().
     :param url: URL of the event to scrape and save
     :return: None
     """
-    try:
-        event_soup: BeautifulSoup = await get_soup_from_url(url)
-    except Exception:
-        print(f"Failed to get response from {url}")
-        return
-    event_details: dict[str] = {}
+    await scrape_event_page(url, "crossweb", extract_crossweb_event)
 
-    # region Extracting event details
-    # Extracting event title
-    event_title = event_soup.find("div", class_="event-var fw-bold", itemprop="name")
-    event_details["event_title"] = event_title.text.strip() if event_title else "N/A"
 
-    # Extracting event type
-    event_type_label = event_soup.find("div", class_="event-label", string="Typ wydarzenia:")
-    event_details["event_type"] = event_type_label.find_next_sibling("div").text.strip() if event_type_label else "N/A"
+async def retry_dead_letters() -> None:
+    """
+    Scrapes events that failed in earlier runs before any listing is walked, so that they are not starved by the new
+    events. Only events of the sites refreshed in this run are retried.
+    :return: None
+    """
+    dead_letters = {url: kind for url, kind in frontier.dead_letters() if urlsplit(url).hostname in refreshed_hosts}
+    if not dead_letters:
+        return
 
-    # Extracting event category
-    event_category_label = event_soup.find("div", class_="event-label", string="Kategoria:")
-    event_details["event_category"] = (
-        event_category_label.find_next_sibling("div").text.strip() if event_category_label else "N/A"
-    )
+    async def produce_event_urls(enqueue: Callable[[str], Awaitable[None]]) -> None:
+        for event_url in dead_letters:
+            await enqueue(event_url)
 
-    # Extracting event subject
-    event_subject_label = event_soup.find("div", class_="event-label", string="Tematyka:")
-    event_details["event_subject"] = (
-        event_subject_label.find_next_sibling("div").text.strip() if event_subject_label else "N/A"
+    event_count = await scheduler.pipeline(
+        produce_event_urls, lambda event_url: scrape_event(event_url, dead_letters[event_url])
     )
+    print(f"Retried {event_count} events that failed in earlier runs")
 
-    # Extracting event date
-    event_date_label = event_soup.find("div", class_="event-label", string="Data:")
-    event_details["event_date"] = event_date_label.find_next_sibling("div").text.strip() if event_date_label else "N/A"
 
-    # Extracting event time
-    event_time_label = event_soup.find("div", class_="event-label", string="Godzina:")
-    event_details["event_time"] = event_time_label.find_next_sibling("div").text.strip() if event_time_label else "N/A"
+async def resume_unfinished_events() -> None:
+    """
+    Scrapes events left unfinished by an interrupted attempt of the current run, so that they are not lost even if their
+    listing pages cannot be reached anymore. Events found again on the listing pages are claimed only once.
+    :return: None
+    """
+    unfinished_urls = dict(frontier.unfinished_urls())
+    if not unfinished_urls:
+        return
+
+    async def produce_event_urls(enqueue: Callable[[str], Awaitable[None]]) -> None:
+        for event_url in unfinished_urls:
+            await enqueue(event_url)
 
-    # Extracting event language
-    event_language_label = event_soup.find("div", class_="event-label", string="Język:")
-    event_details["event_language"] = (
-        event_language_label.find_next_sibling("div").text.strip() if event_language_label else "N/A"
+    event_count = await scheduler.pipeline(
+        produce_event_urls, lambda event_url: scrape_event(event_url, unfinished_urls[event_url])
     )
+    print(f"Resumed {event_count} unfinished events")
 
-    # Extracting event fee
-    event_fee_label = event_soup.find("div", class_="event-label", string="Wstęp:")
-    event_details["event_fee"] = event_fee_label.find_next_sibling("div").text.strip() if event_fee_label else "N/A"
 
-    # Extracting event city
-    event_city_label = event_soup.find("div", class_="event-label", string="Miasto:")
-    event_details["event_city"] = event_city_label.find_next_sibling("div").text.strip() if event_city_label else "N/A"
+# Scrapers of single events by the kind of URL recorded in the frontier
+EVENT_SCRAPERS: dict[str, Callable[[str], Awaitable[None]]] = {
+    "unikon": scrape_unikon_event,
+    "brite": scrape_brite_event,
+    "crossweb": scrape_crossweb_event,
+}
 
-    # Extracting event location
-    event_location_label = event_soup.find("div", class_="event-label", string="Miejsce:")
-    event_details["event_location"] = (
-        event_location_label.find_next_sibling("div").text.strip() if event_location_label else "N/A"
-    )
 
-    # Extracting event location address
-    event_location_address_label = event_soup.find("div", class_="event-label", string="Adres:")
-    event_details["event_location_address"] = (
-        event_location_address_label.find_next_sibling("div").text.strip() if event_location_address_label else "N/A"
-    )
+# Scrapers of listings by the name of the source, matched against the URLs in .env file
+SOURCE_SCRAPERS: dict[str, Callable[[str], Awaitable[None]]] = {
+    "unikonferencje": scrape_unikon_events,
+    "eventbrite": scrape_brite_events,
+    "crossweb": scrape_crossweb_events,
+}
 
-    # Extracting event registration link
-    event_registration_link = event_soup.find("a", class_="eventDetailLink.apply-link-js")
-    event_details["event_registration_link"] = event_registration_link["href"].strip() if event_registration_link else "N/A"
 
-    # Extracting event webpage
-    event_webpage = event_soup.find("a", class_="eventDetailLink.apply-link-js", target="_blank")
-    event_details["event_webpage"] = event_webpage["href"].strip() if event_webpage else "N/A"
+async def scrape_event(url: str, kind: str) -> None:
+    """
+    Scrapes a single event found on a listing, or only records it when the events are scraped by the workers of a sharded
+    crawl.
+    :param url: URL of the event
+    :param kind: Kind of the event URL, see EVENT_SCRAPERS
+    :return: None
+    """
+    if found_event_urls is not None:
+        found_event_urls.setdefault(url, kind)
+        return
+    await EVENT_SCRAPERS[kind](url)
 
-    # Extracting event speakers
-    event_speakers: List[Tag] = event_soup.find_all("div", class_="speaker-box")
-    event_details["event_speakers"] = (
-        ", ".join(speaker.div.a["href"].split("/")[2].replace("-", " ").strip() for speaker in event_speakers)
-        if event_speakers
-        else "N/A"
-    )
 
-    # Extracting event agenda
-    # If there are two divs with this class, the first one contains the agenda;
-    event_details_outer_div: List[Tag] = event_soup.find_all("div", class_="event-detail description")
-    if len(event_details_outer_div) == 2:
-        event_agenda = event_details_outer_div[0]
-    else:
-        event_agenda = None
+async def crawl(urls: List[str], parser_workers: int) -> None:
+    """
+    Scrapes the listings at the given URLs and all their events, after retrying events that failed in earlier runs and
+    resuming the ones left unfinished by an interrupted attempt, and commits the event details to the event store.
+    :param urls: URLs of the listings to scrape
+    :param parser_workers: Number of processes parsing the pages
+    :return: None
+    """
+    global session, parser_pool
+    # Parsing is CPU-bound, so it is spread across processes instead of blocking the event loop
+    parser_pool = ProcessPoolExecutor(max_workers=parser_workers)
 
-    event_details["event_agenda"] = event_agenda.text.strip() if event_agenda else "N/A"
+    try:
+        # One session for the whole run, so that every scraper and event worker shares the same pool of keep-alive
+        # connections
+        async with create_client_session(HEADERS, connection_stats) as session:
+            await retry_dead_letters()
+            tasks = [asyncio.create_task(resume_unfinished_events())]
+            for url in urls:
+                source_name = get_source_name(url)
+                if source_name is not None:
+                    tasks.append(asyncio.create_task(SOURCE_SCRAPERS[source_name](url)))
+
+            print("Scraping started")
+            await asyncio.gather(*tasks)
+            print("Scraping complete")
+    finally:
+        # Events saved before a failure are committed as well, so that a resumed run does not scrape them again
+        parser_pool.shutdown()
+        commit_stored_events()
+
+
+async def scrape_events(event_urls: dict[str, str], parser_workers: int) -> None:
+    """
+    Scrapes the given events and commits their details to the event store, without walking any listing.
+    :param event_urls: URLs of the events with the kind of each, see EVENT_SCRAPERS
+    :param parser_workers: Number of processes parsing the pages
+    :return: None
+    """
+    global session, parser_pool
+    parser_pool = ProcessPoolExecutor(max_workers=parser_workers)
 
-    # Extracting event description
-    # Description shares the class with agenda, if present
-    if len(event_details_outer_div) == 2:
-        event_description = event_details_outer_div[1]
-    elif len(event_details_outer_div) == 1:
-        event_description = event_details_outer_div[0].find("div", class_="event-var ql-editor")
-    else:
-        event_description = None
+    try:
+        async with create_client_session(HEADERS, connection_stats) as session:
 
-    event_details["event_description"] = event_description.text.strip() if event_description else "N/A"
+            async def produce_event_urls(enqueue: Callable[[str], Awaitable[None]]) -> None:
+                for event_url in event_urls:
+                    await enqueue(event_url)
 
-    # Setting source
-    event_details["source"] = url
-    # endregion
+            event_count = await scheduler.pipeline(
+                produce_event_urls, lambda event_url: EVENT_SCRAPERS[event_urls[event_url]](event_url)
+            )
+            print(f"Scraped {event_count} events")
+    finally:
+        parser_pool.shutdown()
+        commit_stored_events()
 
-    await save_event_details(event_details)
 
+def get_shards(event_urls: dict[str, str], worker_count: int) -> list[dict[str, str]]:
+    """
+    Splits the events between workers by the hash of their URLs, so that the events of every site are spread evenly
+    across all workers and the same event always goes to the same worker.
+    :param event_urls: URLs of the events with the kind of each
+    :param worker_count: Maximum number of workers
+    :return: Events of every worker that got at least one event
+    """
+    shards: list[dict[str, str]] = [{} for _ in range(worker_count)]
+    for event_url, kind in event_urls.items():
+        shards[int(get_event_id(event_url), 16) % worker_count][event_url] = kind
+    return [shard for shard in shards if shard]
 
-async def main():
-    start_time = time.perf_counter()
 
-    tasks = []
-    for url in URLS:
-        if "unikonferencje" in url:
-            tasks.append(asyncio.create_task(scrape_unikon_events(url)))
-        elif "eventbrite" in url:
-            tasks.append(asyncio.create_task(scrape_brite_events(url)))
-        elif "crossweb" in url:
-            tasks.append(asyncio.create_task(scrape_crossweb_events(url)))
+def crawl_shard(config: WorkerConfig, event_urls: dict[str, str], parser_workers: int) -> CrawlResult:
+    """
+    Scrapes a shard of the events in a worker process started by crawl_sharded(), on its own event loop, with its own HTTP
+    session and parser pool. The worker is a fresh process, so it is set up from the given configuration alone and opens
+    its own connections to the frontier, the event store and the HTTP cache shared with the main process.
+    :param config: Configuration of the worker
+    :param event_urls: URLs of the events to scrape with the kind of each
+    :param parser_workers: Number of processes parsing the pages
+    :return: Statistics of the crawl and the IDs of the events seen
+    """
+    global frontier, event_store, http_cache, scheduler, connection_stats, run_metrics, HEADERS, EVENT_REFRESH_AGE
+    global seen_event_ids, stored_urls
+    if config.setup is not None:
+        config.setup()
+    HEADERS = config.headers
+    EVENT_REFRESH_AGE = config.event_refresh_age
+    # URLs are claimed as part of the attempt of the main process
+    frontier = Frontier(config.frontier_path, config.attempt_id)
+    event_store = EventStore(config.event_store_path)
+    http_cache = HttpCache(config.http_cache_dir)
+    # Every worker crawls every site, so each one paces its requests to a site with a share of the limits
+    scheduler = CrawlScheduler(config.worker_count)
+    connection_stats = ConnectionStats()
+    run_metrics = RunMetrics()
+    seen_event_ids = set()
+    stored_urls = []
+
+    asyncio.run(scrape_events(event_urls, parser_workers))
+    frontier.close()
+    event_store.close()
+    # The main process evicts old responses once all workers are done
+    http_cache.close(evict=False)
+    return CrawlResult(seen_event_ids, run_metrics, connection_stats, http_cache.counters(), scheduler.report())
+
+
+async def crawl_sharded(urls: List[str], worker_count: int, parser_workers: int) -> str:
+    """
+    Walks the listings in this process and then scrapes the events found in several worker processes, so that fetching
+    and handling the event pages uses more than one core. The statistics and the state of the workers are merged into
+    the ones of this process.
+    :param urls: URLs of the listings to scrape
+    :param worker_count: Maximum number of workers
+    :param parser_workers: Number of processes parsing the pages, split between the workers
+    :return: Report of the crawl schedulers of this process and all workers
+    """
+    global found_event_urls
+    # Dead letters and unfinished events are scraped by the workers as well
+    found_event_urls = {}
+    try:
+        await crawl(urls, parser_workers)
+        event_urls = found_event_urls
+    finally:
+        found_event_urls = None
+
+    shards = get_shards(event_urls, worker_count)
+    print(f"Scraping {len(event_urls)} events in {len(shards)} shards: " + ", ".join(str(len(shard)) for shard in shards))
+    config = WorkerConfig(
+        frontier.path,
+        frontier.attempt_id,
+        event_store.path,
+        http_cache.cache_dir,
+        HEADERS,
+        EVENT_REFRESH_AGE,
+        len(shards),
+        worker_setup,
+    )
+    loop = asyncio.get_running_loop()
+    # Workers are spawned instead of forked, as this process holds threads and connections that must not be copied
+    with ProcessPoolExecutor(max_workers=max(1, len(shards)), mp_context=multiprocessing.get_context("spawn")) as worker_pool:
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(worker_pool, crawl_shard, config, shard, max(1, parser_workers // len(shards)))
+                for shard in shards
+            )
+        )
+
+    for result in results:
+        seen_event_ids.update(result.seen_event_ids)
+        run_metrics.merge(result.run_metrics)
+        connection_stats.merge(result.connection_stats)
+        http_cache.add_counters(result.http_cache_counters)
+    return "\n".join(report for report in [scheduler.report()] + [result.scheduler_report for result in results] if report)
+
+
+def get_source_name(url: str) -> Optional[str]:
+    return next((source_name for source_name in SOURCE_SCRAPERS if source_name in url), None)
+
+
+def get_refresh_intervals() -> dict[str, float]:
+    """
+    Reads how often every source is refreshed in daemon mode from ETL_REFRESH_INTERVALS, e.g. "eventbrite=60,crossweb=180".
+    :return: Refresh interval in seconds by the name of the source
+    """
+    refresh_intervals = {"eventbrite": 60.0, "crossweb": 180.0, "unikonferencje": 360.0}
+    for entry in os.getenv("ETL_REFRESH_INTERVALS", "").split(","):
+        if "=" in entry:
+            source_name, minutes = entry.split("=", 1)
+            refresh_intervals[source_name.strip()] = float(minutes)
+    return {source_name: minutes * 60 for source_name, minutes in refresh_intervals.items()}
+
+
+async def refresh_sources(urls: List[str]) -> None:
+    """
+    Runs the whole ETL once for the given URLs from .env file: scrapes the events, deletes the ones that disappeared or
+    already ended, merges duplicates and updates the vector storage. Events of other sources are left as they are.
+    Afterward the next refresh of every scraped source is scheduled with some jitter, so that the sources do not
+    synchronize.
+    :param urls: URLs of the listings to scrape
+    :return: None
+    """
+    global vector_writer, indexed_events, seen_event_ids, stored_urls, failed_hosts, refreshed_hosts
+    global vector_storage, run_metrics
+    start_time = time.perf_counter()
+    if frontier.start_run():
+        print("Resuming the interrupted run")
+    indexed_events = get_indexed_events(vector_storage)
+    print(f"{len(indexed_events)} events already indexed")
+    seen_event_ids = set()
+    stored_urls = []
+    failed_hosts = set()
+    refreshed_hosts = {urlsplit(url).hostname for url in urls}
+
+    run_metrics = RunMetrics()
+    initial_counts = (
+        connection_stats.created,
+        connection_stats.reused,
+        vector_storage.embeddings.hits,
+        vector_storage.embeddings.misses,
+    )
+    vector_writer = VectorWriter(vector_storage, run_metrics)
 
-    print("Scraping started")
-    await asyncio.gather(*tasks)
-    print("Scraping complete")
+    parser_workers = int(os.getenv("ETL_PARSER_WORKERS", str(os.cpu_count() or 1)))
+    if WORKERS > 1:
+        scheduler_report = await crawl_sharded(urls, WORKERS, parser_workers)
+    else:
+        await crawl(urls, parser_workers)
+        scheduler_report = scheduler.report()
+
+    delete_disappeared_events()
+    prune_ended_events()
+    await index_events()
+    remove_legacy_event_files()
+
+    # A rebuilt collection replaces the active one only once it is complete and valid
+    if is_being_built(vector_storage) and not activate_vector_storage(vector_storage):
+        # The embedding cache stays open for the lifetime of the process, so it is reused instead of opened again
+        vector_storage = connect_to_vector_storage(vector_storage.embeddings)
+
+    # Only a run that got this far is finished, otherwise the next start resumes it
+    frontier.finish_run()
+    refresh_intervals = get_refresh_intervals()
+    refresh_jitter = float(os.getenv("ETL_REFRESH_JITTER", "0.1"))
+    for source_name in {get_source_name(url) for url in urls} - {None}:
+        refresh_interval = refresh_intervals.get(source_name, 6 * 60 * 60)
+        frontier.schedule_refresh(
+            source_name, time.time() + refresh_interval * random.uniform(1 - refresh_jitter, 1 + refresh_jitter)
+        )
+
+    print(frontier.report())
+    print(connection_stats.report())
+    print(scheduler_report)
+    print(http_cache.report())
+    print(vector_storage.embeddings.report())
+    print(vector_writer.report())
+    print(run_metrics.report())
+
+    # The statistics are kept for the lifetime of the process, the report has only the ones of this run
+    run_metrics.increment("connections_opened", connection_stats.created - initial_counts[0])
+    run_metrics.increment("connections_reused", connection_stats.reused - initial_counts[1])
+    run_metrics.increment("embedding_cache_hits", vector_storage.embeddings.hits - initial_counts[2])
+    run_metrics.increment("embedding_cache_misses", vector_storage.embeddings.misses - initial_counts[3])
+    run_metrics.write(os.getenv("ETL_RUN_REPORT_PATH", "cache/run_report.json"), os.getenv("ETL_PROMETHEUS_TEXTFILE"))
 
     end_time = time.perf_counter()
     print(f"Total runtime: {end_time - start_time:.2f} seconds")
 
 
-def clear_output_dir():
-    if os.path.exists(OUTPUT_DIR):
-        print("Removing existing output directory")
-        print(os.listdir(OUTPUT_DIR))
-        for file in os.listdir(OUTPUT_DIR):
-            if file:
-                os.remove(os.path.join(OUTPUT_DIR, file))
-                print(f"Deleted: {os.path.join(OUTPUT_DIR, file)}")
+def write_timestamp() -> None:
+    # Update the last update timestamp
+    with open("timestamp/last_update_timestamp.txt", "w") as f:
+        f.write(datetime.now().strftime("%d-%m-%Y %H:%M"))
+
+
+def close() -> None:
+    frontier.close()
+    event_store.close()
+    http_cache.close()
+    vector_storage.embeddings.close()
+
+
+async def main():
+    await refresh_sources(URLS)
+    close()
+
+
+async def run_daemon() -> None:
+    """
+    Keeps the ETL running and refreshes every source on its own interval, fast-moving sources more often than others.
+    Listing pages are revalidated with conditional requests and only new event pages or ones not fetched recently are
+    requested, so a refresh costs much less than a full crawl.
+    :return: None
+    """
+    source_names = sorted({get_source_name(url) for url in URLS} - {None})
+    if not source_names:
+        print("No known sources in SCRAPING_URLS, nothing to refresh")
+        close()
+        return
+    try:
+        while True:
+            now = time.time()
+            due_source_names = [name for name in source_names if (frontier.next_refresh_at(name) or 0) <= now]
+            if not due_source_names:
+                next_refresh_at = min(frontier.next_refresh_at(name) for name in source_names)
+                print(f"Next refresh in {(next_refresh_at - now) / 60:.1f} minutes")
+                await asyncio.sleep(next_refresh_at - now)
+                continue
+
+            print(f"Refreshing {', '.join(due_source_names)}")
+            await refresh_sources([url for url in URLS if get_source_name(url) in due_source_names])
+            write_timestamp()
+            # Caches are trimmed after every refresh, as the daemon never closes them
+            http_cache.evict()
+            vector_storage.embeddings.evict()
+    finally:
+        close()
+
+
+def remove_legacy_event_files() -> None:
+    """
+    Removes JSON files of single events written by earlier versions of the ETL, their details are in the event store now.
+    :return: None
+    """
+    legacy_files = [file for file in os.listdir(OUTPUT_DIR) if file.endswith(".json")]
+    for file in legacy_files:
+        os.remove(os.path.join(OUTPUT_DIR, file))
+    if legacy_files:
+        print(f"Removed {len(legacy_files)} legacy event files")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrapes tech events and saves them in the vector storage")
+    parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        default=os.getenv("ETL_FULL_REBUILD", "false").lower() == "true",
+        help="Embed every event again into a new version of the collection instead of updating only the changed events, "
+        "the active version keeps answering queries until the new one is validated and activated",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("ETL_WORKERS", "1")),
+        help="Number of processes scraping the events, the listings are walked by the main process",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=os.getenv("ETL_DAEMON", "false").lower() == "true",
+        help="Keep running and refresh every source on its own interval set in ETL_REFRESH_INTERVALS",
+    )
+    args = parser.parse_args()
+
     print("ETL process is running, please wait...")
 
     try:
@@ -470,19 +968,36 @@ if __name__ == "__main__":
 
     # last_update_timestamp = None  # For testing purposes
 
-    if last_update_timestamp is None or datetime.now() - last_update_timestamp > timedelta(hours=6):
+    # The frontier remembers the progress of the current run, so a run interrupted before it finished is resumed right away
+    frontier = Frontier(os.getenv("FRONTIER_PATH", "cache/frontier.sqlite3"))
+    resuming = frontier.unfinished_run_exists()
+
+    if args.daemon or resuming or last_update_timestamp is None or datetime.now() - last_update_timestamp > timedelta(hours=6):
         OUTPUT_DIR = os.getenv("SCRAPING_OUTPUT_DIR")
-        clear_output_dir()
-        vector_storage = create_new_vector_storage()
-        URLS: List[str] = os.getenv("SCRAPING_URLS").split(",")
-        visited_urls = set()
+        # A resumed rebuild must not delete the events saved before the interruption, so it continues incrementally
+        if args.full_rebuild and not resuming:
+            print("Rebuilding the whole vector storage")
+            vector_storage = create_new_vector_storage()
+        else:
+            vector_storage = connect_to_vector_storage()
+            print("Updating the vector storage incrementally")
+        event_store = EventStore(os.path.join(OUTPUT_DIR, "events.sqlite3"))
+        URLS: List[str] = [url.strip() for url in os.getenv("SCRAPING_URLS").split(",")]
         HEADERS = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         }
-        asyncio.run(main())
-
-        # Update the last update timestamp
-        with open("timestamp/last_update_timestamp.txt", "w") as f:
-            f.write(datetime.now().strftime("%d-%m-%Y %H:%M"))
+        connection_stats = ConnectionStats()
+        scheduler = CrawlScheduler()
+        http_cache = HttpCache(os.getenv("HTTP_CACHE_DIR", "cache"))
+        # Event pages fetched more recently than this are not requested again, only in daemon mode
+        EVENT_REFRESH_AGE = float(os.getenv("ETL_EVENT_REFRESH_HOURS", "24")) * 60 * 60 if args.daemon else 0
+        WORKERS = args.workers
+
+        if args.daemon:
+            print("Running as a daemon")
+            asyncio.run(run_daemon())
+        else:
+            asyncio.run(main())
+            write_timestamp()
     else:
         print("Last update was less than 6 hours ago. Skipping scraping.")
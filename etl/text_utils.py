@@ -0,0 +1,51 @@
+import re
+import unicodedata
+
+# Abbreviations of English and Polish month names, as they are written on the scraped sites after folding
+MONTHS = {
+    **{
+        name: index
+        for index, name in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)
+    },
+    **{
+        name: index
+        for index, name in enumerate(["sty", "lut", "mar", "kwi", "maj", "cze", "lip", "sie", "wrz", "paz", "lis", "gru"], 1)
+    },
+}
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})[./](\d{1,2})[./](\d{4})\b")
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+# Numbers of times, like in "grudnia 18:00" or "18:30 grudnia", are not taken for days
+MONTH_DAY_DATE = re.compile(r"\b([a-z]{3})[a-z]*\.?\s+(\d{1,2})\b(?![:.]\d)(?:,?\s+(\d{4})\b)?")
+DAY_MONTH_DATE = re.compile(r"(?<![:.])\b(\d{1,2})\s+([a-z]{3})[a-z]*\.?(?:\s+(\d{4})\b)?")
+DATE_PATTERNS = (NUMERIC_DATE, ISO_DATE, MONTH_DAY_DATE, DAY_MONTH_DATE)
+
+
+def fold_text(text: str) -> str:
+    # Lowercase text without Polish diacritics
+    text = unicodedata.normalize("NFKD", text.lower().replace("ł", "l"))
+    return "".join(character for character in text if not unicodedata.combining(character))
+
+
+def find_date_parts(text: str) -> list[tuple[int, int, int]]:
+    """
+    Finds all dates in a text in any of the date formats used by the scraped sites, like "27.02.2025", "2025-02-27",
+    "Feb 27, 2025" or "27 lutego", in the order in which they appear. Days and months are not validated.
+    :param text: Folded text, see fold_text()
+    :return: Year (0 if the date has none), month and day of every date
+    """
+    candidates = [(match.start(), int(match[3]), int(match[2]), int(match[1])) for match in NUMERIC_DATE.finditer(text)]
+    candidates += [(match.start(), int(match[1]), int(match[2]), int(match[3])) for match in ISO_DATE.finditer(text)]
+    for match in MONTH_DAY_DATE.finditer(text):
+        if match[1] in MONTHS:
+            candidates.append((match.start(), int(match[3] or 0), MONTHS[match[1]], int(match[2])))
+    for match in DAY_MONTH_DATE.finditer(text):
+        if match[2] in MONTHS:
+            candidates.append((match.start(), int(match[3] or 0), MONTHS[match[2]], int(match[1])))
+    return [(year, month, day) for _, year, month, day in sorted(candidates)]
+
+
+def remove_dates(text: str) -> str:
+    # Text without its dates, so that the numbers of dates are not taken for times
+    for pattern in DATE_PATTERNS:
+        text = pattern.sub(" ", text)
+    return text
@@ -1,25 +1,147 @@
+import asyncio
 import json
 import os
-import shutil
+import random
+import time
+from datetime import datetime
+from typing import Callable, Optional
 
 import chromadb
+import tiktoken
+from embedding_cache import CachedEmbeddings
+from event_metadata import METADATA_VERSION, get_event_metadata
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
+from run_metrics import RunMetrics
 
 
-async def add_data_to_vector_storage(vector_storage: Chroma, event_details: dict[str], file_path: str) -> None:
+class VectorWriter:
+    """
+    Write-behind buffer collecting chunks of many events and adding them to the vector storage in batches.
+    Batches are limited by the number of chunks and the number of tokens accepted by a single embedding request,
+    and only a bounded number of batches is embedded and upserted at the same time.
+    Tokens are counted by the given function, or by the tokenizer of the embedding model loaded when the first chunks are added.
+    """
+
+    def __init__(
+        self, vector_storage: Chroma, run_metrics: RunMetrics, count_tokens: Optional[Callable[[str], int]] = None
+    ) -> None:
+        self.vector_storage = vector_storage
+        self.run_metrics = run_metrics
+        self.max_batch_items = int(os.getenv("VECTOR_BATCH_MAX_ITEMS", "1000"))
+        self.max_batch_tokens = int(os.getenv("VECTOR_BATCH_MAX_TOKENS", "250000"))
+        self.max_in_flight = int(os.getenv("VECTOR_BATCH_MAX_IN_FLIGHT", "4"))
+        self.count_tokens = count_tokens
+
+        self.pending_texts: list[str] = []
+        self.pending_metadatas: list[dict[str]] = []
+        self.pending_ids: list[str] = []
+        self.pending_tokens = 0
+        self.writes: set[asyncio.Task] = set()
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        # Statistics of the current run
+        self.batches = 0
+        self.written_chunks = 0
+        self.written_tokens = 0
+        self.failed_events: dict[str, str] = {}
+
+    async def add(self, texts: list[str], metadatas: list[dict[str]], ids: list[str]) -> None:
+        """
+        Adds chunks of a single event to the buffer, writing the buffer out first if the chunks do not fit in the current batch.
+        Waits while too many batches are waiting to be written, so that the buffer does not grow without limits.
+
+        Parameters:
+            texts (list[str]): Chunks of the event.
+            metadatas (list[dict[str]]): Metadata of every chunk, with the event's ID under "event_id".
+            ids (list[str]): IDs of the vectors.
+        """
+        if self.count_tokens is None:
+            self.count_tokens = create_token_counter(self.vector_storage.embeddings.model)
+        tokens = sum(self.count_tokens(text) for text in texts)
+        if self.pending_texts and (
+            len(self.pending_texts) + len(texts) > self.max_batch_items or self.pending_tokens + tokens > self.max_batch_tokens
+        ):
+            self._write_pending()
+
+        self.pending_texts.extend(texts)
+        self.pending_metadatas.extend(metadatas)
+        self.pending_ids.extend(ids)
+        self.pending_tokens += tokens
+
+        while len(self.writes) >= 2 * self.max_in_flight:
+            await asyncio.wait(self.writes, return_when=asyncio.FIRST_COMPLETED)
+
+    async def flush(self) -> None:
+        """
+        Writes out the remaining chunks and waits for all batches to be written.
+        """
+        if self.pending_texts:
+            self._write_pending()
+        if self.writes:
+            await asyncio.wait(self.writes)
+
+    def _write_pending(self) -> None:
+        task = asyncio.create_task(
+            self._write(self.pending_texts, self.pending_metadatas, self.pending_ids, self.pending_tokens)
+        )
+        self.writes.add(task)
+        task.add_done_callback(self.writes.discard)
+
+        self.pending_texts, self.pending_metadatas, self.pending_ids = [], [], []
+        self.pending_tokens = 0
+
+    async def _write(self, texts: list[str], metadatas: list[dict[str]], ids: list[str], tokens: int) -> None:
+        async with self.semaphore:
+            try:
+                # One embedding request and one bulk upsert for the whole batch, timed separately to tell OpenAI from Chroma
+                with self.run_metrics.time("embed"):
+                    embeddings = await self.vector_storage.embeddings.aembed_documents(texts)
+                with self.run_metrics.time("upsert"):
+                    await asyncio.to_thread(
+                        self.vector_storage._collection.upsert,
+                        ids=ids,
+                        embeddings=embeddings,
+                        documents=texts,
+                        metadatas=metadatas,
+                    )
+                self.run_metrics.increment("chunks_embedded", len(texts))
+                self.run_metrics.increment("tokens_embedded", tokens)
+                self.batches += 1
+                self.written_chunks += len(texts)
+                self.written_tokens += tokens
+            except Exception as e:
+                for metadata in metadatas:
+                    self.failed_events[metadata["event_id"]] = str(e)
+                print(f"Error while adding a batch of {len(texts)} chunks to vector_storage: {e}")
+
+    def report(self) -> str:
+        return (
+            f"Vector storage: {self.written_chunks} chunks ({self.written_tokens} tokens) written in {self.batches} batches, "
+            f"{len(self.failed_events)} events failed"
+        )
+
+
+async def add_data_to_vector_storage(
+    vector_writer: VectorWriter, event_details: dict[str], event_id: str, content_hash: str
+) -> None:
     """
     It divides the extracted event information from the website into smaller parts and adds them to the vector storage after automatically converting them into vectors.
-    Each vector is added with the path to the file where the data changed into this vector is stored.
+    Each vector is added with the event's ID, under which its details are kept in the event store, and the hash of its content.
+    Dates, city, fee and site of the event are normalized into metadata, so that searches can be filtered on them.
+    Vectors get IDs derived from the event's ID, so adding the same event again overwrites its vectors instead of duplicating them.
+    The parts are buffered by the vector writer and written together with parts of other events.
 
     Parameters:
-        vector_storage (Chroma): The vector storage to which the data is added.
+        vector_writer (VectorWriter): The buffer of the vector storage to which the data is added.
         event_details (dict[str]): All data about the event.
-        file_path (str): The path to the file where all event data is held.
+        event_id (str): Stable ID of the event.
+        content_hash (str): Hash of the event details, used to detect changed events in the next runs.
 
     Note:
-        If there is an error while adding data to the vector storage, it is handled internally and not re-raised.
+        If there is an error while splitting the data, it is handled internally and not re-raised.
+        Errors while writing a batch are counted per event by the vector writer.
     """
     try:
         # Filter event information, removing descriptions (as they are long and need to be split separately) and non-event related values
@@ -36,7 +158,8 @@ async def add_data_to_vector_storage(vector_storage: Chroma, event_details: dict
                 chunk_size=1200, chunk_overlap=150, length_function=len, separators=["\n\n", "\n", ". ", "! ", "? ", " ", ""]
             )
 
-            chunks = text_splitter.split_text(description)
+            with vector_writer.run_metrics.time("split"):
+                chunks = text_splitter.split_text(description)
         else:
             chunks = []
 
@@ -44,66 +167,329 @@ async def add_data_to_vector_storage(vector_storage: Chroma, event_details: dict
         chunks.append(json.dumps(filtered_event_details, ensure_ascii=False))
 
         # Add the text chunks to the vector storage
-        await vector_storage.aadd_texts(texts=chunks, metadatas=[{"location": file_path}] * len(chunks))
+        metadata = {
+            "event_id": event_id,
+            "content_hash": content_hash,
+            "source": event_details["source"],
+            "metadata_version": METADATA_VERSION,
+            **get_event_metadata(event_details),
+        }
+        await vector_writer.add(
+            texts=chunks, metadatas=[metadata] * len(chunks), ids=[f"{event_id}-{index}" for index in range(len(chunks))]
+        )
     except Exception as e:
-        print(f"Error while adding {file_path} to vector_storage: {e}")
+        print(f"Error while adding event {event_id} to vector_storage: {e}")
 
 
-def create_new_vector_storage() -> Chroma:
+def get_indexed_events(vector_storage: Chroma) -> dict[str, dict[str]]:
     """
-    This function creates a new vector storage collection in ChromaDB and allows to connect to it via the network. If the collection already exists, it is being deleted and recreated, but empty.
+    Collects the events already present in the vector storage. Vectors that do not belong to any identified event are deleted.
+
+    Parameters:
+        vector_storage (Chroma): The vector storage to read from.
 
     Returns:
-        Chroma: Object enabling connection to the collection via the network
+        dict[str, dict[str]]: Metadata of every indexed event (content hash and source URL) by event ID.
+    """
+    indexed_events = {}
+    unidentified_vector_ids = []
+    stored_vectors = vector_storage.get(include=["metadatas"])
+    for vector_id, metadata in zip(stored_vectors["ids"], stored_vectors["metadatas"]):
+        if metadata and "event_id" in metadata:
+            indexed_events[metadata["event_id"]] = metadata
+        else:
+            unidentified_vector_ids.append(vector_id)
+
+    # Vectors saved before events had IDs cannot be matched with scraped events, so they are deleted and their events are added again
+    if unidentified_vector_ids:
+        vector_storage.delete(ids=unidentified_vector_ids)
+        print(f"Deleted {len(unidentified_vector_ids)} vectors without event IDs")
+    return indexed_events
+
+
+def delete_events_from_vector_storage(vector_storage: Chroma, event_ids: list[str]) -> None:
+    """
+    Deletes all vectors of the given events from the vector storage.
+
+    Parameters:
+        vector_storage (Chroma): The vector storage to delete from.
+        event_ids (list[str]): IDs of the events to delete.
+    """
+    # Delete in batches to keep the size of the where clause reasonable
+    for index in range(0, len(event_ids), 500):
+        vector_storage.delete(where={"event_id": {"$in": event_ids[index : index + 500]}})
+
+
+def delete_ended_events_from_vector_storage(vector_storage: Chroma, before_ts: float) -> list[str]:
+    """
+    Finds the vectors of all events that ended before the given time by their end metadata and deletes them in bulk.
+    Events whose end could not be parsed have no end metadata and are kept.
+
+    Parameters:
+        vector_storage (Chroma): The vector storage to delete from.
+        before_ts (float): Unix timestamp, events ending earlier are deleted.
+
+    Returns:
+        list[str]: IDs of the deleted events.
+    """
+    where = {"end_ts": {"$lt": int(before_ts)}}
+    ended_vectors = vector_storage.get(where=where, include=["metadatas"])
+    event_ids = list({metadata["event_id"] for metadata in ended_vectors["metadatas"] if metadata and "event_id" in metadata})
+    if ended_vectors["ids"]:
+        vector_storage.delete(ids=ended_vectors["ids"])
+    return event_ids
+
+
+def estimate_tokens(text: str) -> int:
+    # Upper estimate of the tokens of a text, tokens of Polish texts are rarely shorter than 3 characters
+    return len(text) // 3 + 1
+
+
+def create_token_counter(model: str) -> Callable[[str], int]:
+    """
+    Creates the function counting tokens of texts for the embedding model.
+    The tokenizer downloads its vocabulary when it is first loaded, so without network access the tokens are estimated from the length of the texts.
+
+    Parameters:
+        model (str): Name of the embedding model.
+
+    Returns:
+        Callable[[str], int]: The function returning the number of tokens of a text.
+    """
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception as e:
+        print(f"Could not load the tokenizer of {model}, estimating tokens from the length of texts: {e}")
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def create_embedding_function() -> CachedEmbeddings:
+    # Embedding function used to create vectors, only chunks that were never embedded before are sent to OpenAI
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-3-small", max_retries=5, request_timeout=15, retry_max_seconds=4, retry_min_seconds=1
+    )
+    return CachedEmbeddings(embeddings, embeddings.model, os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3"))
+
+
+# Name of the collection used before collections were versioned, and the prefix of the versioned collections
+COLLECTION_NAME = "PolandEventInfo"
+# Collection whose metadata points to the active version ("active") and to the version being built ("building")
+ALIAS_COLLECTION_NAME = "PolandEventInfo-alias"
+
+
+def create_chroma_client() -> chromadb.HttpClient:
+    """
+    Creates a client of the ChromaDB server.
+
+    Returns:
+        chromadb.HttpClient: Client connected via the network.
 
     Raises:
-        Exception: If there is an error while resetting collection.
+        ValueError: If not all required environment variables are set.
+    """
+
+    # Get the Chroma's host and port from the environment variables
+    CHROMA_PORT = os.getenv("CHROMADB_PORT")
+    CHROMA_HOST = os.getenv("CHROMADB_HOST")
+
+    # Check if all required environment variables are set
+    if CHROMA_HOST is None or CHROMA_PORT is None:
+        raise ValueError("Not all required environment variables are set")
+
+    return chromadb.HttpClient(host=CHROMA_HOST, port=int(CHROMA_PORT))
+
+
+def get_alias(client: chromadb.ClientAPI) -> dict[str]:
     """
+    Reads the pointer to the active version of the collection, creating it for the unversioned collection if it does not exist yet.
+
+    Parameters:
+        client (chromadb.ClientAPI): Client of the ChromaDB server.
 
+    Returns:
+        dict[str]: Name of the active collection under "active" and of the collection being built under "building", if any.
+    """
     try:
-        # Get the Chroma's host and port from the environment variables
-        CHROMA_PORT = int(os.getenv("CHROMADB_PORT"))
-        CHROMA_HOST = os.getenv("CHROMADB_HOST")
-        CHROMA_DIR = os.getenv("CHROMADB_DIR")
-
-        # Check if all required environment variables are set
-        if CHROMA_DIR is None or CHROMA_HOST is None or CHROMA_PORT is None:
-            raise ValueError("Not all required environment variables are set")
-
-        # Embedding function used to create vectors
-        embedding_function = OpenAIEmbeddings(
-            model="text-embedding-3-small", max_retries=5, request_timeout=15, retry_max_seconds=4, retry_min_seconds=1
-        )
+        return dict(client.get_collection(ALIAS_COLLECTION_NAME).metadata)
+    except Exception:
+        return dict(client.create_collection(ALIAS_COLLECTION_NAME, metadata={"active": COLLECTION_NAME}).metadata)
+
+
+def set_alias(client: chromadb.ClientAPI, alias: dict[str]) -> None:
+    # Modifying the metadata of a collection is a single atomic update, so readers see either the old or the new pointer
+    client.get_collection(ALIAS_COLLECTION_NAME).modify(metadata=alias)
+
+
+def connect_to_vector_storage(embedding_function: Optional[CachedEmbeddings] = None) -> Chroma:
+    """
+    This function connects via the network to the vector storage collection in ChromaDB that the ETL writes to, creating it if it does not exist yet.
+    It is the active version of the collection, or the new version if the previous run was interrupted while rebuilding it.
+
+    Parameters:
+        embedding_function (Optional[CachedEmbeddings]): Embedding function of an earlier connection to reuse, so that its cache is not opened twice. A new one is created if not given.
+
+    Returns:
+        Chroma: Object enabling connection to the collection via the network
+
+    Raises:
+        ValueError: If not all required environment variables are set.
+    """
+    client = create_chroma_client()
+    alias = get_alias(client)
+    collection_name = alias.get("building", alias["active"])
+    if "building" in alias:
+        print(f"Continuing to build {collection_name}")
+
+    # Create a network connection to the vector storage
+    vector_storage = Chroma(
+        client=client, collection_name=collection_name, embedding_function=embedding_function or create_embedding_function()
+    )
+    return vector_storage
 
-        # Remove the existing collection
-        if os.path.exists(CHROMA_DIR):
-            # Check whether the number of files indicate the need to delete the previous collection
-            if len(os.listdir(CHROMA_DIR)) > 1:
-                for item in os.listdir(CHROMA_DIR):
-                    item_path = os.path.join(CHROMA_DIR, item)
-                    if os.path.isfile(item_path) or os.path.islink(item_path):
-                        os.unlink(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                print("Vector storage directory cleaned successfully")
-
-                # Create new empty collection files to keep the vector storage working properly
-                new_vector_storage_files = Chroma(
-                    collection_name="PolandEventInfo", embedding_function=embedding_function, persist_directory=CHROMA_DIR
+
+def create_new_vector_storage() -> Chroma:
+    """
+    This function creates a new, empty version of the vector storage collection in ChromaDB and allows to connect to it via the network.
+    The active version keeps serving queries while the new one is built, until activate_vector_storage() switches to it.
+
+    Returns:
+        Chroma: Object enabling connection to the new collection via the network
+
+    Raises:
+        ValueError: If not all required environment variables are set.
+    """
+    client = create_chroma_client()
+    alias = get_alias(client)
+    collection_name = f"{COLLECTION_NAME}-v{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    set_alias(client, {**alias, "building": collection_name})
+    print(f"Building new vector storage collection {collection_name}, {alias['active']} stays active meanwhile")
+
+    vector_storage = Chroma(client=client, collection_name=collection_name, embedding_function=create_embedding_function())
+    return vector_storage
+
+
+def validate_vector_storage(vector_storage: Chroma, active_collection: Optional[chromadb.Collection]) -> list[str]:
+    """
+    Checks whether a newly built version of the collection is good enough to replace the active one.
+    Besides its size, a sample of the events of the active version has to be found in it with the same content, and a
+    sample of its chunks has to be found again by their own text, which fails if the vectors do not match the texts.
+
+    Parameters:
+        vector_storage (Chroma): The newly built version.
+        active_collection (Optional[chromadb.Collection]): The active version, None if it does not exist yet.
+
+    Returns:
+        list[str]: Reasons why the new version is not valid, empty if it is valid.
+    """
+    problems = []
+    active_count = active_collection.count() if active_collection is not None else 0
+    count = vector_storage._collection.count()
+    min_ratio = float(os.getenv("VECTOR_STORAGE_MIN_RATIO", "0.5"))
+    min_count = max(int(os.getenv("VECTOR_STORAGE_MIN_DOCUMENTS", "1")), int(active_count * min_ratio))
+    if count < min_count:
+        problems.append(f"{count} documents, expected at least {min_count}")
+    sample_size = int(os.getenv("VECTOR_STORAGE_VALIDATION_SAMPLE", "5"))
+
+    # Events that have not ended yet are carried over from the active version, unless they changed or disappeared since
+    if active_count:
+        active_sample = active_collection.get(
+            limit=sample_size, offset=random.randrange(max(active_count - sample_size, 0) + 1), include=["metadatas"]
+        )
+        expected_hashes = {
+            metadata["event_id"]: metadata.get("content_hash")
+            for metadata in active_sample["metadatas"]
+            if metadata and "event_id" in metadata and metadata.get("end_ts", float("inf")) >= time.time()
+        }
+        if expected_hashes:
+            found = vector_storage.get(where={"event_id": {"$in": list(expected_hashes)}}, include=["metadatas"])
+            unchanged_event_ids = {
+                metadata["event_id"]
+                for metadata in found["metadatas"]
+                if metadata and metadata.get("content_hash") == expected_hashes.get(metadata["event_id"])
+            }
+            if len(unchanged_event_ids) < min_ratio * len(expected_hashes):
+                problems.append(
+                    f"only {len(unchanged_event_ids)} of {len(expected_hashes)} sampled events of the active version found"
                 )
-        else:
-            raise FileNotFoundError(f"Vector storage directory {CHROMA_DIR} does not exist")
 
-        # Create Chroma's client
-        client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    # Chunks are searched for by their own text embedded like a query of the frontend, so they have to be the best match
+    min_relevance = float(os.getenv("VECTOR_STORAGE_MIN_RELEVANCE", "0.9"))
+    new_sample = vector_storage.get(
+        limit=sample_size, offset=random.randrange(max(count - sample_size, 0) + 1), include=["documents", "metadatas"]
+    )
+    for document, metadata in zip(new_sample["documents"], new_sample["metadatas"]):
+        if not metadata or metadata.get("metadata_version") != METADATA_VERSION:
+            problems.append(f"chunk without current metadata: {metadata}")
+            continue
+        try:
+            results = vector_storage.similarity_search_with_relevance_scores(document, k=1)
+        except Exception as e:
+            problems.append(f"searching for a chunk of event {metadata['event_id']} failed: {e}")
+            continue
+        if not results or results[0][0].page_content != document or results[0][1] < min_relevance:
+            problems.append(f"a chunk of event {metadata['event_id']} is not found by its own text")
+    return problems
 
-        # Create a network connection to the vector storage
-        vector_storage = Chroma(client=client, collection_name="PolandEventInfo", embedding_function=embedding_function)
 
-        print("Empty vector storage collection created successfully")
-        return vector_storage
-    except Exception as e:
+def is_being_built(vector_storage: Chroma) -> bool:
+    return get_alias(vector_storage._client).get("building") == vector_storage._collection.name
+
+
+def activate_vector_storage(vector_storage: Chroma) -> bool:
+    """
+    Validates a newly built version of the collection and, if it is valid, atomically points the alias to it, so that the frontend switches to it.
+    A version that is not valid is deleted and the active one stays in use. Old versions are garbage-collected afterward.
+
+    Parameters:
+        vector_storage (Chroma): The newly built version.
+
+    Returns:
+        bool: Whether the new version became active.
+    """
+    client = vector_storage._client
+    alias = get_alias(client)
+    collection_name = vector_storage._collection.name
+    try:
+        active_collection = client.get_collection(alias["active"])
+    except Exception:
+        active_collection = None
+
+    problems = validate_vector_storage(vector_storage, active_collection)
+    if problems:
         print(
-            f"An error occurred while cleaning the vector storage. The application will not work properly. Stopping application. Error: {e}"
+            f"New vector storage collection {collection_name} is not valid ({'; '.join(problems)}), {alias['active']} stays active"
         )
-        raise
+        client.delete_collection(collection_name)
+        set_alias(client, {"active": alias["active"]})
+        return False
+
+    set_alias(client, {"active": collection_name})
+    print(f"Switched the vector storage to {collection_name}")
+    delete_old_collections(client, collection_name)
+    return True
+
+
+def delete_old_collections(client: chromadb.ClientAPI, active_collection_name: str) -> None:
+    """
+    Deletes old versions of the collection, keeping the active one and the newest previous versions, which may still be used by open frontend sessions.
+
+    Parameters:
+        client (chromadb.ClientAPI): Client of the ChromaDB server.
+        active_collection_name (str): Name of the active version.
+    """
+    keep = int(os.getenv("VECTOR_STORAGE_KEEP_VERSIONS", "2"))
+    # The count includes the active version, which must never be deleted
+    if keep < 1:
+        print(f"VECTOR_STORAGE_KEEP_VERSIONS is {keep}, keeping only the active version")
+        keep = 1
+    # Version names sort by the time they were created, the unversioned collection is the oldest
+    versions = sorted(
+        name for name in client.list_collections() if name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}-v")
+    )
+    active_index = versions.index(active_collection_name)
+    # Versions newer than the active one were left behind by rebuilds that never finished
+    old_versions = versions[: max(active_index + 1 - keep, 0)] + versions[active_index + 1 :]
+    for name in old_versions:
+        client.delete_collection(name)
+        print(f"Deleted old vector storage collection {name}")
@@ -1,20 +1,39 @@
 import asyncio
+import concurrent.futures
 import json
 import logging
+import math
 import os
+import random
+import re
+import sqlite3
 import sys
-from datetime import datetime
-from typing import Generator
+import threading
+import unicodedata
+from collections import Counter
+from datetime import date, datetime, time
+from time import monotonic
+from typing import Any, Callable, Coroutine, Generator, NamedTuple, Optional, TypeVar
+from zoneinfo import ZoneInfo
 
-import aiofiles
 import chromadb
+import httpx
 import streamlit as st
+import tiktoken
+from chromadb.api import AsyncClientAPI
+from chromadb.api.models.AsyncCollection import AsyncCollection
 from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate
-from langchain_chroma import Chroma
-from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from prompts import main_system_message_template, use_search_system_message_template
+from prompts import (
+    main_system_message_template,
+    router_chatter_examples,
+    router_search_examples,
+    summary_message_template,
+    summary_system_message_template,
+    use_search_system_message_template,
+)
 from streamlit.components.v1 import html
 
 # Configure logging to output to stdout immediately
@@ -35,6 +54,49 @@ st.set_page_config(page_title="Chat about Polish tech events!", page_icon="💻"
 st.title("GrepEvent")
 st.write("Welcome to the conversation with a chatbot that will tell you about tech and business meetups in Poland!")
 
+# Name of the unversioned collection and of the collection pointing to its active version, both maintained by the ETL
+COLLECTION_NAME = "PolandEventInfo"
+ALIAS_COLLECTION_NAME = "PolandEventInfo-alias"
+# Events are held in Poland, so the dates in the search filters are in Polish time
+TIMEZONE = ZoneInfo("Europe/Warsaw")
+# Path to the event store written by the ETL
+EVENT_STORE_PATH = os.path.join(os.getenv("SCRAPING_OUTPUT_DIR", "data"), "events.sqlite3")
+
+T = TypeVar("T")
+
+# The earlier part of the conversation is folded into a summary of at most this many tokens
+SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "500"))
+
+# The user's query is searched for with this many results while the decisive model decides, the most it can ask for
+SPECULATIVE_SEARCH_RESULTS = 14
+
+# Words of the messages that only ask for more results on the previous topic, e.g. "give even more" or "a jeszcze?"
+MORE_WORDS = set("more another other others next else wiecej jeszcze kolejne nastepne inne dalej".split())
+# Words that may come with them without changing the topic
+FILLER_WORDS = set(
+    "give show list tell me us some any anything something even please a an the of them events results ones and what about "
+    "can could you i want need daj podaj pokaz wymien mi nam prosze poprosze to jakies cos wydarzenia wydarzen wyniki "
+    "wynikow chce moze czy masz sa".split()
+)
+# Words of the messages that are only small talk, e.g. "thanks!" or "cześć"
+CHATTER_WORDS = set(
+    "hi hello hey thanks thank you thx ok okay cool great nice bye goodbye good morning evening czesc hej witaj witam siema "
+    "dzieki dziekuje bardzo dobrze super okej pa na razie do widzenia dzien dobry".split()
+)
+# Words referring to the earlier messages, which only the decisive model can resolve
+REFERENCE_WORDS = set(
+    "it this that these those them they its there first second third last ten ta to tego tej tym te tych ich jego jej tam "
+    "pierwszy pierwsze drugi drugie trzeci trzecie ostatni ostatnie".split()
+)
+# Beginnings of the words hinting at filters, which only the decisive model can fill in; a false hint only sends the message to it
+FILTER_HINTS = tuple(
+    "free darmow bezplat platn paid upcoming nadchodz future przyszl today dzis tomorrow jutr week tydz tygod month miesi "
+    "year online zdaln remote city miast krakow warszaw warsaw wroclaw poznan gdansk gdyni sopot lodz katowic lublin "
+    "szczecin bydgoszcz torun rzeszow bialystok kielc olsztyn opol crossweb unikonferencje eventbrite january february "
+    "march april may june july august september october november december styczn luty lutego marzec marca kwietn maj "
+    "czerw lipiec lipca sierpn wrzesn pazdziernik listopad grudn".split()
+)
+
 # Initialize session state for user prompts and bot responses
 if "user_prompts" not in st.session_state:
     st.session_state.user_prompts = []
@@ -42,87 +104,792 @@ if "bot_responses" not in st.session_state:
     st.session_state.bot_responses = []
 
 
-def connect_to_vector_storage(collection_name: str) -> Chroma:
+# The clients below are thread-safe and shared by all browser sessions of the process, sessions hold only their conversation
+
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Starts the event loop running the searches of all sessions on a background thread, so that a session waiting for
+    OpenAI or Chroma does not block the others and no event loop is created for every message.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running event loop.
+    """
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="query-event-loop", daemon=True).start()
+    logging.info("Started the background event loop")
+    return loop
+
+
+def run_async(coroutine: Coroutine[Any, Any, T]) -> T:
     """
-    Creates a connection to the Chromadb vector database collection.
+    Runs a coroutine on the background event loop and waits for its result in the thread of the session's script.
+    The coroutine must not use st.session_state, which is only available in the thread of the script.
 
     Parameters:
-        collection_name (str): The name of the collection to connect to.
+        coroutine (Coroutine[Any, Any, T]): The coroutine to run.
+
+    Returns:
+        T: The result of the coroutine.
+    """
+
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+def create_connection_limits() -> httpx.Limits:
+    pool_size = int(os.getenv("OPENAI_HTTP_POOL_SIZE", "100"))
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=60)
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_client() -> httpx.Client:
+    """
+    Creates the pool of keep-alive HTTP connections to the OpenAI API shared by all models and sessions, so that the first
+    question of a new session does not wait for a new TLS handshake. It is used by the calls made in the script threads.
 
     Returns:
-        Chroma: An object to connect to and perform operations on a Chromadb vector database collection.
+        httpx.Client: The pooled HTTP client.
+    """
+
+    logging.info("Creating the OpenAI HTTP connection pool")
+    return httpx.Client(limits=create_connection_limits())
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_http_client() -> httpx.AsyncClient:
     """
+    Creates the pool of keep-alive HTTP connections to the OpenAI API used by the calls made on the background event loop.
 
+    Returns:
+        httpx.AsyncClient: The pooled asynchronous HTTP client.
+    """
+
+    logging.info("Creating the asynchronous OpenAI HTTP connection pool")
+    return httpx.AsyncClient(limits=create_connection_limits())
+
+
+@st.cache_resource(show_spinner=False)
+def get_chat_model() -> ChatOpenAI:
+    # Model answering the user
+    return ChatOpenAI(
+        model_name="gpt-4o-mini",
+        max_retries=5,
+        max_tokens=8000,
+        request_timeout=40,
+        temperature=0.4,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_decisive_model() -> ChatOpenAI:
+    # Model deciding whether to search the vector storage
+    return ChatOpenAI(
+        model_name="gpt-4o-mini",
+        max_retries=5,
+        max_tokens=5000,
+        model_kwargs={"response_format": {"type": "json_object"}},
+        request_timeout=40,
+        temperature=0.2,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_summarizing_model() -> ChatOpenAI:
+    # Model folding the earlier part of the conversation into its summary, which is limited to the length of its answer
+    return ChatOpenAI(
+        model_name="gpt-4o-mini",
+        max_retries=5,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        request_timeout=40,
+        temperature=0.2,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_encoding() -> Optional[tiktoken.Encoding]:
+    # Tokenizer of the models, used to keep the conversation within its token budget. Its vocabulary is downloaded on
+    # first use, so None is returned if it cannot be loaded.
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception as e:
+        logging.warning(f"Tokenizer could not be loaded, estimating tokens from the length of messages: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    # Tokens of a message, with the few tokens of its role and separators
+    encoding = get_encoding()
+    if encoding is None:
+        # Roughly three characters per token, the same estimate as in the ETL
+        return len(text) // 3 + 1 + 4
+    return len(encoding.encode(text, disallowed_special=())) + 4
+
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_function() -> OpenAIEmbeddings:
     # Embedding function used to create vectors while searching through a collection
-    embedding_function = OpenAIEmbeddings(
-        model="text-embedding-3-small", max_retries=5, request_timeout=15, retry_max_seconds=4, retry_min_seconds=1
+    return OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        max_retries=5,
+        request_timeout=15,
+        retry_max_seconds=4,
+        retry_min_seconds=1,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
     )
 
-    # Create client for chroma
-    client = chromadb.HttpClient(host=st.session_state.CHROMA_HOST, port=st.session_state.CHROMA_PORT)
 
-    # Create a connection to the Chromadb vector database collection or create a new collection.
-    vector_storage = Chroma(
-        client=client,
-        collection_name=collection_name,
-        embedding_function=embedding_function,
+@st.cache_resource(show_spinner=False)
+def get_prompts() -> tuple[ChatPromptTemplate, ChatPromptTemplate, ChatPromptTemplate]:
+    """
+    Builds the prompt templates of the decisive model, of the chat model and of the summarizing model.
+
+    Returns:
+        tuple[ChatPromptTemplate, ChatPromptTemplate, ChatPromptTemplate]: The prompt deciding whether to search, the main prompt and the summary prompt.
+    """
+
+    use_search_prompt = ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(use_search_system_message_template),
+            MessagesPlaceholder(variable_name="conversation"),
+        ]
+    )
+    main_prompt = ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(main_system_message_template),
+            MessagesPlaceholder(variable_name="conversation"),
+        ]
     )
-    logging.info("Connected to Chroma vector storage")
-    return vector_storage
+    summary_prompt = ChatPromptTemplate.from_messages(
+        [SystemMessagePromptTemplate.from_template(summary_system_message_template)]
+    )
+    return use_search_prompt, main_prompt, summary_prompt
+
+
+class VectorStorage:
+    """
+    Searches the active version of the Chromadb collection through the asynchronous Chroma client.
+    It is used only on the background event loop, so it needs no locks.
+    """
 
+    def __init__(self, client: AsyncClientAPI, embedding_function: OpenAIEmbeddings) -> None:
+        self.client = client
+        self.embedding_function = embedding_function
+        self.collection: Optional[AsyncCollection] = None
+        # When the Chroma server last answered the health check
+        self.checked_at = monotonic()
 
-async def read_json_file(file_path: str) -> str:
+    async def get_collection(self) -> AsyncCollection:
+        """
+        Returns the active version of the collection, reconnecting when the ETL has switched to a newly built version.
+
+        Returns:
+            AsyncCollection: The active collection.
+        """
+
+        # The ETL points the alias to a new version of the collection once it is completely built
+        try:
+            collection_name = (await self.client.get_collection(ALIAS_COLLECTION_NAME)).metadata["active"]
+        except Exception:
+            # The collection has not been versioned yet
+            collection_name = COLLECTION_NAME
+
+        if self.collection is None or self.collection.name != collection_name:
+            self.collection = await self.client.get_or_create_collection(collection_name)
+            logging.info(f"Connected to Chroma vector storage {collection_name}")
+        return self.collection
+
+    async def search(
+        self, expression: str, k: int, search_filter: Optional[dict], embedding: Optional[list[float]] = None
+    ) -> list[dict]:
+        """
+        Performs a similarity search in the active version of the collection. If the connection to Chroma fails, e.g.
+        after the server was restarted, the search is retried once over a new connection.
+
+        Parameters:
+            expression (str): The search text.
+            k (int): The number of results.
+            search_filter (Optional[dict]): The where clause on the event metadata, if any.
+            embedding (Optional[list[float]]): The embedding of the search text, if it was already created.
+
+        Returns:
+            list[dict]: Metadata of the matching documents, the most similar first.
+        """
+
+        if embedding is None:
+            embedding = await self.embedding_function.aembed_query(expression)
+        try:
+            collection = await self.get_collection()
+            results = await collection.query(
+                query_embeddings=[embedding], n_results=k, where=search_filter, include=["metadatas"]
+            )
+        except httpx.TransportError as e:
+            logging.warning(f"Connection to Chroma failed, reconnecting: {e}")
+            self.collection = None
+            collection = await self.get_collection()
+            results = await collection.query(
+                query_embeddings=[embedding], n_results=k, where=search_filter, include=["metadatas"]
+            )
+        return results["metadatas"][0]
+
+
+def is_vector_storage_healthy(vector_storage: VectorStorage) -> bool:
     """
-    Reads the content of a JSON file and returns it as a string.
+    Checks whether the Chroma server answers, before the shared vector storage is handed out.
+    The server is asked at most once per CHROMA_HEALTH_CHECK_INTERVAL seconds, failures in between are handled by
+    the reconnection of the search itself.
 
     Parameters:
-        file_path (str): The path to the file to read.
+        vector_storage (VectorStorage): The shared vector storage.
+
+    Returns:
+        bool: Whether the vector storage can be used, otherwise it is connected again.
+    """
+
+    if monotonic() - vector_storage.checked_at < float(os.getenv("CHROMA_HEALTH_CHECK_INTERVAL", "30")):
+        return True
+    try:
+        run_async(vector_storage.client.heartbeat())
+        vector_storage.checked_at = monotonic()
+        return True
+    except Exception as e:
+        logging.warning(f"Chroma health check failed, reconnecting: {e}")
+        return False
+
+
+@st.cache_resource(show_spinner=False, validate=is_vector_storage_healthy)
+def get_vector_storage() -> VectorStorage:
+    """
+    Creates the asynchronous client of the Chroma server shared by all sessions, which keeps its connections alive between requests.
 
     Returns:
-        str: The content of the file as a string or an error message if the file could not be read.
+        VectorStorage: The vector storage searched on the background event loop.
+
+    Raises:
+        ValueError: If not all required environment variables are set.
+    """
+
+    # Get the port number and the host for the Chromadb vector storage
+    chroma_port = os.getenv("CHROMADB_PORT")
+    chroma_host = os.getenv("CHROMADB_HOST")
+
+    # Check if the Chromadb host and port are not empty
+    if chroma_port is None or chroma_host is None:
+        raise ValueError("Chromadb host or port not found in environment variables")
+
+    logging.info(f"Connecting to Chroma at {chroma_host}:{chroma_port}")
+    # The client is created on the background event loop, where all its requests are sent
+    client = run_async(chromadb.AsyncHttpClient(host=chroma_host, port=int(chroma_port)))
+    return VectorStorage(client, get_embedding_function())
+
+
+def read_events(event_ids: list[str]) -> list[str]:
+    """
+    Reads the details of the given events from the event store written by the ETL with a single query.
+
+    Parameters:
+        event_ids (list[str]): IDs of the events to read.
+
+    Returns:
+        list[str]: Details of every event as JSON strings, in the order of the given IDs, or an error message if the store could not be read.
 
     Note:
-        If there is an error while reading the file, the function returns an error message.
+        If there is an error while reading the store, the function returns an error message.
     """
 
     try:
-        # Read the contents of the json file
-        async with aiofiles.open(file_path, "r", encoding="utf-8") as file:
-            json_data = await file.read()
-        logging.info(f"File {file_path} read successfully")
-        return json_data
+        # Open the store read-only, the ETL may be writing to it at the same time
+        connection = sqlite3.connect(f"file:{EVENT_STORE_PATH}?mode=ro", uri=True)
+        try:
+            placeholders = ", ".join("?" * len(event_ids))
+            rows = connection.execute(
+                f"SELECT event_id, details FROM events WHERE event_id IN ({placeholders})", event_ids
+            ).fetchall()
+        finally:
+            connection.close()
+        events = dict(rows)
+        logging.info(f"Read {len(events)} of {len(event_ids)} events from the event store")
+        return [events[event_id] for event_id in event_ids if event_id in events]
     except Exception as e:
-        logging.error(f"Error while reading file {file_path}: {e}")
-        # Return an error message to AI if the file could not be read
-        return "An error occurred while loading data about one of the events!"
+        logging.error(f"Error while reading events from {EVENT_STORE_PATH}: {e}")
+        # Return an error message to AI if the events could not be read
+        return ["An error occurred while loading data about the events!"]
+
 
+def fold_text(text: str) -> str:
+    # Lowercase text without Polish diacritics, the way the ETL stores cities
+    text = unicodedata.normalize("NFKD", text.lower().replace("ł", "l"))
+    return "".join(character for character in text if not unicodedata.combining(character))
 
-async def get_knowledge_from_vector_storage() -> str:
+
+def build_search_filter(filters: Optional[dict]) -> Optional[dict]:
     """
-    Sends a prompt to the chat model to decide whether to search the vector storage for data and how much data to retrieve.
-    Checks the response from the chat model and retrieves locations of files with data about events from the vector storage.
-    Reads the content of the files and returns it as a string.
+    Translates the filters chosen by the decisive model into a where clause on the event metadata stored by the ETL,
+    so that past or irrelevant events are excluded by the vector storage instead of taking places among the results.
+
+    Parameters:
+        filters (Optional[dict]): Filters with any of "upcoming" (bool), "date_from" and "date_to" (YYYY-MM-DD), "city" (str), "is_free" (bool) and "source_site" (str).
 
     Returns:
-        str: The knowledge retrieved from the vector storage or information about no need for data or an error message.
+        Optional[dict]: The where clause, or None if there are no valid filters.
 
     Note:
-        If there is an error in parsing the JSON response, the function returns an error message to AI.
+        Invalid filters are logged and skipped, the search is then less narrow but still answers the user.
     """
 
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        logging.warning(f"Ignoring search filters that are not an object: {filters}")
+        return None
+
+    conditions = []
+    for name, value in filters.items():
+        try:
+            if name == "upcoming" and isinstance(value, bool):
+                # Events that have already started but not ended yet are still worth attending
+                if value:
+                    conditions.append({"end_ts": {"$gte": int(datetime.now(TIMEZONE).timestamp())}})
+            elif name == "date_from" and isinstance(value, str):
+                day_start = datetime.combine(date.fromisoformat(value), time(0, 0), TIMEZONE)
+                conditions.append({"end_ts": {"$gte": int(day_start.timestamp())}})
+            elif name == "date_to" and isinstance(value, str):
+                day_end = datetime.combine(date.fromisoformat(value), time(23, 59, 59), TIMEZONE)
+                conditions.append({"start_ts": {"$lte": int(day_end.timestamp())}})
+            elif name == "city" and isinstance(value, str) and value.strip():
+                conditions.append({"city": fold_text(value.strip())})
+            elif name == "is_free" and isinstance(value, bool):
+                conditions.append({"is_free": value})
+            elif name == "source_site" and isinstance(value, str) and value.strip():
+                conditions.append({"source_site": value.strip().lower().removeprefix("www.")})
+            else:
+                logging.warning(f"Ignoring invalid search filter {name}: {value}")
+        except ValueError:
+            logging.warning(f"Ignoring invalid search filter {name}: {value}")
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class SpeculationStats:
+    """
+    Counts how often the results of the speculative search were used, shared by all sessions of the process.
+    It is updated only on the background event loop, so it needs no locks.
+    """
+
+    def __init__(self) -> None:
+        self.outcomes: Counter[str] = Counter()
+
+    def record(self, outcome: str) -> None:
+        self.outcomes[outcome] += 1
+        logging.info(f"Speculative search: {outcome}, {self.report()}")
+
+    def report(self) -> str:
+        hits = self.outcomes["hit"]
+        # Searches were needed in every outcome except when the decisive model decided not to search
+        searches = sum(count for outcome, count in self.outcomes.items() if outcome != "not needed")
+        hit_rate = hits / searches if searches else 0.0
+        return (
+            f"{hits} hits of {searches} searches ({hit_rate:.1%} hit rate), "
+            f"{self.outcomes['not needed']} speculative searches not needed"
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def get_speculation_stats() -> SpeculationStats:
+    return SpeculationStats()
+
+
+def get_words(text: str) -> list[str]:
+    # Words of the text, ignoring case and Polish diacritics
+    return re.findall(r"\w+", fold_text(text))
+
+
+def get_similarity(query: str, expression: str) -> float:
+    # Share of the words of both texts that appear in both of them
+    query_words, expression_words = (set(get_words(text)) for text in (query, expression))
+    if not query_words or not expression_words:
+        return 0.0
+    return len(query_words & expression_words) / len(query_words | expression_words)
+
+
+async def take_speculative_results(
+    speculative_search: asyncio.Task,
+    speculation_stats: SpeculationStats,
+    query: str,
+    expression: str,
+    k: int,
+    search_filter: Optional[dict],
+) -> Optional[list[dict]]:
+    """
+    Uses the results of the search for the user's query, started before the decisive model responded, if they answer the
+    search the model decided on: it has no filters, asks for no more results than were searched for and its expression
+    is close enough to the query.
+
+    Parameters:
+        speculative_search (asyncio.Task): The search for the user's query.
+        speculation_stats (SpeculationStats): The statistics to record the outcome in.
+        query (str): The user's query.
+        expression (str): The search expression decided on by the decisive model.
+        k (int): The number of results decided on by the decisive model.
+        search_filter (Optional[dict]): The where clause decided on by the decisive model.
+
+    Returns:
+        Optional[list[dict]]: Metadata of the first k matching documents, or None if the search has to be made again.
+    """
+
+    min_similarity = float(os.getenv("SPECULATIVE_SEARCH_MIN_SIMILARITY", "0.5"))
+    if search_filter is not None:
+        outcome = "miss, filtered search"
+    elif k > SPECULATIVE_SEARCH_RESULTS:
+        outcome = "miss, too many results"
+    elif get_similarity(query, expression) < min_similarity:
+        outcome = "miss, different expression"
+    else:
+        try:
+            results = await speculative_search
+        except Exception as e:
+            logging.warning(f"Speculative search failed: {e}")
+            outcome = "miss, failed"
+        else:
+            speculation_stats.record("hit")
+            return results[:k]
+    speculation_stats.record(outcome)
+    return None
+
+
+def discard_speculative_search(speculative_search: asyncio.Task) -> None:
+    if not speculative_search.done():
+        speculative_search.cancel()
+    elif not speculative_search.cancelled():
+        # Retrieving the exception of a failed search keeps it from being logged as never retrieved
+        speculative_search.exception()
+
+
+def get_cosine_similarity(first: list[float], second: list[float]) -> float:
+    norms = math.sqrt(sum(value * value for value in first)) * math.sqrt(sum(value * value for value in second))
+    return sum(a * b for a, b in zip(first, second)) / norms if norms else 0.0
+
+
+def get_last_decision(search_decisions_memory: str) -> Optional[dict]:
+    # The last decision in the memory if it was a valid search, which a request for more results continues
+    lines = search_decisions_memory.strip().splitlines()
+    if not lines:
+        return None
     try:
-        # Create a prompt to decide whether to search the database
-        decisive_prompt = st.session_state.use_search_prompt.format_messages(
-            today_date=datetime.now().strftime("%Y-%m-%d"),
-            search_decisions_history=st.session_state.search_decisions_memory,
-            conversation=st.session_state.conversation,
+        decision = json.loads(lines[-1].removeprefix("- "))
+    except json.JSONDecodeError:
+        return None
+    if (
+        not isinstance(decision, dict)
+        or not isinstance(decision.get("number_of_results"), int)
+        or not isinstance(decision.get("results_shown"), int)
+        or not isinstance(decision.get("expression"), str)
+        or decision["number_of_results"] <= 0
+        or decision["results_shown"] < 0
+        or decision["expression"] == ""
+    ):
+        return None
+    return decision
+
+
+def is_search(decision: dict) -> bool:
+    return isinstance(decision.get("number_of_results"), int) and decision["number_of_results"] > 0
+
+
+class TopicGuess(NamedTuple):
+    # Decision guessed from the topic of the message, whether the router is confident about it and how it was guessed
+    decision: dict
+    confident: bool
+    description: str
+
+
+class SearchRouter:
+    """
+    Decides locally how to search the vector storage when the decision is obvious, so that the decisive model is asked
+    only when the router is not confident. Short requests for more results on the previous topic and small talk are
+    recognized by word lists, other messages by the similarity of their embedding to the centroids of example messages
+    about events and of off-topic ones.
+    A share of the local decisions is still compared with the decisive model, and the agreement is logged to tune the thresholds.
+    It is used only on the background event loop, so it needs no locks.
+    """
+
+    def __init__(self, embedding_function: OpenAIEmbeddings) -> None:
+        self.embedding_function = embedding_function
+        self.centroids: Optional[dict[str, list[float]]] = None
+        # A message is routed by its topic if it is this similar to the closest centroid and this much closer to it than to the other one
+        self.min_similarity = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.3"))
+        self.min_margin = float(os.getenv("ROUTER_MIN_MARGIN", "0.1"))
+        # Share of the local decisions compared with the decisive model
+        self.shadow_rate = float(os.getenv("ROUTER_SHADOW_RATE", "0.1"))
+        self.routes: Counter[str] = Counter()
+        self.agreements: Counter[tuple[str, bool]] = Counter()
+        # Comparisons that outlive the request, kept so that they are not garbage collected
+        self.shadow_tasks: set[asyncio.Task] = set()
+
+    async def get_centroids(self) -> Optional[dict[str, list[float]]]:
+        if self.centroids is None:
+            try:
+                embeddings = await self.embedding_function.aembed_documents(router_search_examples + router_chatter_examples)
+            except Exception as e:
+                logging.warning(f"Could not embed the examples of the router, asking the decisive model: {e}")
+                return None
+            groups = {
+                "search": embeddings[: len(router_search_examples)],
+                "chatter": embeddings[len(router_search_examples) :],
+            }
+            self.centroids = {
+                label: [sum(values) / len(vectors) for values in zip(*vectors)] for label, vectors in groups.items()
+            }
+        return self.centroids
+
+    def route_by_rules(self, query: str, search_decisions_memory: str) -> Optional[dict]:
+        """
+        Recognizes small talk and requests for more results on the previous topic by their words alone.
+
+        Parameters:
+            query (str): The user's query.
+            search_decisions_memory (str): The previous decisions, one JSON object per line.
+
+        Returns:
+            Optional[dict]: The decision in the format of the decisive model, or None if the rules do not apply.
+        """
+
+        words = get_words(query)
+        if not words or any(character.isdigit() for word in words for character in word):
+            return None
+        if all(word in CHATTER_WORDS for word in words):
+            return {"number_of_results": 0, "expression": "", "results_shown": 0}
+        if any(word in MORE_WORDS for word in words) and all(word in MORE_WORDS or word in FILLER_WORDS for word in words):
+            previous = get_last_decision(search_decisions_memory)
+            if previous is not None:
+                # The next results on the same topic with the same filters, as the decisive model is instructed to do
+                decision = {
+                    "number_of_results": 3,
+                    "expression": previous["expression"],
+                    "results_shown": previous["results_shown"] + min(previous["number_of_results"], 14),
+                }
+                if previous.get("filters"):
+                    decision["filters"] = previous["filters"]
+                return decision
+        return None
+
+    async def route_by_topic(self, query: str, query_embedding: list[float]) -> Optional[TopicGuess]:
+        """
+        Classifies the message as a search for events or as off-topic by the centroid closest to its embedding.
+        Messages with numbers, filters or references to the earlier messages are left to the decisive model.
+
+        Parameters:
+            query (str): The user's query.
+            query_embedding (list[float]): The embedding of the query.
+
+        Returns:
+            Optional[TopicGuess]: The decision in the format of the decisive model with whether the router is confident
+            about it, or None if the message cannot be classified.
+        """
+
+        words = get_words(query)
+        if (
+            any(character.isdigit() for word in words for character in word)
+            or any(word in REFERENCE_WORDS or word in MORE_WORDS for word in words)
+            or any(word.startswith(FILTER_HINTS) for word in words)
+        ):
+            return None
+        centroids = await self.get_centroids()
+        if centroids is None:
+            return None
+
+        similarities = {label: get_cosine_similarity(query_embedding, centroid) for label, centroid in centroids.items()}
+        label, other_label = sorted(similarities, key=similarities.get, reverse=True)
+        margin = similarities[label] - similarities[other_label]
+        if label == "search":
+            guess = {"number_of_results": 3, "expression": query, "results_shown": 0}
+        else:
+            guess = {"number_of_results": 0, "expression": "", "results_shown": 0}
+        confident = similarities[label] >= self.min_similarity and margin >= self.min_margin
+        return TopicGuess(guess, confident, f" ({label} at similarity {similarities[label]:.3f} with margin {margin:.3f})")
+
+    def record(self, route: str) -> None:
+        self.routes[route] += 1
+        logging.info(f"Router: decided by {route}, {self.report()}")
+
+    def shadow(
+        self, route: str, local_decision: dict, ask: Callable[[], Coroutine], decision: Optional[asyncio.Task] = None
+    ) -> None:
+        """
+        Asks the decisive model about a share of the local decisions and compares its decision, without waiting for it.
+        These are the only requests to the decisive model made for messages decided locally.
+
+        Parameters:
+            route (str): How the local decision was made.
+            local_decision (dict): The local decision.
+            ask (Callable[[], Coroutine]): Asks the decisive model.
+            decision (Optional[asyncio.Task]): The request to the decisive model already made for the message, compared if the local decision is sampled and cancelled otherwise.
+        """
+
+        if random.random() >= self.shadow_rate:
+            if decision is not None:
+                decision.cancel()
+            return
+        if decision is None:
+            decision = asyncio.create_task(ask())
+        self.shadow_tasks.add(decision)
+        decision.add_done_callback(self.shadow_tasks.discard)
+        decision.add_done_callback(lambda task: self.compare(route, local_decision, task))
+
+    def compare(self, route: str, local_decision: dict, decision: asyncio.Task, description: str = "") -> None:
+        if decision.cancelled():
+            return
+        try:
+            model_decision = json.loads(decision.result())
+        except Exception as e:
+            logging.warning(f"Router: could not compare with the decisive model: {e}")
+            return
+        if not isinstance(model_decision, dict):
+            return
+
+        # Both decisions agree if they both search or both do not, and searches continue from the same result
+        agrees = is_search(local_decision) == is_search(model_decision) and (
+            not is_search(local_decision)
+            or (
+                local_decision["results_shown"] == model_decision.get("results_shown")
+                and bool(local_decision.get("filters")) == bool(model_decision.get("filters"))
+            )
+        )
+        self.agreements[route, agrees] += 1
+        logging.info(
+            f"Router: {route} {'agrees' if agrees else 'disagrees'} with the decisive model{description}, "
+            f"local {json.dumps(local_decision, ensure_ascii=False)}, model {json.dumps(model_decision, ensure_ascii=False)}, "
+            f"{self.agreements[route, True]} of {self.agreements[route, True] + self.agreements[route, False]} agreed"
         )
 
-        # Get the response from the chat model
-        response = (st.session_state.decisive_model.invoke(decisive_prompt)).content.strip()
-        logging.info("Sent prompt to decide whether to search the vector storage")
-        # Add the decision to the search decisions memory
-        st.session_state.search_decisions_memory += f"- {response}\n"
+    def report(self) -> str:
+        total = sum(self.routes.values())
+        local = total - self.routes["decisive model"]
+        local_rate = local / total if total else 0.0
+        return f"{local} of {total} decisions made locally ({local_rate:.1%}), " + ", ".join(
+            f"{count} by {route}" for route, count in self.routes.items()
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_router() -> SearchRouter:
+    return SearchRouter(get_embedding_function())
+
+
+async def ask_decisive_model(
+    conversation: list[BaseMessage],
+    search_decisions_memory: str,
+    decisive_model: ChatOpenAI,
+    use_search_prompt: ChatPromptTemplate,
+) -> str:
+    # Create a prompt to decide whether to search the database
+    decisive_prompt = use_search_prompt.format_messages(
+        today_date=datetime.now().strftime("%Y-%m-%d"),
+        search_decisions_history=search_decisions_memory,
+        conversation=conversation,
+    )
+
+    # Get the response from the chat model
+    response = (await decisive_model.ainvoke(decisive_prompt)).content.strip()
+    logging.info("Sent prompt to decide whether to search the vector storage")
+    return response
+
+
+async def get_knowledge_from_vector_storage(
+    conversation: list[BaseMessage],
+    search_decisions_memory: str,
+    decisive_model: ChatOpenAI,
+    use_search_prompt: ChatPromptTemplate,
+    vector_storage: VectorStorage,
+    speculation_stats: Optional[SpeculationStats] = None,
+    search_router: Optional[SearchRouter] = None,
+) -> tuple[str, Optional[str]]:
+    """
+    Sends a prompt to the chat model to decide whether to search the vector storage for data, how much data to retrieve and how to filter it.
+    Checks the response from the chat model and retrieves IDs of the matching events from the vector storage.
+    Reads the details of the events from the event store and returns them as a string.
+    Runs on the background event loop, so everything it needs from the session is passed to it.
+    In the speculative mode the user's query is searched for while the model decides, and the results are used if the
+    decided search is close enough to it, which saves the time of a search after the decision.
+    With the search router, obvious decisions are made locally by rules without asking the decisive model. Otherwise the
+    decisive model is asked while the router guesses the topic of the query, and the request is cancelled if the guess
+    is confident.
+
+    Parameters:
+        conversation (list[BaseMessage]): The conversation history, ending with the user's query.
+        search_decisions_memory (str): The previous decisions of the decisive model.
+        decisive_model (ChatOpenAI): The model deciding whether to search the vector storage.
+        use_search_prompt (ChatPromptTemplate): The prompt of the decisive model.
+        vector_storage (VectorStorage): The vector storage to search.
+        speculation_stats (Optional[SpeculationStats]): The statistics of the speculative mode, None to disable it.
+        search_router (Optional[SearchRouter]): The router making obvious decisions locally, None to always ask the decisive model.
+
+    Returns:
+        tuple[str, Optional[str]]: The knowledge retrieved from the vector storage or information about no need for data or an error message, and the decision of the decisive model to remember, if it responded.
+
+    Note:
+        If there is an error in parsing the JSON response, the function returns an error message to AI.
+    """
+
+    response = None
+    query = conversation[-1].content
+    speculative_search = None
+    decision = None
+    local_decision = None
+    route = "rules"
+
+    def ask() -> Coroutine[Any, Any, str]:
+        return ask_decisive_model(conversation, search_decisions_memory, decisive_model, use_search_prompt)
+
+    try:
+        if search_router is not None:
+            local_decision = search_router.route_by_rules(query, search_decisions_memory)
+        topic_guess = None
+        if local_decision is None:
+            # The decisive model is asked while the query is embedded and routed by topic, so a message the router is
+            # unsure about does not wait for both one after the other
+            decision = asyncio.create_task(ask())
+            query_embedding = None
+            if search_router is not None:
+                try:
+                    query_embedding = await vector_storage.embedding_function.aembed_query(query)
+                except Exception as e:
+                    logging.warning(f"Could not embed the query for the router: {e}")
+            if speculation_stats is not None:
+                speculative_search = asyncio.create_task(
+                    vector_storage.search(query, SPECULATIVE_SEARCH_RESULTS, None, query_embedding)
+                )
+            if search_router is not None and query_embedding is not None:
+                topic_guess = await search_router.route_by_topic(query, query_embedding)
+                route = "topic"
+                if topic_guess is not None and topic_guess.confident:
+                    local_decision = topic_guess.decision
+
+        if local_decision is not None:
+            search_router.record(route)
+            # The request already made is kept only to compare it with a sampled local decision, otherwise it is cancelled
+            search_router.shadow(route, local_decision, ask, decision)
+            decision = None
+            response = json.dumps(local_decision, ensure_ascii=False)
+        else:
+            if search_router is not None:
+                search_router.record("decisive model")
+                if topic_guess is not None:
+                    # Compare the unsure guess with the decisive model to show whether the thresholds could be lower
+                    decision.add_done_callback(
+                        lambda task: search_router.compare("unsure topic", topic_guess.decision, task, topic_guess.description)
+                    )
+            response = await decision
         # Parse the response from the chat model
         response_json = json.loads(response)
 
@@ -140,51 +907,199 @@ async def get_knowledge_from_vector_storage() -> str:
             or (response_json["number_of_results"] != 0 and response_json["expression"] == "")
         ):
             logging.error("There was an error in decision-making!")
-            return "An error occurred while deciding to load the data!"
+            return "An error occurred while deciding to load the data!", response
         # Check if the response indicates that no data is needed
         elif response_json["number_of_results"] == 0:
             logging.info("No data is needed to be loaded from the vector storage")
-            return "No data is needed."
+            if speculative_search is not None:
+                speculation_stats.record("not needed")
+            return "No data is needed.", response
         # Retrieve data from the vector storage
         else:
             # Change the number of results that will be retrieved if the chat model has decided to search for too many results
             if response_json["number_of_results"] > 14:
                 response_json["number_of_results"] = 14
 
-            # Perform a similarity search in the vector storage
-            logging.info("Searching for relevant data in the vector storage")
-            results = st.session_state.vector_storage.similarity_search_with_relevance_scores(
-                response_json["expression"], k=response_json["number_of_results"] + response_json["results_shown"]
-            )
+            # Perform a similarity search in the vector storage, narrowed down by the filters if the chat model has chosen any
+            search_filter = build_search_filter(response_json.get("filters"))
+            logging.info(f"Searching for relevant data in the vector storage with filter {search_filter}")
+            k = response_json["number_of_results"] + response_json["results_shown"]
+            results = None
+            if speculative_search is not None:
+                results = await take_speculative_results(
+                    speculative_search, speculation_stats, query, response_json["expression"], k, search_filter
+                )
+            if results is None:
+                results = await vector_storage.search(response_json["expression"], k, search_filter)
 
             # Check if there are any results
             if len(results) == 0:
-                return "No relevant data was found."
+                return "No relevant data was found.", response
             else:
-                # Retrieve paths to files with data about events(retrieve only from particular group of results to enable giving new results on the same topic)
-                file_paths = []
-                for doc, score in results[
+                # Retrieve IDs of the events(retrieve only from particular group of results to enable giving new results on the same topic)
+                event_ids = []
+                for metadata in results[
                     response_json["results_shown"] : (response_json["number_of_results"] + response_json["results_shown"])
                 ]:
-                    # Get the path to the file where the data about the event is stored, but only if it is not already in the list or if it is not "Unknown"
-                    file_path = doc.metadata.get("location", "Unknown")
-                    if file_path != "Unknown" and file_path not in file_paths:
-                        file_paths.append(file_path)
-                # Read the content of the files by using asynchronous file reading
-                results = await asyncio.gather(*[read_json_file(path) for path in file_paths])
-
-                # Combine the content of the files into one string
+                    # Get the ID of the event, but only if it is not already in the list or if it is not "Unknown"
+                    event_id = (metadata or {}).get("event_id", "Unknown")
+                    if event_id != "Unknown" and event_id not in event_ids:
+                        event_ids.append(event_id)
+                # Read the details of all events at once, in a thread so that the event loop is not blocked by the disk
+                results = await asyncio.to_thread(read_events, event_ids) if event_ids else []
+
+                # Combine the details of the events into one string
                 full_knowledge = "\n".join(results)
-                return full_knowledge
+                return full_knowledge, response
     except json.JSONDecodeError as e:
         # Return an error message to AI if there is an error while parsing the JSON response
         logging.error(f"Error while parsing JSON response: {e}")
-        return "An error occurred while deciding to load the data!"
+        return "An error occurred while deciding to load the data!", response
+    finally:
+        if speculative_search is not None:
+            discard_speculative_search(speculative_search)
+        # An error before the decision was awaited leaves the request to the decisive model unneeded
+        if decision is not None:
+            decision.cancel()
+
+
+async def summarize_conversation(
+    summary: str,
+    messages: list[BaseMessage],
+    search_decisions: list[str],
+    summarizing_model: ChatOpenAI,
+    summary_prompt: ChatPromptTemplate,
+) -> str:
+    """
+    Folds messages and search decisions into the summary of the earlier part of the conversation.
+    Only the new messages and decisions are sent with the previous summary, so the cost of every update is bounded.
+
+    Parameters:
+        summary (str): The previous summary, empty if there is none yet.
+        messages (list[BaseMessage]): The messages to fold into the summary, the oldest first.
+        search_decisions (list[str]): The search decisions to fold into the summary, the oldest first.
+        summarizing_model (ChatOpenAI): The model writing the summary.
+        summary_prompt (ChatPromptTemplate): The prompt of the summarizing model.
+
+    Returns:
+        str: The updated summary.
+    """
+
+    transcript = "\n".join(
+        f"{'User' if isinstance(message, HumanMessage) else 'Chatbot'}: {message.content}" for message in messages
+    )
+    prompt = summary_prompt.format_messages(
+        # The summary is limited in tokens, roughly three quarters of which are words
+        max_words=int(SUMMARY_MAX_TOKENS * 0.6),
+        summary=summary or "There is no summary yet.",
+        search_decisions="\n".join(f"- {decision}" for decision in search_decisions) or "No search decisions.",
+        messages=transcript or "No messages.",
+    )
+    return (await summarizing_model.ainvoke(prompt)).content.strip()
+
+
+class ConversationContext:
+    """
+    The conversation and the search decisions of a session sent to the models, bounded by the number of turns and by a
+    token budget. The last turns are kept verbatim, older messages and decisions are folded into a summary updated in
+    the background between the turns, so the prompts stay the same size however long the conversation runs.
+    Tokens of every message are counted once, when it is added.
+    It is used only in the thread of the session's script, the summary is written on the background event loop.
+    """
+
+    def __init__(self) -> None:
+        self.max_turns = int(os.getenv("CONTEXT_MAX_TURNS", "6"))
+        self.token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+        self.messages: list[BaseMessage] = []
+        self.message_tokens: list[int] = []
+        self.decisions: list[str] = []
+        self.decision_tokens: list[int] = []
+        self.summary = ""
+        self.summary_tokens = 0
+        # Messages and decisions that no longer fit, waiting to be folded into the summary
+        self.folded_messages: list[BaseMessage] = []
+        self.folded_decisions: list[str] = []
+        # The update of the summary running on the background event loop and how many waiting messages and decisions it folds
+        self.summarizing: Optional[concurrent.futures.Future] = None
+        self.summarizing_counts = (0, 0)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.messages.append(message)
+        self.message_tokens.append(count_tokens(message.content))
+
+    def add_decision(self, decision: str) -> None:
+        self.decisions.append(decision)
+        self.decision_tokens.append(count_tokens(decision))
+
+    def get_messages(self) -> list[BaseMessage]:
+        # The summary replaces the earlier part of the conversation
+        if not self.summary:
+            return list(self.messages)
+        return [SystemMessage(content=summary_message_template.format(summary=self.summary))] + self.messages
+
+    def get_decisions_history(self) -> str:
+        return "".join(f"- {decision}\n" for decision in self.decisions)
+
+    def count_verbatim_tokens(self) -> int:
+        return sum(self.message_tokens) + sum(self.decision_tokens)
+
+    def fold(self) -> None:
+        """
+        Moves the oldest messages and decisions that exceed the limits out of the verbatim part and starts folding them
+        into the summary on the background event loop, after the response is shown, so that the user does not wait for it.
+        The last message and the last decision are always kept verbatim.
+        """
+
+        while len(self.messages) > 1 and (
+            len(self.messages) > 2 * self.max_turns or self.count_verbatim_tokens() > self.token_budget
+        ):
+            self.folded_messages.append(self.messages.pop(0))
+            self.message_tokens.pop(0)
+        while len(self.decisions) > 1 and (
+            len(self.decisions) > self.max_turns or self.count_verbatim_tokens() > self.token_budget
+        ):
+            self.folded_decisions.append(self.decisions.pop(0))
+            self.decision_tokens.pop(0)
+
+        if (self.folded_messages or self.folded_decisions) and self.summarizing is None:
+            self.summarizing_counts = (len(self.folded_messages), len(self.folded_decisions))
+            self.summarizing = asyncio.run_coroutine_threadsafe(
+                summarize_conversation(
+                    self.summary,
+                    list(self.folded_messages),
+                    list(self.folded_decisions),
+                    get_summarizing_model(),
+                    get_prompts()[2],
+                ),
+                get_event_loop(),
+            )
+
+    def wait_for_summary(self) -> None:
+        """
+        Takes the summary updated since the previous turn, waiting for it only if the user replied before it was written.
+        If the update failed, the waiting messages and decisions are folded again after the next turn.
+        """
+
+        if self.summarizing is None:
+            return
+        try:
+            self.summary = self.summarizing.result()
+            self.summary_tokens = count_tokens(self.summary)
+            del self.folded_messages[: self.summarizing_counts[0]]
+            del self.folded_decisions[: self.summarizing_counts[1]]
+            logging.info(
+                f"Folded {self.summarizing_counts[0]} messages and {self.summarizing_counts[1]} search decisions "
+                f"into the summary of {self.summary_tokens} tokens"
+            )
+        except Exception as e:
+            logging.warning(f"Could not update the summary of the conversation: {e}")
+        finally:
+            self.summarizing = None
 
 
 def generate_response(user_query: str) -> Generator[AIMessageChunk, None, None]:
     """
-    Gets the knowledge from the vector storage and files with data about events, then creates a prompt for the chat model.
+    Gets the knowledge from the vector storage and the event store, then creates a prompt for the chat model.
     Sends the prompt to the chat model and yields the response chunks. If the response is too long, the user is warned that the chatbot did not complete its speech.
 
     Parameters:
@@ -194,18 +1109,37 @@ def generate_response(user_query: str) -> Generator[AIMessageChunk, None, None]:
         Generator[AIMessageChunk, None, None]: A generator of AI message chunks containing the chat-bot responses.
     """
 
-    # Add the user's query to the conversation history
-    st.session_state.conversation.append(HumanMessage(content=user_query))
+    # Add the user's query to the conversation history, with the summary of the earlier messages that no longer fit
+    context = st.session_state.context
+    context.wait_for_summary()
+    context.add_message(HumanMessage(content=user_query))
+    logging.info(
+        f"Context: {len(context.messages)} messages and {len(context.decisions)} search decisions "
+        f"of {context.count_verbatim_tokens()} tokens, summary of {context.summary_tokens} tokens"
+    )
 
-    # Get the knowledge from the vector storage and files with data about events
-    knowledge = asyncio.run(get_knowledge_from_vector_storage())
+    # Get the knowledge from the vector storage and the event store on the background event loop
+    knowledge, decision = run_async(
+        get_knowledge_from_vector_storage(
+            context.get_messages(),
+            context.get_decisions_history(),
+            get_decisive_model(),
+            get_prompts()[0],
+            get_vector_storage(),
+            get_speculation_stats() if os.getenv("SPECULATIVE_SEARCH", "true").lower() == "true" else None,
+            get_search_router() if os.getenv("SEARCH_ROUTER", "true").lower() == "true" else None,
+        )
+    )
+    # Add the decision to the search decisions memory
+    if decision is not None:
+        context.add_decision(decision)
 
     # Create a prompt for the chat model and get the response
     logging.info("Sending prompt to the chat model")
-    prompt = st.session_state.dynamic_main_prompt.format_messages(
-        today_date=datetime.now().strftime("%Y-%m-%d"), knowledge=knowledge, conversation=st.session_state.conversation
+    prompt = get_prompts()[1].format_messages(
+        today_date=datetime.now().strftime("%Y-%m-%d"), knowledge=knowledge, conversation=context.get_messages()
     )
-    response = st.session_state.chat_model.stream(prompt)
+    response = get_chat_model().stream(prompt)
 
     # Yield the response chunks and check if the chatbot did not complete its speech or stopped unexpectedly
     for chunk in response:
@@ -250,8 +1184,10 @@ def display_response(user_prompt: str) -> None:
             # Write the response to the chat interface
             full_response = st.write_stream(response_stream)
             # Append the response to the conversation history and bot responses
-            st.session_state.conversation.append(AIMessage(content=full_response))
+            st.session_state.context.add_message(AIMessage(content=full_response))
             st.session_state.bot_responses.append(full_response)
+            # Fold the turns that no longer fit into the summary while the user reads the response
+            st.session_state.context.fold()
 
 
 # Check if the application is initialized(application variables and objects need to be initialized only once)
@@ -261,53 +1197,14 @@ if "initialized" not in st.session_state:
         # Set the flag to indicate that the application is initialized
         st.session_state.initialized = True
 
-        # Get the port number and the host for the Chromadb vector storage
-        st.session_state.CHROMA_PORT = int(os.getenv("CHROMADB_PORT"))
-        st.session_state.CHROMA_HOST = os.getenv("CHROMADB_HOST")
+        # Initialize the conversation history and search decisions memory, the models and clients are shared by all sessions
+        st.session_state.context = ConversationContext()
 
-        # Check if the Chromadb host and port are not empty
-        if st.session_state.CHROMA_PORT is None or st.session_state.CHROMA_HOST is None:
-            raise ValueError("Chromadb host or port not found in environment variables")
-
-        # Initialize the chat model, model used to decide on the need to search the vector storage, search prompt, main prompt, conversation history, search decisions memory, and vector storage
-        st.session_state.chat_model = ChatOpenAI(
-            model_name="gpt-4o-mini", max_retries=5, max_tokens=8000, request_timeout=40, temperature=0.4
-        )
-
-        st.session_state.decisive_model = ChatOpenAI(
-            model_name="gpt-4o-mini",
-            max_retries=5,
-            max_tokens=5000,
-            model_kwargs={"response_format": {"type": "json_object"}},
-            request_timeout=40,
-            temperature=0.2,
-        )
-
-        st.session_state.use_search_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(use_search_system_message_template),
-                MessagesPlaceholder(variable_name="conversation"),
-            ]
-        )
-
-        st.session_state.dynamic_main_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(main_system_message_template),
-                MessagesPlaceholder(variable_name="conversation"),
-            ]
-        )
-
-        st.session_state.conversation = []
-
-        st.session_state.search_decisions_memory = ""
-
-        st.session_state.vector_storage = connect_to_vector_storage("PolandEventInfo")
+        # Check that the vector storage is reachable, the shared clients are created by the first session
+        run_async(get_vector_storage().get_collection())
 
         # Initialize conversation blocking flag
         st.session_state.blocking_conversation = False
-
-        # Initialize the length warning flag
-        st.session_state.length_warning_shown = False
     except Exception as e:
         # Display an error message if the application fails to initialize
         st.error(f"Failed to initialize application! Try refreshing the page. Error: {e}")
@@ -358,13 +1255,6 @@ if not st.session_state.blocking_conversation:
 
             # Run asynchronous function to display response
             display_response(user_prompt)
-
-            # Check whether to show a warning about the length of the conversation
-            if len(st.session_state.conversation) > 110 and not st.session_state.length_warning_shown:
-                st.warning(
-                    "Such a long conversation can result in long waits for answers or reduced accuracy. You can refresh the page and start the conversation again if this is a problem for you."
-                )
-                st.session_state.length_warning_shown = True
         # Handle exceptions from most of the functions
         except Exception as e:
             # Check if the error is due to exceeding the context length of the chatbot